@@ -0,0 +1,334 @@
+#!/usr/bin/env python
+
+"""Running roi luminance histograms of classified frames, bucketed by door state, hour of day and ISO week.
+
+This module keeps one 256-bin histogram per (state, hour, week) bucket and ratchets them up with every frame it
+is fed (live frames from the server, or whole batches from a Deck), so medians and percentiles over any mix of
+buckets come from summing a few 256-bin histograms rather than rescanning images.
+
+The histograms persist in one .npz file. Saving takes an exclusive flock on a lock file next to it, re-reads
+what is on disk, adds in the counts gathered since our last save and swaps the result in via temp file and
+rename, so the server and batch tools can share one file without losing each other's counts (and readers never
+see a partial file).
+
+Keys of counted frames go in an append-only text file next to it (see seen_file), one per line. A save appends
+just the keys counted since the last save and reads back just what other processes appended since, so its cost
+does not grow with the archive.
+
+Buckets of archive frames are labelled by the door state in their filename ("open", "close"). Live frames from
+the server have no label, only the classifier's own verdict, so they go in buckets of their own ("verdict_open",
+"verdict_close"; see verdict_state) and never mix with the labelled ones that percentile and threshold studies
+are built on.
+
+Frames are counted at most once by key (basename by default; live frames have none, see add_verdict). A frame
+fed to two processes between their saves is counted by both.
+
+Example:
+    Add a few days of archive snapshots, then show hourly medians and percentiles per state::
+
+        $ python aggregator.py 2017-11-10 2017-11-17
+
+"""
+
+import os
+import time
+import fcntl
+import datetime
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+from flimsy_constants import DEFAULT_AGGREGATE_FILE
+
+PERCENTILES = range(10, 100, 10)  # roi luminance percentiles (10th, 20th, ... 90th), like features.py
+VERDICT_PREFIX = 'verdict_'        # bucket state of live frames is this plus classifier verdict (not a label)
+
+
+def verdict_state(verdict):
+    """return bucket state for a frame known only by classifier verdict (like "open" -> "verdict_open")"""
+    return VERDICT_PREFIX + verdict
+
+
+def bucket_key(state, dtm):
+    """return 3-tuple (state, hour, week) bucket for frame taken at datetime dtm (week like 2017-W46)"""
+    year, week, weekday = dtm.isocalendar()
+    return state, dtm.hour, '%04d-W%02d' % (year, week)
+
+
+def hist_percentiles(hist, q=PERCENTILES):
+    """Percentiles of the values counted in a 256-bin histogram, in O(256).
+
+    Returns float array like q, same as np.percentile (linear interpolation) of the values themselves would
+    give; nan for an empty histogram.
+    -------
+    Input arguments:
+    hist -- (256,) array of counts for values 0..255
+
+    Keyword arguments:
+    q    -- percentile or sequence of percentiles (0 to 100)
+
+    """
+    cdf = np.cumsum(hist)
+    total = cdf[-1]
+    q = np.asarray(q, dtype=np.float64)
+    if total == 0:
+        return np.full(q.shape, np.nan)
+    pos = q / 100.0 * (total - 1)  # 0-based rank in the sorted values
+    lo, hi = np.floor(pos), np.ceil(pos)
+    # value at 0-based rank r is the first bin whose cumulative count exceeds r
+    vlo = np.searchsorted(cdf, lo + 1).astype(np.float64)
+    vhi = np.searchsorted(cdf, hi + 1).astype(np.float64)
+    return vlo + (vhi - vlo) * (pos - lo)
+
+
+def hist_median(hist):
+    """return float median of the values counted in a 256-bin histogram (same as np.median of the values)"""
+    return float(hist_percentiles(hist, 50))
+
+
+def _merge(into, hists):
+    for key, h in hists.items():
+        if key in into:
+            into[key] = into[key] + h
+        else:
+            into[key] = h.copy()
+
+
+def read_histograms(filename):
+    """return dict (state, hour, week) -> (256,) int64 counts from filename"""
+    with np.load(filename) as npz:
+        keys = zip(npz['states'], npz['hours'], npz['weeks'])
+        hists = dict(((str(s), int(h), str(w)), npz['hists'][i]) for i, (s, h, w) in enumerate(keys))
+    return hists
+
+
+def write_histograms(filename, hists):
+    """write hists (see read_histograms) to filename via temp file and rename"""
+    keys = sorted(hists)
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(prefix='.tmp_', suffix='.npz', dir=dirname)
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, states=np.array([k[0] for k in keys], dtype=str),
+                 hours=np.array([k[1] for k in keys], dtype=np.int8),
+                 weeks=np.array([k[2] for k in keys], dtype=str),
+                 hists=np.array([hists[k] for k in keys], np.int64).reshape(len(keys), 256))
+    os.chmod(tmp, 0644)
+    os.rename(tmp, filename)
+
+
+def seen_file(filename):
+    """return string full path of append-only file of counted frame keys that goes with histograms filename"""
+    return filename + '.seen'
+
+
+def read_seen(filename, offset=0):
+    """Read frame keys appended to seen_file(filename) since byte offset.
+
+    Returns 2-tuple (keys, offset) of set of keys and byte offset to read from next time.
+
+    """
+    name = seen_file(filename)
+    if not os.path.exists(name):
+        return set(), offset
+    with open(name, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    end = data.rfind('\n') + 1  # leave any partly written last line for next time
+    return set(data[:end].split()), offset + end
+
+
+def append_seen(filename, keys):
+    """append frame keys to seen_file(filename), one per line"""
+    if keys:
+        with open(seen_file(filename), 'ab') as f:
+            f.write(''.join('%s\n' % k for k in sorted(keys)))
+
+
+class HistogramAggregator(object):
+
+    """Running 256-bin roi luminance histograms per (state, hour, week) bucket, shared on disk.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, filename=DEFAULT_AGGREGATE_FILE, load=True):
+        self.filename = filename  #: str: full path of .npz file the histograms persist in
+        self.hists = dict()       #: dict: (state, hour, week) -> (256,) int64 counts, saved plus not yet saved
+        self.seen = set()         #: set: keys of frames already counted
+        self.last_save = time.time()  #: float: time.time() of last save (or of creation)
+        self._delta = dict()      # counts added since last save, merged into file on save
+        self._delta_seen = set()
+        self._seen_offset = 0     # bytes of seen file already read into seen
+        self._lock = threading.Lock()
+        if load:
+            if os.path.exists(filename):
+                self.hists = read_histograms(filename)
+            self.seen, self._seen_offset = read_seen(filename)
+
+    def __len__(self):
+        return len(self.hists)
+
+    def __str__(self):
+        return 'HistogramAggregator %s with %d buckets, %d frames (%d unsaved)' % (
+            self.filename, len(self), len(self.seen), len(self._delta_seen))
+
+    def _add(self, key, hist, frame_key):
+        # caller holds _lock
+        for d in (self.hists, self._delta):
+            if key in d:
+                d[key] = d[key] + hist
+            else:
+                d[key] = hist.astype(np.int64)
+        if frame_key is not None:
+            self.seen.add(frame_key)
+            self._delta_seen.add(frame_key)
+
+    def add(self, roi, state, dtm=None, key=None):
+        """Count roi luminance values of one frame into its bucket.
+
+        Returns True if counted, False if a frame with key was already counted.
+        -------
+        Input arguments:
+        roi   -- (h, w) uint8 roi luminance, or (256,) histogram of it
+        state -- string door state to bucket by (the filename's label, or verdict_state of a live frame's verdict)
+
+        Keyword arguments:
+        dtm   -- datetime when frame was taken; None for now
+        key   -- string that identifies the frame (like its basename); None to always count it
+
+        """
+        if roi.shape == (256,):
+            hist = roi
+        else:
+            hist = np.bincount(roi.ravel(), minlength=256)
+        with self._lock:
+            if key is not None and key in self.seen:
+                return False
+            self._add(bucket_key(state, dtm or datetime.datetime.now()), hist, key)
+        return True
+
+    def add_frame(self, fci, state=None):
+        """count FoscamImage, fci (bucketed by state, or else its filename state); returns True if counted"""
+        fcf = fci.foscam_file
+        return self.add(fci.roi_luminance, state or fcf.state, fcf.dtm, key=fcf.bname)
+
+    def add_verdict(self, fci, verdict):
+        """Count unlabelled (live) FoscamImage, fci in buckets of its classifier verdict.
+
+        Returns True (always counted). Live frames come every few seconds but snapshot basenames only go down
+        to the minute, so they are not keyed by name (nor added to seen); each call is a new camera grab.
+
+        """
+        return self.add(fci.roi_luminance, verdict_state(verdict), fci.foscam_file.dtm)
+
+    def add_stack(self, rs):
+        """Count every frame of a roistack.RoiStack (by filename state) with one vectorized histogram pass.
+
+        Returns int number of frames counted (those already counted are skipped).
+
+        """
+        bnames = [os.path.basename(f) for f in rs.filenames]
+        with self._lock:
+            rows = [i for i, b in enumerate(bnames) if b not in self.seen and rs.states[i]]
+            if not rows:
+                return 0
+            hists = rs.histograms()[rows]
+            keys = [bucket_key(rs.states[i], rs.dtms[i].astype(datetime.datetime)) for i in rows]
+            uniq = sorted(set(keys))
+            where = dict((k, j) for j, k in enumerate(uniq))
+            sums = np.zeros((len(uniq), 256), dtype=np.int64)
+            np.add.at(sums, [where[k] for k in keys], hists)  # sum histograms of frames in same bucket
+            for j, key in enumerate(uniq):
+                self._add(key, sums[j], None)
+            for i in rows:
+                self.seen.add(bnames[i])
+                self._delta_seen.add(bnames[i])
+        return len(rows)
+
+    def save(self):
+        """merge counts added since last save into the file (under flock), then take on the merged result"""
+        with self._lock:
+            with open(self.filename + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    if os.path.exists(self.filename):
+                        hists = read_histograms(self.filename)
+                    else:
+                        hists = dict()
+                    _merge(hists, self._delta)
+                    write_histograms(self.filename, hists)
+                    append_seen(self.filename, self._delta_seen)
+                    # pick up keys others appended since we last read (ours too, which we already have)
+                    seen, self._seen_offset = read_seen(self.filename, self._seen_offset)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+            self.hists = hists
+            self.seen |= seen
+            self._delta, self._delta_seen = dict(), set()
+            self.last_save = time.time()
+
+    def maybe_save(self, interval=60.0):
+        """save if there are unsaved counts and interval seconds have passed since last save; returns True if saved"""
+        if self._delta and time.time() - self.last_save >= interval:
+            self.save()
+            return True
+        return False
+
+    def histogram(self, state=None, hours=None, weeks=None):
+        """Sum bucket histograms that match selection; each selector is a value, a list of values, or None for all.
+
+        Returns (256,) int64 counts.
+
+        """
+        def matches(value, sel):
+            return sel is None or value == sel or (isinstance(sel, (list, tuple, set)) and value in sel)
+        total = np.zeros(256, dtype=np.int64)
+        with self._lock:
+            for (s, h, w), hist in self.hists.items():
+                if matches(s, state) and matches(h, hours) and matches(w, weeks):
+                    total += hist
+        return total
+
+    def count(self, **selection):
+        """return int number of roi pixels counted in buckets that match selection (see histogram)"""
+        return int(self.histogram(**selection).sum())
+
+    def median(self, **selection):
+        """return float median roi luminance over buckets that match selection (see histogram)"""
+        return hist_median(self.histogram(**selection))
+
+    def percentiles(self, q=PERCENTILES, **selection):
+        """return float array of roi luminance percentiles q over buckets that match selection (see histogram)"""
+        return hist_percentiles(self.histogram(**selection), q)
+
+    def summary(self, by=('state', 'hour'), q=PERCENTILES):
+        """Summarize buckets grouped by some of state, hour and week.
+
+        Returns pandas.DataFrame indexed by the by fields with pixels (count), median and p<q> columns.
+
+        """
+        fields = ('state', 'hour', 'week')
+        groups = dict()
+        with self._lock:
+            for key, hist in self.hists.items():
+                gkey = tuple(key[fields.index(f)] for f in by)
+                groups[gkey] = groups.get(gkey, 0) + hist
+        rows = []
+        for gkey in sorted(groups):
+            hist = groups[gkey]
+            pcts = hist_percentiles(hist, q)
+            rows.append(list(gkey) + [int(hist.sum()), hist_median(hist)] + list(pcts))
+        columns = list(by) + ['pixels', 'median'] + ['p%d' % p for p in q]
+        return pd.DataFrame(rows, columns=columns).set_index(list(by))
+
+
+if __name__ == '__main__':
+
+    import sys
+    from deck import Deck
+
+    agg = Deck(date_range=sys.argv[1:3], morning=False).aggregate()
+    print agg
+    print agg.summary()
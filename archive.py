@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""An index of the webcam snapshot archive folder.
+
+This module provides a sorted (datetime, state, path) index of Foscam snapshot files that is built once with
+scandir and refreshed incrementally when the folder's mtime changes, so that date-range, morning-only and state
+queries run by bisection instead of listing and parsing the whole folder each time.
+
+Example:
+    Count morning snapshots of open door in a date range::
+
+        $ python archive.py 2017-11-10 2017-11-17
+
+"""
+
+import os
+import time
+import datetime
+import threading
+from bisect import bisect_left
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir  # python 2 backport (pip install scandir)
+
+from fcimage import parse_foscam_fullfilestr
+from flimsy_constants import DEFAULT_FOLDER
+
+_INDEXES = dict()  # topdir -> ArchiveIndex, shared process-wide via get_archive_index
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_archive_index(topdir=DEFAULT_FOLDER):
+    """return the process-wide ArchiveIndex for topdir (built on first use, refreshed on each query)"""
+    key = os.path.abspath(topdir)
+    with _INDEXES_LOCK:
+        if key not in _INDEXES:
+            _INDEXES[key] = ArchiveIndex(key)
+        return _INDEXES[key]
+
+
+class ArchiveIndex(object):
+
+    """A sorted index of Foscam snapshot files in a folder.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, topdir=DEFAULT_FOLDER):
+        self.topdir = topdir      #: str: folder of snapshot files
+        self.scans = 0            #: int: number of times folder was actually (re)scanned
+        self._dir_mtime = None
+        self._scan_time = None
+        self._names = set()       # every name seen in folder (snapshot or not), so we only parse new ones
+        self._entries = []        # sorted list of (dtm, state, path)
+        self._by_state = dict()   # state -> (sorted dtms, entries) for bisection; None key for all states
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return 'ArchiveIndex of %d snapshots in %s' % (len(self), self.topdir)
+
+    def refresh(self):
+        """Rescan folder if its mtime changed since last scan, parsing only names not seen before.
+
+        Returns int number of snapshot entries added or removed.
+
+        """
+        with self._lock:
+            mtime = os.stat(self.topdir).st_mtime
+            # coarse mtime resolution means a file landing in the same second as our last scan leaves mtime as-is
+            if mtime == self._dir_mtime and mtime < self._scan_time - 1.0:
+                return 0
+            self._scan_time = time.time()
+            self._dir_mtime = mtime
+            self.scans += 1
+
+            seen = set()
+            new = []
+            for entry in scandir(self.topdir):
+                seen.add(entry.name)
+                if entry.name in self._names:
+                    continue
+                try:
+                    dtm, state = parse_foscam_fullfilestr(entry.name)
+                except ValueError:
+                    dtm, state = None, None  # like 1999-12-32 that matches pattern, but is not a date
+                if dtm is not None and entry.is_file():
+                    new.append((dtm, state, entry.path))
+
+            removed = self._names - seen
+            self._names = seen
+            if removed:
+                self._entries = [e for e in self._entries if os.path.basename(e[2]) not in removed]
+            if new:
+                self._entries.extend(new)
+                self._entries.sort()  # timsort is near linear for already-sorted run plus appended run
+            if new or removed:
+                self._reindex()
+            return len(new) + len(removed)
+
+    def _reindex(self):
+        self._by_state = dict()
+        groups = {None: self._entries}
+        for e in self._entries:
+            groups.setdefault(e[1], []).append(e)
+        for state, entries in groups.items():
+            self._by_state[state] = ([e[0] for e in entries], entries)
+
+    def query(self, start, stop, morning=False, state=None):
+        """Get snapshot filenames in date range.
+
+        Returns list of full path filenames sorted by timestamp.
+        -------
+        Input arguments:
+        start -- datetime.date of first day of range
+        stop  -- datetime.date of last day of range (inclusive)
+
+        Keyword arguments:
+        morning -- bool True for just files with hour < 12
+        state   -- string state (open or close); None for don't care
+
+        """
+        self.refresh()
+        dtms, entries = self._by_state.get(state, ([], []))
+        midnight, noon = datetime.time(0), datetime.time(12)
+        if morning:
+            # bisect each day's [midnight, noon) separately
+            out = []
+            day = start
+            while day <= stop:
+                lo = bisect_left(dtms, datetime.datetime.combine(day, midnight))
+                hi = bisect_left(dtms, datetime.datetime.combine(day, noon))
+                out.extend(e[2] for e in entries[lo:hi])
+                day += datetime.timedelta(days=1)
+            return out
+        lo = bisect_left(dtms, datetime.datetime.combine(start, midnight))
+        hi = bisect_left(dtms, datetime.datetime.combine(stop + datetime.timedelta(days=1), midnight))
+        return [e[2] for e in entries[lo:hi]]
+
+    def latest(self, state=None):
+        """return 3-tuple (dtm, state, path) of most recent snapshot (of state, if given); None if there is none"""
+        self.refresh()
+        dtms, entries = self._by_state.get(state, ([], []))
+        if not entries:
+            return None
+        return entries[-1]
+
+
+if __name__ == '__main__':
+
+    import sys
+    from argparser import date_str
+
+    start, stop = date_str(sys.argv[1]), date_str(sys.argv[2])
+    idx = get_archive_index()
+    print idx
+    print '%d morning open snapshots from %s to %s' % (len(idx.query(start, stop, morning=True, state='open')),
+                                                       start, stop)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""Benchmark the FoscamImage processing chain with and without per-instance stage caching.
+
+Example:
+    Time the typical per-image workload over the images in the data folder::
+
+        $ python bench_fcimage.py data/2017*.jpg
+
+"""
+
+import sys
+import glob
+import timeit
+import numpy as np
+
+import decoder
+import matcher
+from fcimage import FoscamImage
+
+
+def typical_workload(fci, uncached=False):
+    """do what Deck and AnalysisResults do per image; uncached=True emulates the old never-assigned backing fields"""
+    steps = [
+        lambda: np.median(fci.roi_luminance),
+        lambda: fci.get_hist(),
+        lambda: fci.roi_vertices,
+        lambda: np.percentile(fci.roi_luminance, [10, 50, 90]),
+        ]
+    for step in steps:
+        if uncached:
+            fci.invalidate()
+        step()
+
+
+def bench(fnames, repeat=3):
+    """return dict of best-of-repeat seconds per image for uncached, cached and cached roi-only runs"""
+    results = dict()
+    for label, uncached, roi_only in [('uncached', True, False), ('cached', False, False), ('roi_only', False, True)]:
+        def run():
+            for fname in fnames:
+                typical_workload(FoscamImage(fname, roi_only=roi_only), uncached=uncached)
+        best = min(timeit.repeat(run, number=1, repeat=repeat))
+        results[label] = best / len(fnames)
+    return results
+
+
+def bench_decode(fnames, repeat=3):
+    """return dict of decode mode -> best-of-repeat seconds per image for roi-only median"""
+    results = dict()
+    for mode in sorted(decoder.DECODE_MODES.keys()):
+        def run():
+            for fname in fnames:
+                np.median(FoscamImage(fname, roi_only=True, decode=mode).roi_luminance)
+        results[mode] = min(timeit.repeat(run, number=1, repeat=repeat)) / len(fnames)
+    return results
+
+
+def bench_search(fnames, repeat=3):
+    """return dict of template search method -> best-of-repeat seconds per image (on already-decoded luminance)"""
+    lums = [FoscamImage(fname) for fname in fnames]
+    lums = [(fci.lab[0], fci.template) for fci in lums]
+    results = dict()
+    for method, func in sorted(matcher.SEARCH_METHODS.items()):
+        def run():
+            for L, template in lums:
+                func(L, template)
+        results[method] = min(timeit.repeat(run, number=1, repeat=repeat)) / len(fnames)
+    return results
+
+
+def show_cache_info(fname):
+    fci = FoscamImage(fname)
+    typical_workload(fci)
+    for stage in FoscamImage.STAGES:
+        hits, misses = fci.cache_info()[stage]
+        print '%16s: %d hits, %d misses' % (stage, hits, misses)
+
+
+if __name__ == '__main__':
+
+    fnames = sys.argv[1:] or glob.glob('data/2017*.jpg')
+    res = bench(fnames)
+    print 'uncached: %.1f ms per image' % (1000.0 * res['uncached'])
+    print '  cached: %.1f ms per image' % (1000.0 * res['cached'])
+    print ' speedup: %.1fx' % (res['uncached'] / res['cached'])
+    print 'roi_only: %.1f ms per image' % (1000.0 * res['roi_only'])
+    print ' speedup: %.1fx' % (res['uncached'] / res['roi_only'])
+    for mode, sec in sorted(bench_decode(fnames).items(), key=lambda x: x[1]):
+        print '%9s: %.1f ms per image (roi-only median)' % (mode, 1000.0 * sec)
+    for method, sec in sorted(bench_search(fnames).items(), key=lambda x: x[1]):
+        print '%9s: %.1f ms per image (template search)' % (method, 1000.0 * sec)
+    show_cache_info(fnames[0])
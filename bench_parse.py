@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Micro-benchmark foscam filename parsing: fixed-format slicing parser vs. old dateutil parser vs. batch parser.
+
+Example:
+    Parse 100,000 synthetic snapshot names each way::
+
+        $ python bench_parse.py 100000
+
+"""
+
+import os
+import re
+import sys
+import timeit
+import datetime
+from dateutil import parser
+
+from fcimage import parse_foscam_fullfilestr, parse_foscam_filenames
+from flimsy_constants import BASENAME_PATTERN
+
+
+def parse_foscam_fullfilestr_dateutil(fullfilestr, bname_pattern=BASENAME_PATTERN):
+    """the way we used to do it (regex match, then compile and search, then fuzzy dateutil parse)"""
+    dtm = None
+    state = None
+    bname = os.path.basename(fullfilestr)
+    if re.match(bname_pattern, bname):
+        p = re.compile(bname_pattern)
+        m = p.search(bname)
+        state = m.group('state')
+        dtm = parser.parse(m.group('day') + ' ' + m.group('hour') + ':' + m.group('minute'))
+    return dtm, state
+
+
+def synthetic_names(n, topdir='/home/pi/Pictures/foscam'):
+    """return list of n once-a-minute snapshot names"""
+    t0 = datetime.datetime(2017, 11, 1)
+    states = ['open', 'close']
+    return [os.path.join(topdir, (t0 + datetime.timedelta(minutes=i)).strftime('%Y-%m-%d_%H_%M_') + states[i % 2] +
+                         '.jpg') for i in range(n)]
+
+
+def bench(names, repeat=3):
+    """return dict of best-of-repeat microseconds per name for each parser"""
+    runs = [
+        ('dateutil', lambda: [parse_foscam_fullfilestr_dateutil(f) for f in names]),
+        ('sliced', lambda: [parse_foscam_fullfilestr(f) for f in names]),
+        ('batch', lambda: parse_foscam_filenames(names)),
+        ]
+    results = dict()
+    for label, run in runs:
+        results[label] = 1e6 * min(timeit.repeat(run, number=1, repeat=repeat)) / len(names)
+    return results
+
+
+if __name__ == '__main__':
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    names = synthetic_names(n)
+
+    # sanity check that all three agree before timing them
+    dtms, states = parse_foscam_filenames(names[:100])
+    for f, dtm64, st in zip(names[:100], dtms, states):
+        assert parse_foscam_fullfilestr_dateutil(f) == parse_foscam_fullfilestr(f) == (dtm64.astype(datetime.datetime), st)
+
+    res = bench(names)
+    for label in ['dateutil', 'sliced', 'batch']:
+        print '%8s: %6.2f us per name (%.0fx)' % (label, res[label], res['dateutil'] / res[label])
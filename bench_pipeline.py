@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+"""Benchmark each stage of the snapshot-to-verdict pipeline and the Deck throughput.
+
+This module times, per image, the stages that turn a Foscam snapshot into an open/close verdict (decode, LAB
+conversion, template match, blur and CLAHE, roi luminance, median) plus the roi-only path that
+AnalysisResults.compute takes. It reports p50/p95 per stage and images per second for Deck.map over the
+data folder and over synthetic, scaled-up copies of it, and saves results as JSON keyed by git commit so runs
+from different commits can be compared.
+
+Example:
+    Time the data folder and a 10x synthetic corpus, save results, then compare against an earlier run::
+
+        $ python bench_pipeline.py --scale 10 --json /tmp/bench_new.json
+        $ python bench_pipeline.py --scale 10 --compare /tmp/bench_old.json
+
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import tempfile
+import datetime
+import platform
+import subprocess
+import cv2
+import numpy as np
+
+import matcher
+from deck import Deck, roi_verdict
+from fcimage import FoscamImage, FoscamFile
+from flimsy_constants import DEFAULT_TEMPLATE
+from fauxmo_garage.macpisocket.async_socket_common import AnalysisResults
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+#: stage name -> function(fci) that does just that stage's work (earlier stages already cached on fci)
+STAGES = [
+    ('imread',         lambda fci: fci.image),
+    ('lab',            lambda fci: fci.lab),
+    ('match_template', lambda fci: fci.template_match),
+    ('blur_clahe',     lambda fci: fci.processed_image),
+    ('roi_luminance',  lambda fci: fci.roi_luminance),
+    ('median',         lambda fci: np.median(fci.roi_luminance)),
+]
+
+
+def git_commit():
+    """return string like abc1234 (or abc1234-dirty) for the checked out commit; 'unknown' outside of git"""
+    try:
+        out = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=_HERE,
+                                      stderr=open(os.devnull, 'w'))
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return out.strip()
+
+
+def summarize(seconds):
+    """return dict of n, p50 and p95 (in milliseconds) for list of durations in seconds"""
+    ms = 1000.0 * np.asarray(seconds)
+    return {'n': len(ms), 'p50': float(np.percentile(ms, 50)), 'p95': float(np.percentile(ms, 95))}
+
+
+def analysis_verdict(fname, tmp_name=DEFAULT_TEMPLATE):
+    """run AnalysisResults.compute (the server's roi-only verdict) on snapshot fname; returns (state, median)"""
+    ar = AnalysisResults(FoscamImage(fname, template=tmp_name, roi_only=True))
+    ar.compute()
+    return ar.state, ar.median
+
+
+def time_stages(fnames, tmp_name=DEFAULT_TEMPLATE, repeat=3):
+    """Time each pipeline stage on each image.
+
+    Returns dict of stage name -> summarize() dict; 'analysis' is the end-to-end roi-only verdict.
+    -------
+    Input arguments:
+    fnames -- list of full path snapshot filenames
+
+    Keyword arguments:
+    tmp_name -- string full filename of template image
+    repeat   -- int times through the whole list of files
+
+    """
+    durations = dict((name, []) for name, func in STAGES)
+    durations['analysis'] = []
+    for i in range(repeat):
+        for fname in fnames:
+            fci = FoscamImage(fname, template=tmp_name)
+            for name, func in STAGES:
+                t1 = time.time()
+                func(fci)
+                durations[name].append(time.time() - t1)
+            t1 = time.time()
+            analysis_verdict(fname, tmp_name=tmp_name)
+            durations['analysis'].append(time.time() - t1)
+    return dict((name, summarize(sec)) for name, sec in durations.items())
+
+
+def time_snaps(ini_file, count=5):
+    """time count snapshots from live camera configured by ini_file (see macpisocket.foscam_snap)"""
+    from macpisocket.foscam_snap import FoscamSnap
+    fcsnap = FoscamSnap(ini_file)
+    durations = []
+    for i in range(count):
+        t1 = time.time()
+        fname = fcsnap.snap_picture('bench')
+        durations.append(time.time() - t1)
+        os.remove(fname)
+    return summarize(durations)
+
+
+def make_synthetic_corpus(fnames, outdir, copies):
+    """Fill outdir with copies of snapshot files renamed to later (unique) timestamps.
+
+    Returns 2-tuple of datetime.date for first and last day of the synthetic corpus.
+    -------
+    Input arguments:
+    fnames -- list of full path snapshot filenames (must parse as FoscamFile)
+    outdir -- string for existing output folder
+    copies -- int number of copies of the whole set of fnames
+
+    """
+    files = [FoscamFile(f) for f in fnames]
+    first = min(f.dtm for f in files)
+    span = (max(f.dtm for f in files) - first).days + 1
+    for k in range(copies):
+        shift = datetime.timedelta(days=k * span)
+        for f in files:
+            bname = (f.dtm + shift).strftime('%Y-%m-%d_%H_%M') + '_' + f.state + '.jpg'
+            dest = os.path.join(outdir, bname)
+            try:
+                os.link(f.filename, dest)
+            except OSError:
+                shutil.copy(f.filename, dest)
+    return first.date(), (first + datetime.timedelta(days=copies * span - 1)).date()
+
+
+def time_deck(basedir, date_range, tmp_name=DEFAULT_TEMPLATE, workers=(1, None)):
+    """return dict of workers label -> {n, sec, images_per_sec} for Deck.map(roi_verdict) over date range"""
+    results = dict()
+    for w in workers:
+        deck = Deck(basedir=basedir, date_range=[str(d) for d in date_range], morning=False, tmp_name=tmp_name)
+        t1 = time.time()
+        n = len(deck.map(roi_verdict, workers=w))
+        sec = time.time() - t1
+        results['workers=%s' % (w or 'all')] = {'n': n, 'sec': sec, 'images_per_sec': n / sec}
+    return results
+
+
+def run(data_dir, tmp_name=DEFAULT_TEMPLATE, scale=0, repeat=3, ini_file=None):
+    """run whole benchmark; returns JSON-ready dict of results"""
+    fnames = sorted(glob.glob(os.path.join(data_dir, '2017*.jpg')))
+    results = {
+        'commit': git_commit(),
+        'when': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+        'corpus': {'data': len(fnames)},
+        'stages': time_stages(fnames, tmp_name=tmp_name, repeat=repeat),
+        'deck': dict(),
+        }
+    if ini_file:
+        results['stages']['snap_picture'] = time_snaps(ini_file)
+    files = [FoscamFile(f) for f in fnames]
+    days = (min(f.dtm for f in files).date(), max(f.dtm for f in files).date())
+    results['deck']['data'] = time_deck(data_dir, days, tmp_name=tmp_name)
+    if scale:
+        outdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+        try:
+            days = make_synthetic_corpus(fnames, outdir, scale)
+            results['corpus']['synthetic'] = len(fnames) * scale
+            results['deck']['synthetic'] = time_deck(outdir, days, tmp_name=tmp_name)
+        finally:
+            shutil.rmtree(outdir)
+    return results
+
+
+def show(results, baseline=None):
+    """print results (and ratio to baseline results' p50 and images/sec, if given)"""
+    print 'commit %s on python %s, opencv %s, %d cpus' % (results['commit'], results['python'], results['opencv'],
+                                                        results['cpus'])
+    if baseline:
+        print 'compared to commit %s (ratio is new / old)' % baseline['commit']
+    for name, st in sorted(results['stages'].items(), key=lambda x: -x[1]['p50']):
+        line = '%16s: p50 %7.2f ms  p95 %7.2f ms  (n=%d)' % (name, st['p50'], st['p95'], st['n'])
+        if baseline and name in baseline['stages']:
+            line += '  x%.2f' % (st['p50'] / baseline['stages'][name]['p50'])
+        print line
+    for corpus, runs in sorted(results['deck'].items()):
+        for label, r in sorted(runs.items()):
+            line = '%16s: %7.1f images/sec %s (n=%d)' % (corpus, r['images_per_sec'], label, r['n'])
+            try:
+                line += '  x%.2f' % (r['images_per_sec'] / baseline['deck'][corpus][label]['images_per_sec'])
+            except (TypeError, KeyError):
+                pass
+            print line
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='benchmark the snapshot-to-verdict pipeline')
+    parser.add_argument('--data', default=os.path.join(_HERE, 'data'), help='folder of snapshot files')
+    parser.add_argument('--template', default=DEFAULT_TEMPLATE, help='template image file')
+    parser.add_argument('--scale', type=int, default=0, help='copies of data in synthetic corpus (0 for none)')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over data for per-stage timing')
+    parser.add_argument('--ini', default=None, help='cgi_snap ini file to also time live snap_picture')
+    parser.add_argument('--json', default=None, help='save results to this JSON file')
+    parser.add_argument('--compare', default=None, help='JSON file of earlier results to compare against')
+    args = parser.parse_args()
+
+    res = run(args.data, tmp_name=args.template, scale=args.scale, repeat=args.repeat, ini_file=args.ini)
+    old = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+    show(res, baseline=old)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(res, f, indent=2, sort_keys=True)
+        print 'saved %s' % args.json
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import cv2
 import numpy as np
@@ -7,6 +8,7 @@ import matcher
 import disp
 from matplotlib import pyplot as plt
 import matplotlib.mlab as mlab
+from fcimage import parse_foscam_fullfilestr, FoscamImage
 from flimsy_constants import DOOR_OFFSETXY_WH, TARG_OFFSETXY_WH
 
 # TODO canvas/look at histograms to get a feel for what those look like with a few param changes
@@ -104,7 +106,7 @@ def flood_fill(img):
     return img2
 
 
-def main_chain(img_name, template_name, blursize=5, cliplim=3.0, gridsize=8):
+def main_chain(img_name, template_name, blursize=5, cliplim=3.0, gridsize=8, aggregator=None):
     
     # FIXME what if foscam moves, then blind offset-from-template method will not work robustly, will it?
     # apply blurring and CLAHE to small (skinny garage door) roi
@@ -126,10 +128,14 @@ def main_chain(img_name, template_name, blursize=5, cliplim=3.0, gridsize=8):
     
     # FIXME we may not always want histogram plot (maybe just during "gather")
     
-    # TODO with each image file, always ratchet up a running sum type of histogram OR db each for future summing
-    
-    # TODO always put percentiles (10th, 20th, 30th, ... 90th) into db table!?
-    
+    # ratchet up running histograms for future summing (percentiles come from those; see aggregator.py)
+    if aggregator is not None:
+        dtm, state = parse_foscam_fullfilestr(img_name)
+        # histogram the roi_only luminance the verdict paths classify, not this full-frame sgd (a count or two off)
+        roi = FoscamImage(img_name, template=template_name, roi_only=True).roi_luminance
+        aggregator.add(roi, state, dtm, key=os.path.basename(img_name))
+        aggregator.maybe_save()  # at most once a minute; caller does aggregator.save() once done with its batch
+
     # percentiles
     percs = mlab.prctile([sgd], p=np.arange(10.0, 100.0, 10.0))
     print percs    
@@ -12,40 +12,29 @@ Todo:
 
 import os
 import random
+import multiprocessing
 import numpy as np
 from matplotlib import pyplot as plt
 import pandas as pd
 
-from template import GrayscaleTemplateImage
+from template import GrayscaleTemplateImage, as_template_image, get_template_image
 from fcimage import FoscamImage, get_date_range_foscam_files
 from flimsy_constants import DEFAULT_FOLDER, DEFAULT_TEMPLATE, DAYONE, MEDIAN_THRESHOLD
 
 
 class FoscamImageIterator(object):
 
-    def __init__(self, filenames, template=DEFAULT_TEMPLATE):
+    def __init__(self, filenames, template=DEFAULT_TEMPLATE, roi_only=False):
         self.filenames = filenames
         self._template = template
+        self.roi_only = roi_only
         self.current = 0
         self.max = len(filenames) - 1
 
     @property
     def template(self):
         """numpy.ndarray: Array (h, w) of template image (grayscale)"""
-        if self._template is None:
-            # is None, so use default template
-            tmp = GrayscaleTemplateImage(DEFAULT_TEMPLATE)
-            return tmp.image
-        elif isinstance(self._template, np.ndarray):
-            # type is numpy array, so just return it
-            return self._template
-        elif isinstance(self._template, str):
-            # type is str, so read from string filename
-            tmp = GrayscaleTemplateImage(self._template)
-            return tmp.image
-        elif isinstance(self._template, GrayscaleTemplateImage):
-            # type is GrayscaleTemplateImage, so return image part of object
-            return self._template.image
+        return as_template_image(self._template)
 
     def __iter__(self):
         return self
@@ -55,7 +44,81 @@ class FoscamImageIterator(object):
             raise StopIteration
         else:
             self.current += 1
-            return FoscamImage(self.filenames[self.current - 1], template=self.template)
+            return FoscamImage(self.filenames[self.current - 1], template=self.template, roi_only=self.roi_only)
+
+
+_WORKER = dict()  # per-process state for map_images workers (template is loaded once per worker)
+
+
+def _init_worker(tmp_name, fci_kwargs):
+    """pool initializer: load template once into this worker process"""
+    _WORKER['template'] = get_template_image(tmp_name)
+    _WORKER['fci_kwargs'] = fci_kwargs
+
+
+def _apply_to_image(func_fname):
+    func, fname = func_fname
+    fci = FoscamImage(fname, template=_WORKER['template'], **_WORKER['fci_kwargs'])
+    return func(fci)
+
+
+def map_images(func, filenames, tmp_name=DEFAULT_TEMPLATE, workers=None, chunksize=None, **fci_kwargs):
+    """Apply func to a FoscamImage for each of filenames, fanned out over a process pool.
+
+    Returns list of func results in the same order as filenames.
+    -------
+    Input arguments:
+    func      -- module-level (picklable) function that takes a FoscamImage, like roi_median or roi_hist
+    filenames -- list of full path image filenames
+
+    Keyword arguments:
+    tmp_name  -- string for full path to template image (read once per worker)
+    workers   -- int number of worker processes; None for cpu count, 1 to run serially in this process
+    chunksize -- int number of images handed to a worker at a time; None to pick ~4 chunks per worker
+
+    Other keyword arguments (like roi_only, decode, blursize, cliplim, gridsize) are passed to FoscamImage;
+    roi_only defaults to True (fast classification mode).
+
+    """
+    fci_kwargs.setdefault('roi_only', True)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    tasks = [(func, fname) for fname in filenames]
+
+    if workers == 1 or len(tasks) < 2:
+        _init_worker(tmp_name, fci_kwargs)
+        return [_apply_to_image(task) for task in tasks]
+
+    if chunksize is None:
+        chunksize = max(1, len(tasks) // (4 * workers))
+    pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(tmp_name, fci_kwargs))
+    try:
+        # imap hands out chunks and gives results back in input order
+        results = list(pool.imap(_apply_to_image, tasks, chunksize))
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def roi_median(fci):
+    """return median of roi luminance for FoscamImage, fci"""
+    return np.median(fci.roi_luminance)
+
+
+def roi_hist(fci):
+    """return (256, 1) histogram of roi luminance for FoscamImage, fci"""
+    return fci.get_hist()
+
+
+def roi_verdict(fci):
+    """return 3-tuple (filename state, guessed state, median) for FoscamImage, fci"""
+    med = roi_median(fci)
+    if med < MEDIAN_THRESHOLD:
+        guess = 'open'
+    else:
+        guess = 'close'
+    return fci.foscam_file.state, guess, med
 
 
 class DateRangeException(Exception):
@@ -66,17 +129,20 @@ class DateRangeException(Exception):
 # TODO maybe Deck gets smarter; uses different templates for each constituent images based on overall light/darkness
 class Deck(object):
 
-    def __init__(self, basedir=DEFAULT_FOLDER, date_range=None, morning=True, state=None, tmp_name=None, verbose=False):
+    def __init__(self, basedir=DEFAULT_FOLDER, date_range=None, morning=True, state=None, tmp_name=None, verbose=False,
+                 cube=None):
         self._set_basedir(basedir)
         self._set_date_range(date_range)
         self._set_morning(morning)
         self._set_state(state)
         self._set_tmp_name(tmp_name)
         self._set_verbose(verbose)
+        self._set_cube(cube)
         self._images = None
+        self._filenames = None
 
     def __len__(self):
-        return len(self.images)
+        return len(self.filenames)
 
     @property
     def basedir(self):
@@ -155,19 +221,42 @@ class Deck(object):
                 raise TypeError('Deck.tmp_name template file "%s" does not exist' % value)
         self._tmp_name = value
 
+    @property
+    def cube(self):
+        """roicube.RoiCube: cube that serves roi luminance (opened on first use); None to decode images"""
+        if isinstance(self._cube, str):
+            from roicube import RoiCube
+            self._cube = RoiCube(self._cube)
+        return self._cube
+
+    def _set_cube(self, value):
+        if isinstance(value, str) and not os.path.exists(value):
+            raise ValueError('Deck.cube file "%s" does not exist (see roicube.build_cube)' % value)
+        self._cube = value
+
     def _get_filenames(self):
         """get list of filenames"""
         start = self.date_range[0].to_pydatetime().date()
         stop = self.date_range[-1].to_pydatetime().date()
-        _filenames = get_date_range_foscam_files(start, stop, morning=self.morning)
-        if self.state:           
-            [_filenames.remove(f) for f in _filenames if self.state not in f]
+        _filenames = get_date_range_foscam_files(start, stop, morning=self.morning, state=self.state,
+                                                 topdir=self.basedir)
         _filenames.sort(key=os.path.basename)
         return _filenames
 
+    @property
+    def filenames(self):
+        """list: sorted full path filenames of images in the deck"""
+        if self._filenames is None:
+            self._filenames = self._get_filenames()
+        return self._filenames
+
     @property
     def images(self):
         """Get foscam image iterator."""
+        return self.get_images()
+
+    def get_images(self, roi_only=False):
+        """Get foscam image iterator; roi_only=True for fast classification mode (roi_luminance only)."""
         if self._images:
             return self._images
 
@@ -177,22 +266,116 @@ class Deck(object):
         else:
             tmp = GrayscaleTemplateImage(DEFAULT_TEMPLATE)
 
+        # in cube mode, roi_luminance of each image is a view into the cube (no decode)
+        if self.cube is not None:
+            return (self.cube.fcimage(f, template=tmp) for f in self.filenames)
+
         # return iterator object
-        fnames = self._get_filenames()
-        return FoscamImageIterator(fnames, template=tmp)
-    
+        return FoscamImageIterator(self.filenames, template=tmp, roi_only=roi_only)
+
+    def map(self, func, workers=None, chunksize=None, **fci_kwargs):
+        """Apply func to each image in the deck over a process pool; returns results in filename order.
+
+        See map_images for arguments; func must be a module-level function that takes a FoscamImage.
+
+        """
+        return map_images(func, self.filenames, tmp_name=self.tmp_name, workers=workers, chunksize=chunksize,
+                          **fci_kwargs)
+
+    def features(self, store=None, workers=None, chunksize=None):
+        """Get per-image features for the deck from a feature store, computing only rows it is missing.
+
+        Returns pandas.DataFrame indexed by basename (see features.FeatureStore.get).
+
+        Keyword arguments:
+        store -- features.FeatureStore; None for one at the default location using the deck's template
+
+        """
+        from features import FeatureStore
+        if store is None:
+            store = FeatureStore(tmp_name=self.tmp_name)
+        return store.features(self.filenames, workers=workers, chunksize=chunksize)
+
+    def roi_stack(self, workers=None, chunksize=None):
+        """Get roi luminance of every image in the deck stacked into one (N, h, w) array.
+
+        Returns roistack.RoiStack (see there for its vectorized medians, percentiles and histograms); in cube
+        mode its stack comes from the cube, a zero-copy view when the deck's images are consecutive cube rows.
+
+        """
+        if self.cube is not None:
+            return self.cube.roi_stack(self.filenames)
+        from roistack import RoiStack
+        return RoiStack.from_files(self.filenames, tmp_name=self.tmp_name, workers=workers, chunksize=chunksize)
+
+    def batch_stats(self, workers=None, chunksize=None):
+        """return pandas.DataFrame of per-image roi stats indexed by timestamp (see roistack.RoiStack.stats)"""
+        return self.roi_stack(workers=workers, chunksize=chunksize).stats()
+
+    def aggregate(self, aggregator=None, workers=None, chunksize=None):
+        """Count the deck's images into running roi histograms (skipping ones already counted) and save them.
+
+        Returns aggregator.HistogramAggregator (the one given, or None for one at the default location).
+
+        """
+        from aggregator import HistogramAggregator
+        from roistack import RoiStack
+        if aggregator is None:
+            aggregator = HistogramAggregator()
+        todo = [f for f in self.filenames if os.path.basename(f) not in aggregator.seen]
+        if todo:
+            if self.cube is not None:
+                rs = self.cube.roi_stack(todo)
+            else:
+                rs = RoiStack.from_files(todo, tmp_name=self.tmp_name, workers=workers, chunksize=chunksize)
+            if aggregator.add_stack(rs):
+                aggregator.save()
+        return aggregator
+
+    def threshold_features(self, filenames=None, workers=None, chunksize=None):
+        """return pandas.DataFrame of threshold.threshold_features rows for filenames (None for whole deck)"""
+        from threshold import threshold_features
+        if filenames is None:
+            filenames = self.filenames
+        rows = map_images(threshold_features, filenames, tmp_name=self.tmp_name, workers=workers, chunksize=chunksize)
+        return pd.DataFrame(rows, columns=['bname', 'dtm', 'state', 'median', 'hour', 'brightness'])
+
+    def calibrate_thresholds(self, engine=None, workers=None, chunksize=None):
+        """Recalibrate learned thresholds with the deck's labelled images not yet counted, and save them.
+
+        Returns threshold.ThresholdEngine (the one given, or None for one at the default location).
+
+        """
+        from threshold import ThresholdEngine
+        if engine is None:
+            engine = ThresholdEngine()
+        todo = [f for f in self.filenames if os.path.basename(f) not in engine.seen]
+        if todo and engine.add_many(self.threshold_features(todo, workers=workers, chunksize=chunksize)):
+            engine.save()
+        return engine
+
+    def threshold_report(self, engine=None, workers=None, chunksize=None):
+        """return pandas.DataFrame of learned vs fixed threshold accuracy on the deck (see ThresholdEngine.report)"""
+        from threshold import ThresholdEngine
+        if engine is None:
+            engine = ThresholdEngine()
+        return engine.report(self.threshold_features(workers=workers, chunksize=chunksize))
+
+    def evaluate_template_methods(self, workers=None, chunksize=None):
+        """return pandas.DataFrame of every matchTemplate method and level on the deck (see template_eval.evaluate)"""
+        from template_eval import evaluate
+        return evaluate(self.filenames, tmp_name=self.tmp_name, workers=workers, chunksize=chunksize)
+
     def random_draw(self):
-        fcimage = random.choice(self.images)
+        fcimage = FoscamImage(random.choice(self.filenames), template=self.tmp_name)
         return fcimage
     
-    def overlay_roi_histograms(self):
-        hopen = np.zeros((256, 1))
-        hclose = np.zeros((256, 1))
-        for fci in self.images:
-            if 'open' in os.path.basename(fci.foscam_file.filename):
-                hopen += fci.get_hist()
-            else:
-                hclose += fci.get_hist()
+    def overlay_roi_histograms(self, workers=None, chunksize=None):
+        rs = self.roi_stack(workers=workers, chunksize=chunksize)
+        hists = rs.histograms()
+        is_open = rs.states == 'open'
+        hopen = hists[is_open].sum(axis=0)
+        hclose = hists[~is_open].sum(axis=0)
         #    plt.plot(h, color=c, alpha=0.6)
         #    print fci.foscam_file.filename, type(h)
         #plt.xlim([0, 256])
@@ -202,17 +385,13 @@ class Deck(object):
         plt.xlim([0, 256])
         plt.show()
     
-    def show_roi_luminance_medians(self):
-        for fci in self.images:
-            med = np.median(fci.roi_luminance)
-            if med < MEDIAN_THRESHOLD:
-                guess = 'open'
-            else:
-                guess = 'close'
-            if not fci.foscam_file.state == guess:
-                print 'open -a Firefox file://%s # OOPS!' % fci.img_name
+    def show_roi_luminance_medians(self, workers=None, chunksize=None):
+        df = self.batch_stats(workers=workers, chunksize=chunksize)
+        for fname, state, guess, med in zip(df['fname'], df['state'], df['verdict'], df['median']):
+            if not state == guess:
+                print 'open -a Firefox file://%s # OOPS!' % fname
             else:
-                print med, fci.img_name
+                print med, fname
 
 
 if __name__ == '__main__':
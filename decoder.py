@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""Decode Foscam JPEG snapshots at only the resolution and extent that the analysis needs.
+
+This module provides a decoding layer so a FoscamImage can skip work that full-resolution color decoding does.
+
+The "rows" modes exploit the fact that Foscam snapshots are baseline JPEGs: patching the frame height in the
+SOF segment makes libjpeg stop entropy decoding after the MCU rows that cover the template search band and
+the skinny garage door, so the bottom of the frame is never decoded. The scan data for the rest of the frame
+stays in the buffer, but the end-of-image (EOI) marker is dropped: libjpeg then runs out of input while skipping
+that tail and quietly stops, rather than finding EOI and warning "Corrupt JPEG data: N extraneous bytes before
+marker 0xd9" on stderr for every frame.
+
+Todo:
+    * Progressive JPEGs fall back to a full decode (camera does not produce them so far)
+
+"""
+
+import os
+import struct
+
+import cv2
+import numpy as np
+
+import tracing
+from flimsy_constants import ROI_DECODE_ROWS
+
+
+DECODE_MODES = {
+    # mode          imread flag                    scale  top rows only
+    'color':       (cv2.IMREAD_COLOR,              1,     False),
+    'gray':        (cv2.IMREAD_GRAYSCALE,          1,     False),
+    'reduced2':    (cv2.IMREAD_REDUCED_COLOR_2,    2,     False),
+    'reduced4':    (cv2.IMREAD_REDUCED_COLOR_4,    4,     False),
+    'rows':        (cv2.IMREAD_COLOR,              1,     True),
+    'rows_gray':   (cv2.IMREAD_GRAYSCALE,          1,     True),
+}
+
+_BASELINE_SOF_MARKERS = ('\xc0', '\xc1')  # SOF0 baseline, SOF1 extended sequential (both are single-scan)
+
+
+def decode_scale(mode):
+    """return int downscale factor (1, 2 or 4) for decode mode"""
+    return _mode_params(mode)[1]
+
+
+def is_grayscale(mode):
+    """return True if decode mode yields (h, w) grayscale instead of (h, w, 3) color"""
+    return _mode_params(mode)[0] == cv2.IMREAD_GRAYSCALE
+
+
+def _mode_params(mode):
+    try:
+        return DECODE_MODES[mode]
+    except KeyError:
+        raise ValueError('decode mode "%s" is not among %s' % (mode, sorted(DECODE_MODES.keys())))
+
+
+def find_sof(data):
+    """Walk JPEG marker segments up to the first scan and locate the start-of-frame segment.
+
+    Returns 2-tuple (offset, marker) of SOF segment in data (offset is of the 0xFF byte); (None, None) if not found.
+
+    """
+    if data[0:2] != '\xff\xd8':
+        return None, None
+    i = 2
+    n = len(data)
+    while i + 4 <= n:
+        if data[i] != '\xff':
+            return None, None
+        marker = data[i + 1]
+        if marker == '\xff':
+            i += 1  # fill byte
+            continue
+        if marker == '\xda':
+            return None, None  # reached start of scan without seeing a frame header
+        if '\xc0' <= marker <= '\xcf' and marker not in ('\xc4', '\xc8', '\xcc'):
+            return i, marker
+        seglen = struct.unpack('>H', data[i + 2:i + 4])[0]
+        i += 2 + seglen
+    return None, None
+
+
+def crop_rows(data, rows):
+    """Return copy of baseline JPEG data whose frame header claims only the top rows (or data as-is if it cannot).
+
+    The copy has no EOI marker, so libjpeg stops at the end of the data instead of warning about the undecoded
+    rest of the scan (see module docstring).
+
+    """
+    offset, marker = find_sof(data)
+    if offset is None or marker not in _BASELINE_SOF_MARKERS:
+        return data
+    # SOF segment: FF Cn, length (2 bytes), precision (1 byte), height (2 bytes), width (2 bytes), ...
+    hpos = offset + 5
+    height = struct.unpack('>H', data[hpos:hpos + 2])[0]
+    if rows >= height:
+        return data
+    end = data.rfind('\xff\xd9')  # entropy-coded data never holds FF D9 (FF is always stuffed), so this is EOI
+    if end < hpos:
+        end = len(data)
+    return data[:hpos] + struct.pack('>H', rows) + data[hpos + 2:end]
+
+
+def frame_size(data):
+    """return 2-tuple (height, width) from JPEG frame header in data; None if there is no frame header"""
+    offset, marker = find_sof(data)
+    if offset is None:
+        return None
+    return struct.unpack('>HH', data[offset + 5:offset + 9])
+
+
+def _imdecode(data, flag, scale):
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if scale > 1 and img is not None and img.shape[0:2] == frame_size(data):
+        # not every opencv's imdecode honors IMREAD_REDUCED_* (4.2 decodes color at full size regardless), so
+        # downscale here when it did not; that is slower than plain color, but only on such opencv versions
+        h, w = img.shape[0:2]
+        img = cv2.resize(img, (w // scale, h // scale), interpolation=cv2.INTER_AREA)
+    return img
+
+
+def decode_file(fname, mode='color', rows=ROI_DECODE_ROWS):
+    """Decode JPEG file according to decode mode.
+
+    Returns numpy.ndarray of decoded image, (h, w, 3) for color modes and (h, w) for gray modes; None if unreadable.
+    -------
+    Input arguments:
+    fname -- string for full path to JPEG file
+
+    Keyword arguments:
+    mode -- string key of DECODE_MODES
+    rows -- int number of rows from top to decode for the "rows" modes
+
+    """
+    flag, scale, top_rows_only = _mode_params(mode)
+    with tracing.span('decode', img=os.path.basename(fname), mode=mode) as ev:
+        if not top_rows_only:
+            # imread honors the IMREAD_REDUCED_* flags with DCT-domain scaling
+            img = cv2.imread(fname, flag)
+            if img is not None and tracing.enabled():
+                ev['bytes'] = os.path.getsize(fname)
+        else:
+            try:
+                with open(fname, 'rb') as f:
+                    data = f.read()
+            except IOError:
+                return None
+            img = _decode_bytes(data, mode=mode, rows=rows)
+            ev['bytes'] = len(data)
+        if img is not None:
+            ev['pixels'] = img.shape[0] * img.shape[1]
+    return img
+
+
+def decode_bytes(data, mode='color', rows=ROI_DECODE_ROWS, name=None):
+    """Decode JPEG bytes (str, buffer or mmap) according to decode mode; see decode_file.
+
+    Keyword argument name is the string basename the trace event is tagged with (like FoscamFile.bname).
+
+    """
+    with tracing.span('decode', img=name, mode=mode) as ev:
+        img = _decode_bytes(data, mode=mode, rows=rows)
+        ev['bytes'] = len(data)
+        if img is not None:
+            ev['pixels'] = img.shape[0] * img.shape[1]
+    return img
+
+
+def _decode_bytes(data, mode, rows):
+    """return decoded image for JPEG bytes (like decode_bytes, but without a trace event of its own)"""
+    flag, scale, top_rows_only = _mode_params(mode)
+    if top_rows_only:
+        data = crop_rows(bytes(data), rows)
+    return _imdecode(data, flag, scale)
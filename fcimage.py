@@ -14,53 +14,67 @@ Todo:
 import os
 import re
 import cv2
+import glob
+import datetime
 import numpy as np
-from dateutil import parser
-
-from pims.files.filter_pipeline import FileFilterPipeline
 
 import matcher
-from template import GrayscaleTemplateImage
+import decoder
+import tracing
+from template import as_template_image
 from flimsy_constants import DOOR_OFFSETXY_WH, DEFAULT_TEMPLATE
 from flimsy_constants import DEFAULT_FOLDER, BASENAME_PATTERN
 from fgutils import calc_grayscale_hist, plot_hist
 
 
+_BASENAME_REGEX = re.compile(BASENAME_PATTERN)
+
+
 def parse_foscam_fullfilestr(fullfilestr, bname_pattern=BASENAME_PATTERN):
     """convert foscam timestamped fullfile string to datetime object"""
     # /Users/ken/Pictures/foscam/2017-11-08_06_00_close.jpg
-    dtm = None
-    state = None
     bname = os.path.basename(fullfilestr)
-    if not re.match(bname_pattern, bname):
-        pass
+    if bname_pattern == BASENAME_PATTERN:
+        m = _BASENAME_REGEX.match(bname)
+        if m is None:
+            return None, None
+        # layout is fixed YYYY-MM-DD_HH_MM_state.jpg, so just slice the fields
+        day, hh, mm = bname[0:10], bname[11:13], bname[14:16]
     else:
-        p = re.compile(bname_pattern)
-        m = p.search(bname)
-        daystr = m.group('day')
-        hh = m.group('hour')
-        mm = m.group('minute')
-        state = m.group('state')
-        dtm = parser.parse(daystr + ' ' + hh + ':' + mm)
-    return dtm, state
+        m = re.match(bname_pattern, bname)  # re module caches compiled patterns
+        if m is None:
+            return None, None
+        day, hh, mm = m.group('day'), m.group('hour'), m.group('minute')
+    # datetime raises ValueError for invalid date like 1999-12-32
+    dtm = datetime.datetime(int(day[0:4]), int(day[5:7]), int(day[8:10]), int(hh), int(mm))
+    return dtm, m.group('state')
 
 
-def get_date_range_foscam_files(start, stop, morning=True, state=None, topdir=DEFAULT_FOLDER):
-    # Initialize processing pipeline (prime the pipe with callables)
-    ffp = FileFilterPipeline(
-        DateRangeStateFoscamFile(start, stop, morning=morning, state=state),
-        # YoungFile(max_age_minutes=max_age_minutes),
-    )
+def parse_foscam_filenames(fullfilestrs, bname_pattern=BASENAME_PATTERN):
+    """Convert a batch of foscam timestamped fullfile strings.
+
+    Returns 2-tuple (dtms, states) of numpy arrays: datetime64[m] (NaT where name does not match pattern)
+    and string states ('' where name does not match pattern); raises ValueError for like 1999-12-32.
 
-    # get all files [quickly?]
-    file_list = [os.path.join(topdir, f) for f in os.listdir(topdir) if os.path.isfile(os.path.join(topdir, f))]
+    """
+    regex = re.compile(bname_pattern)
+    isos, states = [], []
+    for fullfilestr in fullfilestrs:
+        m = regex.match(os.path.basename(fullfilestr))
+        if m is None:
+            isos.append('NaT')
+            states.append('')
+        else:
+            isos.append('%sT%s:%s' % m.group('day', 'hour', 'minute'))
+            states.append(m.group('state'))
+    # numpy parses the ISO strings in C and raises ValueError for invalid dates
+    return np.array(isos, dtype='datetime64[m]'), np.array(states)
 
-    # apply processing pipeline to probably prune input list of files
-    my_files = []
-    for f in ffp(file_list):
-        my_files.append(f)
 
-    return my_files
+def get_date_range_foscam_files(start, stop, morning=True, state=None, topdir=DEFAULT_FOLDER):
+    """return list of foscam files in topdir in date range (sorted by time) via process-wide archive index"""
+    from archive import get_archive_index
+    return get_archive_index(topdir).query(start, stop, morning=morning, state=state)
 
 
 class DateRangeStateFoscamFile(object):
@@ -128,6 +142,25 @@ class FoscamFile(object):
     def __str__(self):
         s =  '%s has state: "door %s" at %s (%d bytes)' % (self.bname, self.state, self.dtm, self.fsize)
         return s
+
+    @classmethod
+    def from_metadata(cls, filename=None, dtm=None, state=None, fsize=0):
+        """Make FoscamFile from explicit metadata, without touching the filesystem.
+
+        Returns FoscamFile whose dtm and state are as given, or else parsed from filename (if it has one).
+
+        """
+        fcf = cls.__new__(cls)
+        fcf.filename = filename
+        fcf.bname = os.path.basename(filename) if filename else None
+        fcf.fsize = fsize
+        if filename and (dtm is None or state is None):
+            parsed_dtm, parsed_state = parse_foscam_fullfilestr(filename)
+            dtm = parsed_dtm if dtm is None else dtm
+            state = parsed_state if state is None else state
+        fcf.dtm = dtm
+        fcf.state = state
+        return fcf
             
     def parse_image_filename(self):
         """Parse image filename to extract some useful info.
@@ -153,7 +186,21 @@ class FoscamFile(object):
         # get datetime and state
         self.dtm, self.state = parse_foscam_fullfilestr(self.filename)
 
-    
+
+def blur_and_clahe(roi1, blursize=5, cliplim=3.0, gridsize=8):
+    """return grayscale roi1 blurred (unless blursize is None) and then histogram-equalized via CLAHE"""
+    if blursize:
+        # use blurring to smooth skinny garage door (roi1) region a bit
+        roi2 = cv2.GaussianBlur(roi1, (blursize, blursize), 0)
+    else:
+        # skip blurring
+        roi2 = roi1
+
+    # apply CLAHE to skinny garage door (roi2 may/not be blurred)
+    clahe = cv2.createCLAHE(clipLimit=cliplim, tileGridSize=(gridsize, gridsize))
+    return clahe.apply(roi2)
+
+
 class FoscamImage(object):
     
     """A webcam image object.
@@ -162,35 +209,143 @@ class FoscamImage(object):
 
     Properties created with the @property decorator are documented in the property's getter method.
 
+    Each stage of the processing chain (see STAGES) is computed at most once per instance and kept in its
+    underscore backing field; use invalidate() to force recomputation.
+
     """
 
-    def __init__(self, img_name, template=DEFAULT_TEMPLATE):
+    #: tuple: processing chain stages in dependency order (each stage may only depend on earlier ones)
+    STAGES = ('image', 'lab', 'template_match', 'roi_vertices', 'processed_image', 'roi_luminance')
+
+    def __init__(self, img_name, template=DEFAULT_TEMPLATE, roi_only=False, decode='color',
+                 blursize=5, cliplim=3.0, gridsize=8, search=None, foscam_file=None):
         self.img_name = img_name
-        self.foscam_file = FoscamFile(self.img_name)
+        if foscam_file is None:
+            foscam_file = FoscamFile(self.img_name)  # parses name and stats file
+        self.foscam_file = foscam_file  #: FoscamFile: name, timestamp, state and size of the snapshot
         self._template = template
+        self.roi_only = roi_only  #: bool: True to blur/CLAHE just the roi for roi_luminance (fast classification mode)
+        self.decode = decode      #: str: JPEG decode mode, a key of decoder.DECODE_MODES
+        self.scale = decoder.decode_scale(decode)  #: int: downscale factor of decoded image relative to full size
+        if decoder.is_grayscale(decode) and not roi_only:
+            raise ValueError('grayscale decode mode "%s" needs roi_only=True (no LAB color for full frame)' % decode)
+        self.blursize = blursize  #: int: kernel size of Gaussian blur (x and y same size); None to skip blurring
+        self.cliplim = cliplim    #: float: CLAHE clipLimit
+        self.gridsize = gridsize  #: int: CLAHE tileGridSize (x and y same size)
+        if isinstance(search, str):
+            search = matcher.get_search_method(search)  # like 'pyramid' (see matcher.SEARCH_METHODS)
+        self.search = search      #: callable: (img, template) -> matcher.TemplateMatch; None for full-frame search
+        self._data = None   # in-memory JPEG bytes (see from_bytes); None to read img_name
+        self._array = None  # already decoded image (see from_array)
         self._image = None
         self._lab = None
-        self._xywh_template = None
+        self._template_match = None
         self._roi_vertices = None
         self._processed_image = None
         self._roi_luminance = None
+        self.cache_hits = dict.fromkeys(self.STAGES, 0)    #: dict: per-stage count of values served from cache
+        self.cache_misses = dict.fromkeys(self.STAGES, 0)  #: dict: per-stage count of values actually computed
 
     def __str__(self):
         s = '%s' % self.foscam_file
         return s
 
+    @classmethod
+    def from_bytes(cls, data, name=None, dtm=None, state=None, **kwargs):
+        """Make FoscamImage from JPEG bytes already in memory (from a socket, HTTP response, mmap, etc.).
+
+        Returns FoscamImage that decodes data (never reads the filesystem).
+        -------
+        Input arguments:
+        data -- str, buffer or mmap of JPEG bytes
+
+        Keyword arguments:
+        name  -- string filename (like archive name it will get) or None; timestamp and state parsed from it
+                 when not given explicitly
+        dtm   -- datetime when snapshot was taken
+        state -- string door state (open, close or unknown) attached to snapshot
+        kwargs -- as for FoscamImage (template, roi_only, decode, etc.)
+
+        """
+        fcf = FoscamFile.from_metadata(name, dtm=dtm, state=state, fsize=len(data))
+        fci = cls(name, foscam_file=fcf, **kwargs)
+        fci._data = data
+        return fci
+
+    @classmethod
+    def from_array(cls, img, name=None, dtm=None, state=None, **kwargs):
+        """Make FoscamImage from decoded image array, (h, w, 3) BGR or (h, w) gray (which needs roi_only=True).
+
+        Returns FoscamImage whose image is img as-is; see from_bytes for keyword arguments.
+
+        """
+        kwargs.setdefault('decode', 'gray' if img.ndim == 2 else 'color')
+        fcf = FoscamFile.from_metadata(name, dtm=dtm, state=state, fsize=img.nbytes)
+        fci = cls(name, foscam_file=fcf, **kwargs)
+        fci._array = img
+        return fci
+
+    @classmethod
+    def from_roi_luminance(cls, roi, name=None, dtm=None, state=None, fsize=0, **kwargs):
+        """Make FoscamImage whose roi_luminance is already known (like a view into a roicube.RoiCube).
+
+        Returns FoscamImage (roi_only) serving roi as-is, without a copy; other stages still decode name if used.
+
+        """
+        kwargs['roi_only'] = True
+        fcf = FoscamFile.from_metadata(name, dtm=dtm, state=state, fsize=fsize)
+        fci = cls(name, foscam_file=fcf, **kwargs)
+        fci._roi_luminance = roi
+        return fci
+
+    def _cached(self, stage, compute):
+        """Return value for stage from its backing field, calling compute() to fill it on first use."""
+        attr = '_' + stage
+        value = getattr(self, attr)
+        if value is None:
+            self.cache_misses[stage] += 1
+            with tracing.span('fcimage.' + stage, img=self.foscam_file.bname, hit=False):
+                value = compute()
+            setattr(self, attr, value)
+        else:
+            self.cache_hits[stage] += 1
+            tracing.emit('fcimage.' + stage, img=self.foscam_file.bname, hit=True)
+        return value
+
+    def invalidate(self, stage=None):
+        """Drop cached value for stage and every stage downstream of it; None (default) drops them all."""
+        start = 0 if stage is None else self.STAGES.index(stage)
+        for name in self.STAGES[start:]:
+            setattr(self, '_' + name, None)
+
+    def cache_info(self):
+        """Return dict of stage -> (hits, misses)."""
+        return dict((s, (self.cache_hits[s], self.cache_misses[s])) for s in self.STAGES)
+
     @property
     def image(self):
         """numpy.ndarray: Array (h, w, 3) of input image of interest; 3rd dimension is color."""
-        if self._image:
-            return self._image
-        return cv2.imread(self.img_name, 1)
+        return self._cached('image', self._compute_image)
+
+    def _compute_image(self):
+        if self._array is not None:
+            return self._array
+        if self._data is not None:
+            return decoder.decode_bytes(self._data, mode=self.decode, name=self.foscam_file.bname)
+        return decoder.decode_file(self.img_name, mode=self.decode)
 
     @property
     def roi_luminance(self):
         """numpy.ndarray: Array (h, w) of luminance channel of roi from processed image."""
-        if self._roi_luminance:
-            return self._roi_luminance
+        return self._cached('roi_luminance', self._compute_roi_luminance)
+
+    def _compute_roi_luminance(self):
+        if self.roi_only:
+            # shrink blur kernel and CLAHE grid along with the image for reduced-resolution decode modes
+            blursize, gridsize = self.blursize, max(2, self.gridsize // self.scale)
+            if blursize:
+                blursize = max(1, (blursize // self.scale) | 1)
+            return self.apply_blur_and_clahe_roi(blursize=blursize, cliplim=self.cliplim, gridsize=gridsize)
         topleft, botright = self.roi_vertices
         _roi = self.processed_image[topleft[1]:botright[1], topleft[0]:botright[0]]
         _lab_roi = cv2.cvtColor(_roi, cv2.COLOR_BGR2LAB)  # convert color image to LAB color model
@@ -200,66 +355,69 @@ class FoscamImage(object):
     @property
     def template(self):
         """numpy.ndarray: Array (h, w) of template image (grayscale)"""
-        if self._template is None:
-            # is None, so use default template
-            template = GrayscaleTemplateImage(DEFAULT_TEMPLATE)
-            return template.image
-
-        elif isinstance(self._template, np.ndarray):
-                # type is numpy array, so return as-is
-                return self._template
-
-        elif isinstance(self._template, GrayscaleTemplateImage):
-                # type is GrayscaleTemplateImage, so return image part
-                return self._template.image
-
-        elif isinstance(self._template, str):
-            # type is str, so read from string filename
-            template = GrayscaleTemplateImage(self._template)
-            return template.image
-
-        else:
-            raise TypeError('template is unexpected type %s' % type(self._template))
+        return as_template_image(self._template)
 
     @property
     def lab(self):
         """Get the image as LAB color model in 3-channel tuple (L, a, b)."""
-        if self._lab:
-            return self._lab
+        return self._cached('lab', self._compute_lab)
+
+    def _compute_lab(self):
         lab = cv2.cvtColor(self.image, cv2.COLOR_BGR2LAB)  # convert color image to LAB color model
         L, a, b = cv2.split(lab)  # split LAB image to 3 channels (L, a, b); L is luminance channel
         return L, a, b
 
+    @property
+    def template_match(self):
+        """Get matcher.TemplateMatch for where (and how well) the template was found in the image."""
+        return self._cached('template_match', self._compute_template_match)
+
+    def _compute_template_match(self):
+        if self.image.ndim == 2:
+            L = self.image  # grayscale decode mode, so gray stands in for luminance
+        else:
+            L = self.lab[0]  # luminance channel is first element of the lab tuple
+        template = self.template
+        if self.scale > 1:
+            h, w = template.shape[0:2]
+            template = cv2.resize(template, (w // self.scale, h // self.scale), interpolation=cv2.INTER_AREA)
+        if self.search is None:
+            return matcher.find_template(L, template)  # both inputs are grayscale
+        return matcher.run_search(self.search, L, template, scale=self.scale)  # in coords of this decode's image
+
     @property
     def xywh_template(self):
         """Get xywh-tuple for where the template was found in the image."""
-        if self._xywh_template:
-            return self._xywh_template
-        L = self.lab[0]  # luminance channel is first element of the lab tuple
-        xywh_template = matcher.match_template(L, self.template)  # both inputs are grayscale
-        return xywh_template
+        return self.template_match.xywh
 
     @property
     def roi_vertices(self):
         """Get the (top-left, bottom-right) vertices of where roi was found in the image."""
-        if self._roi_vertices:
-            return self._roi_vertices
+        return self._cached('roi_vertices', self._compute_roi_vertices)
 
-        # use template matching on luminance channel to find gray-scale template in image of interest
-        topleft_template = (self.xywh_template[0], self.xywh_template[1])
+    def _compute_roi_vertices(self):
+        ## use template matching on luminance channel to find gray-scale template in image of interest
+        #topleft_template = (self.xywh_template[0], self.xywh_template[1])
+        #
+        ## FIXME what if foscam moves, then offset method will not work robustly, will it?
+        ## extract skinny garage door subset image (roi1) using flimsy offsetxy_wh method
+        #topleft_roi, botright_roi = matcher.convert_offsetxy_wh_to_vertices(topleft_template, DOOR_OFFSETXY_WH)
 
-        # FIXME what if foscam moves, then offset method will not work robustly, will it?
-        # extract skinny garage door subset image (roi1) using flimsy offsetxy_wh method
-        topleft_roi, botright_roi = matcher.convert_offsetxy_wh_to_vertices(topleft_template, DOOR_OFFSETXY_WH)
+        # FIXME The snow has introduced a monkey wrench into our scheme!
+        topleft_roi, botright_roi = (571, 179), (623, 291)
+
+        # full-size pixel coords to coords in (maybe reduced-resolution) decoded image
+        topleft_roi = (topleft_roi[0] // self.scale, topleft_roi[1] // self.scale)
+        botright_roi = (botright_roi[0] // self.scale, botright_roi[1] // self.scale)
 
         return topleft_roi, botright_roi
 
     @property
     def processed_image(self):
         """Get the final, processed image."""
-        if self._processed_image:
-            return self._processed_image
-        return self.apply_blur_and_clahe(blursize=5, cliplim=3.0, gridsize=8)
+        return self._cached('processed_image', lambda: self.apply_blur_and_clahe(blursize=self.blursize,
+                                                                                 cliplim=self.cliplim,
+                                                                                 gridsize=self.gridsize))
 
     def apply_blur_and_clahe(self, blursize=5, cliplim=3.0, gridsize=8):
         """Apply Gaussian blur and histogram equalization CLAHE to a region of interest (roi).
@@ -268,13 +426,6 @@ class FoscamImage(object):
         -------
         Output:
         final -- processed copy of input image where roi has been replaced with blurred CLAHE
-        xywh_template -- xywh-tuple where template image was found in img
-        topleft_roi -- top-left xy-tuple of coords where skinny garage door (offset from template) WAS ASSUMED
-        botright_roi -- bottom-right xy-tuple of coords where skinny garage door (offset from template) WAS ASSUMED
-
-        Input argument:
-        img_name -- string for full path to image of interest
-        template_name -- string for full path to template image
 
         Keyword arguments:
         blursize -- int for kernel size of Gaussian blur (x and y same size); None to skip blurring
@@ -286,20 +437,15 @@ class FoscamImage(object):
         # get explicit channels from our LAB color model split into 3 channels (L, a, b)
         L, a, b = self.lab
 
+        # copy luminance channel so we do not clobber the cached lab stage when replacing roi below
+        L = L.copy()
+
         # use template matching on luminance channel to find gray-scale template in image of interest (roi is skinny garage door)
         topleft_roi, botright_roi = self.roi_vertices
         roi1 = L[topleft_roi[1]:botright_roi[1], topleft_roi[0]:botright_roi[0]]  # looks like np arrays have rows/cols swapped
 
-        if blursize:
-            # use blurring to smooth skinny garage door (roi1) region a bit
-            roi2 = cv2.GaussianBlur(roi1, (blursize, blursize), 0)
-        else:
-            # skip blurring
-            roi2 = roi1
-
-        # apply CLAHE to skinny garage door (roi2 may/not be blurred) subset of image's luminance channel
-        clahe = cv2.createCLAHE(clipLimit=cliplim, tileGridSize=(gridsize, gridsize))
-        roi3 = clahe.apply(roi2)
+        # blur (maybe) and apply CLAHE to skinny garage door subset of image's luminance channel
+        roi3 = blur_and_clahe(roi1, blursize=blursize, cliplim=cliplim, gridsize=gridsize)
 
         # replace copy of luminance channel's skinny garage door region with that of the blurred-CLAHE-enhanced version, roi3
         L[topleft_roi[1]:botright_roi[1], topleft_roi[0]:botright_roi[0]] = roi3
@@ -312,161 +458,33 @@ class FoscamImage(object):
 
         return final
 
-    def get_hist(self):
-        return calc_grayscale_hist(self.roi_luminance)
-
-    def plot_hist(self):
-        h = self.get_hist()
-        plot_hist(h)
+    def apply_blur_and_clahe_roi(self, blursize=5, cliplim=3.0, gridsize=8):
+        """Apply Gaussian blur and histogram equalization CLAHE to just the region of interest (roi).
 
-    def show_results(self):
-
-        # get xywh-tuple from top-left and bottom-right vertices of skinny garage door
-        xywh_door = matcher.convert_vertices_to_xywh(*self.roi_vertices)
-
-        # tuple of parameters for rectangles to draw
-        rectangle_params = [
-            # xywh                color:  B    G    R
-            (self.xywh_template,       (255,   0,   0)),
-            (xywh_door,                (0,     0, 255)),
-            ]
-
-        # get markup of processed image: blue rectangle around template, red around skinny garage door
-        img2 = matcher.get_markup_image(fci.processed_image, rectangle_params)
-
-        # get a horizontal stack result image to look at in Firefox
-        res = np.hstack((fci.image, img2))  # stacking images side-by-side
-
-        oname = '/template/out.jpg'
-        cv2.imwrite(oname, res)
-        print 'open -a Firefox file://%s' % oname
-        self.img_name = img_name
-        self.foscam_file = FoscamFile(self.img_name)
-        self._template = template
-        self._tmp_name = None
-        self._image = None
-        self._template = None
-        self._lab = None
-        self._xywh_template = None
-        self._roi_vertices = None
-        self._processed_image = None
-        self._roi_luminance = None
-
-    def __str__(self):
-        s = '%s' % self.foscam_file
-        return s
-
-    @property
-    def image(self):
-        """numpy.ndarray: Array (h, w, 3) of input image of interest; 3rd dimension is color."""
-        if self._image:
-            return self._image
-        return cv2.imread(self.img_name, 1)
-
-    @property
-    def roi_luminance(self):
-        """numpy.ndarray: Array (h, w) of luminance channel of roi from processed image."""
-        if self._roi_luminance is None:
-            topleft, botright = self.roi_vertices
-            _roi = self.processed_image[topleft[1]:botright[1], topleft[0]:botright[0]]
-            _lab_roi = cv2.cvtColor(_roi, cv2.COLOR_BGR2LAB)  # convert color image to LAB color model
-            L, a, b = cv2.split(_lab_roi)  # split LAB image to 3 channels (L, a, b); L is luminance channel
-            return L
-        return self._roi_luminance
-
-    @property
-    def lab(self):
-        """Get the image as LAB color model in 3-channel tuple (L, a, b)."""
-        if self._lab:
-            return self._lab
-        lab = cv2.cvtColor(self.image, cv2.COLOR_BGR2LAB)  # convert color image to LAB color model
-        L, a, b = cv2.split(lab)  # split LAB image to 3 channels (L, a, b); L is luminance channel
-        return L, a, b
-
-    @property
-    def xywh_template(self):
-        """Get xywh-tuple for where the template was found in the image."""
-        if self._xywh_template:
-            return self._xywh_template
-        L = self.lab[0]  # luminance channel is first element of the lab tuple
-        xywh_template = matcher.match_template(L, self.template)  # both inputs are grayscale
-        return xywh_template
-
-    @property
-    def roi_vertices(self):
-        """Get the (top-left, bottom-right) vertices of where roi was found in the image."""
-        if self._roi_vertices:
-            return self._roi_vertices
-        
-        ## use template matching on luminance channel to find gray-scale template in image of interest
-        #topleft_template = (self.xywh_template[0], self.xywh_template[1])
-        #
-        ## FIXME what if foscam moves, then offset method will not work robustly, will it?
-        ## extract skinny garage door subset image (roi1) using flimsy offsetxy_wh method
-        #topleft_roi, botright_roi = matcher.convert_offsetxy_wh_to_vertices(topleft_template, DOOR_OFFSETXY_WH)
-
-        # FIXME The snow has introduced a monkey wrench into our scheme!
-        topleft_roi, botright_roi = (571, 179), (623, 291)
-
-        return topleft_roi, botright_roi
-    
-    @property
-    def processed_image(self):
-        """Get the final, processed image."""
-        if self._processed_image:
-            return self._processed_image
-        return self.apply_blur_and_clahe(blursize=5, cliplim=3.0, gridsize=8)
-    
-    def apply_blur_and_clahe(self, blursize=5, cliplim=3.0, gridsize=8):
-        """Apply Gaussian blur and histogram equalization CLAHE to a region of interest (roi).
-        
-        Returns a final image with roi that has been blurred and histogram-equalized via CLAHE.
+        Returns luminance channel of roi that has been blurred and histogram-equalized via CLAHE; unlike
+        apply_blur_and_clahe, only the roi gets converted to LAB and the LAB-to-BGR-to-LAB round trip of the
+        full frame is skipped, so medians can differ from the full-frame path by a count or so.
         -------
         Output:
-        final -- processed copy of input image where roi has been replaced with blurred CLAHE
-        xywh_template -- xywh-tuple where template image was found in img
-        topleft_roi -- top-left xy-tuple of coords where skinny garage door (offset from template) WAS ASSUMED
-        botright_roi -- bottom-right xy-tuple of coords where skinny garage door (offset from template) WAS ASSUMED    
-    
-        Input argument:
-        img_name -- string for full path to image of interest
-        template_name -- string for full path to template image
-        
+        roi3 -- array (h, w) of blurred CLAHE luminance channel of the roi
+
         Keyword arguments:
         blursize -- int for kernel size of Gaussian blur (x and y same size); None to skip blurring
         cliplim  -- float value for CLAHE clipLimit
         gridsize -- int value for CLAHE tileGridSize (x and y same size)
-    
+
         """
-               
-        # get explicit channels from our LAB color model split into 3 channels (L, a, b)
-        L, a, b = self.lab
-        
-        # use template matching on luminance channel to find gray-scale template in image of interest (roi is skinny garage door)
+        return blur_and_clahe(self.get_raw_roi_luminance(), blursize=blursize, cliplim=cliplim, gridsize=gridsize)
+
+    def get_raw_roi_luminance(self):
+        """return array (h, w) of luminance channel of roi before any blur or CLAHE (LAB of just the roi)"""
         topleft_roi, botright_roi = self.roi_vertices
-        roi1 = L[topleft_roi[1]:botright_roi[1], topleft_roi[0]:botright_roi[0]]  # looks like np arrays have rows/cols swapped
-    
-        if blursize:   
-            # use blurring to smooth skinny garage door (roi1) region a bit
-            roi2 = cv2.GaussianBlur(roi1, (blursize, blursize), 0)
-        else:
-            # skip blurring
-            roi2 = roi1
-        
-        # apply CLAHE to skinny garage door (roi2 may/not be blurred) subset of image's luminance channel
-        clahe = cv2.createCLAHE(clipLimit=cliplim, tileGridSize=(gridsize, gridsize))
-        roi3 = clahe.apply(roi2)
-        
-        # replace copy of luminance channel's skinny garage door region with that of the blurred-CLAHE-enhanced version, roi3
-        L[topleft_roi[1]:botright_roi[1], topleft_roi[0]:botright_roi[0]] = roi3
-        
-        # merge the blurred-CLAHE-enhanced luminance channel back with the a and b channels
-        limg = cv2.merge((L, a, b))
-        
-        # convert image from LAB Color model to BGR
-        final = cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
-        
-        return final
+        roi = self.image[topleft_roi[1]:botright_roi[1], topleft_roi[0]:botright_roi[0]]
+        if roi.ndim == 2:
+            # grayscale decode mode, so use gray as stand-in for luminance
+            return roi
+        lab_roi = cv2.cvtColor(roi, cv2.COLOR_BGR2LAB)  # convert just the roi to LAB color model
+        return cv2.split(lab_roi)[0]  # L is luminance channel
 
     def get_hist(self):
         return calc_grayscale_hist(self.roi_luminance)
@@ -474,25 +492,25 @@ class FoscamImage(object):
     def plot_hist(self):
         h = self.get_hist()
         plot_hist(h)
-        
+
     def show_results(self):
-        
+
         # get xywh-tuple from top-left and bottom-right vertices of skinny garage door
         xywh_door = matcher.convert_vertices_to_xywh(*self.roi_vertices)
-     
+
         # tuple of parameters for rectangles to draw
         rectangle_params = [
             # xywh                color:  B    G    R
             (self.xywh_template,       (255,   0,   0)),
             (xywh_door,                (0,     0, 255)),
             ]
-        
+
         # get markup of processed image: blue rectangle around template, red around skinny garage door
-        img2 = matcher.get_markup_image(fci.processed_image, rectangle_params)    
-        
+        img2 = matcher.get_markup_image(self.processed_image, rectangle_params)
+
         # get a horizontal stack result image to look at in Firefox
-        res = np.hstack((fci.image, img2))  # stacking images side-by-side
-        
+        res = np.hstack((self.image, img2))  # stacking images side-by-side
+
         oname = '/tmp/out.jpg'
         cv2.imwrite(oname, res)
         print 'open -a Firefox file://%s' % oname
@@ -502,18 +520,27 @@ def median_passes_test(inp1, relate, inp2):
     return relate(inp1, inp2)
 
 
-def quick_glob_check(glob_pat):
-    from flimsy_constants import MEDIAN_THRESHOLD    
+def quick_glob_check(glob_pat, store=None, engine=None):
+    """check roi median verdicts for files matching glob_pat; get medians from features.FeatureStore, if given,
+    and thresholds from threshold.ThresholdEngine, if given (else fixed MEDIAN_THRESHOLD)"""
+    from flimsy_constants import MEDIAN_THRESHOLD
+    from threshold import scene_brightness
     import operator
     dtest = {'open': operator.gt, 'close': operator.le, 'noon': operator.le}
     
     count = 0
     medmin, medmax = 9999.9, -9999.9
     fnames = glob.glob(glob_pat)
+    if store is not None:
+        # read what we can from feature store, computing (and storing) only the missing rows
+        medians = store.features(fnames)['median']
     for fname in fnames:
         
-        fci = FoscamImage(fname)
-        m = np.median(fci.roi_luminance)
+        fci = FoscamImage(fname, roi_only=True)
+        if store is not None:
+            m = medians[os.path.basename(fname)]
+        else:
+            m = np.median(fci.roi_luminance)
         if m > medmax:
             medmax = m
         if m < medmin:
@@ -530,7 +557,11 @@ def quick_glob_check(glob_pat):
             continue
         
         count += 1
-        if median_passes_test(MEDIAN_THRESHOLD, op, m):
+        if engine is not None:
+            thresh = engine.threshold(fci.foscam_file.dtm.hour, scene_brightness(fci.image, fci.scale))
+        else:
+            thresh = MEDIAN_THRESHOLD
+        if median_passes_test(thresh, op, m):
             print "okay ",
         else:
             print "CRAP ",
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""A persistent, per-image feature store for the webcam snapshot archive.
+
+This module provides an SQLite-backed store of per-snapshot features (roi luminance median, percentiles and
+histogram, template match location and score, verdict) so that repeated analyses of the archive only have to
+decode and process images that are new or changed since the last run.
+
+Rows are keyed by image basename and validated against file size and mtime; the whole store is emptied when
+the processing parameters (blursize, cliplim, gridsize, template, threshold) differ from those it was built with.
+
+Example:
+    Bring the store up to date for a few days of snapshots and get a DataFrame of their features::
+
+        $ python features.py 2017-11-10 2017-11-17
+
+"""
+
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from deck import map_images
+from flimsy_constants import DEFAULT_FEATURE_DB, DEFAULT_TEMPLATE, MEDIAN_THRESHOLD
+
+PERCENTILES = range(10, 100, 10)  # roi luminance percentiles (10th, 20th, ... 90th) kept for each image
+QUERY_CHUNK = 500  # basenames per "WHERE bname IN (...)" query (SQLite allows 999 host parameters by default)
+
+_COLUMNS = ['bname', 'fsize', 'mtime', 'dtm', 'state', 'median', 'percentiles', 'hist',
+            'tx', 'ty', 'tw', 'th', 'tscore', 'verdict']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS features (
+    bname TEXT PRIMARY KEY,
+    fsize INTEGER,
+    mtime REAL,
+    dtm TEXT,
+    state TEXT,
+    median REAL,
+    percentiles BLOB,
+    hist BLOB,
+    tx INTEGER, ty INTEGER, tw INTEGER, th INTEGER,
+    tscore REAL,
+    verdict TEXT
+);
+"""
+
+
+def extract_features(fci):
+    """Compute feature row for FoscamImage, fci (module-level so it can be fanned out via map_images).
+
+    Returns dict with one entry for each of the feature store's columns.
+
+    """
+    st = os.stat(fci.img_name)
+    roi = fci.roi_luminance
+    med = float(np.median(roi))
+    hist = np.bincount(roi.ravel(), minlength=256).astype(np.int32)
+    match = fci.template_match
+    x, y, w, h = match.xywh
+    if med < MEDIAN_THRESHOLD:
+        verdict = 'open'
+    else:
+        verdict = 'close'
+    return {
+        'bname': os.path.basename(fci.img_name),
+        'fsize': st.st_size,
+        'mtime': st.st_mtime,
+        'dtm': str(fci.foscam_file.dtm),
+        'state': fci.foscam_file.state,
+        'median': med,
+        'percentiles': np.percentile(roi, PERCENTILES).astype(np.float64),
+        'hist': hist,
+        'tx': x, 'ty': y, 'tw': w, 'th': h,
+        'tscore': float(match.score),
+        'verdict': verdict,
+    }
+
+
+class FeatureStore(object):
+
+    """An on-disk (SQLite) store of per-image features.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, db_name=DEFAULT_FEATURE_DB, tmp_name=DEFAULT_TEMPLATE, blursize=5, cliplim=3.0, gridsize=8):
+        self.db_name = db_name    #: str: full filename of sqlite database file
+        self.tmp_name = tmp_name  #: str: full filename for template image
+        self.blursize = blursize  #: int: kernel size of Gaussian blur
+        self.cliplim = cliplim    #: float: CLAHE clipLimit
+        self.gridsize = gridsize  #: int: CLAHE tileGridSize
+        self.conn = sqlite3.connect(self.db_name)
+        self.conn.executescript(_SCHEMA)
+        self._check_params()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM features').fetchone()[0]
+
+    def __str__(self):
+        return 'FeatureStore %s with %d rows for %s' % (self.db_name, len(self), self.params)
+
+    @property
+    def params(self):
+        """str: signature of processing parameters that the stored features depend on"""
+        tmp_mtime = os.stat(self.tmp_name).st_mtime
+        return 'blursize=%s,cliplim=%s,gridsize=%s,template=%s@%r,threshold=%s' % (
+            self.blursize, self.cliplim, self.gridsize, os.path.abspath(self.tmp_name), tmp_mtime, MEDIAN_THRESHOLD)
+
+    def _check_params(self):
+        """empty the store if it was built with processing parameters other than ours"""
+        params = self.params
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'params'").fetchone()
+        if row is None or row[0] != params:
+            with self.conn:
+                self.conn.execute('DELETE FROM features')
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('params', ?)", (params,))
+
+    def _select(self, columns, bnames):
+        """yield rows of columns (first of which is bname) stored for just those bnames, QUERY_CHUNK at a time"""
+        bnames = list(bnames)
+        for i in range(0, len(bnames), QUERY_CHUNK):
+            chunk = bnames[i:i + QUERY_CHUNK]
+            sql = 'SELECT %s FROM features WHERE bname IN (%s)' % (', '.join(columns), ', '.join('?' * len(chunk)))
+            for row in self.conn.execute(sql, chunk):
+                yield row
+
+    def missing(self, filenames):
+        """return list of those filenames not in store, or whose size or mtime changed since they were stored"""
+        bnames = [os.path.basename(f) for f in filenames]
+        stored = dict((r[0], (r[1], r[2])) for r in self._select(['bname', 'fsize', 'mtime'], bnames))
+        out = []
+        for fname in filenames:
+            st = os.stat(fname)
+            if stored.get(os.path.basename(fname)) != (st.st_size, st.st_mtime):
+                out.append(fname)
+        return out
+
+    def put(self, rows):
+        """insert (or replace) feature rows, each a dict like from extract_features"""
+        records = []
+        for r in rows:
+            rec = [r[c] for c in _COLUMNS]
+            rec[_COLUMNS.index('percentiles')] = sqlite3.Binary(r['percentiles'].tobytes())
+            rec[_COLUMNS.index('hist')] = sqlite3.Binary(r['hist'].tobytes())
+            records.append(rec)
+        sql = 'INSERT OR REPLACE INTO features (%s) VALUES (%s)' % (', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS)))
+        with self.conn:
+            self.conn.executemany(sql, records)
+
+    def update(self, filenames, workers=None, chunksize=None):
+        """compute and store features for just the missing (or stale) filenames; returns number of rows computed"""
+        todo = self.missing(filenames)
+        if todo:
+            rows = map_images(extract_features, todo, tmp_name=self.tmp_name, workers=workers, chunksize=chunksize,
+                              blursize=self.blursize, cliplim=self.cliplim, gridsize=self.gridsize)
+            self.put(rows)
+        return len(todo)
+
+    def get(self, filenames):
+        """Get stored features for filenames (that are in the store).
+
+        Returns pandas.DataFrame indexed by basename in the order of filenames; percentiles is (n, 9) column of
+        arrays and hist is column of (256,) int32 arrays.
+
+        """
+        bnames = [os.path.basename(f) for f in filenames]
+        rows = dict((r[0], r) for r in self._select(_COLUMNS, bnames))
+        df = pd.DataFrame([rows[b] for b in bnames if b in rows], columns=_COLUMNS)
+        df['percentiles'] = [np.frombuffer(bytes(b), dtype=np.float64) for b in df['percentiles']]
+        df['hist'] = [np.frombuffer(bytes(b), dtype=np.int32) for b in df['hist']]
+        df['dtm'] = pd.to_datetime(df['dtm'])
+        return df.set_index('bname')
+
+    def features(self, filenames, workers=None, chunksize=None):
+        """bring store up to date for filenames and return their features (see get)"""
+        self.update(filenames, workers=workers, chunksize=chunksize)
+        return self.get(filenames)
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+
+    import sys
+    from deck import Deck
+
+    deck = Deck(date_range=sys.argv[1:3], morning=False)
+    store = FeatureStore()
+    print 'computed %d new rows' % store.update(deck.filenames)
+    print store
+    print deck.features(store=store)[['dtm', 'state', 'median', 'tscore', 'verdict']]
@@ -19,8 +19,10 @@ import datetime
 # BRP = (613, 259) => offset: (213, 232)                                # WH is absolute (pixels)
 
 
+TEMPLATE_XY = (400, 27)  # where template routinely gets found (absolute pixel coords); seeds windowed search
 DOOR_OFFSETXY_WH = (167, 154, 52, 112)
 TARG_OFFSETXY_WH = (203, 198, 10, 34)    # offset for where the target was (for flood fill)
+ROI_DECODE_ROWS = 320  # rows from top that cover template search band and skinny garage door (w/ margin)
 
 _cwd = os.path.dirname(os.path.abspath(__file__))
 if _cwd.startswith('/home/pi'):
@@ -32,9 +34,15 @@ elif _cwd.startswith('/Users/ken'):
 else:
     DEFAULT_FOLDER = '/home/ken/pictures/foscam'
     DEFAULT_TEMPLATE = '/home/ken/pictures/foscam/template.jpg'
+DEFAULT_FEATURE_DB = os.path.join(DEFAULT_FOLDER, 'features.sqlite')  # per-image feature store (see features.py)
+DEFAULT_ROI_CUBE = os.path.join(DEFAULT_FOLDER, 'roi_cube.npy')  # memory-mapped roi luminance (see roicube.py)
+DEFAULT_AGGREGATE_FILE = os.path.join(DEFAULT_FOLDER, 'roi_histograms.npz')  # running histograms (see aggregator.py)
+DEFAULT_THRESHOLD_FILE = os.path.join(DEFAULT_FOLDER, 'thresholds.npz')  # learned thresholds (see threshold.py)
+DEFAULT_VERDICT_FILE = os.path.join(DEFAULT_FOLDER, 'latest_verdict.json')  # published by watcher.py
 
 BASENAME_PATTERN = r'^(?P<day>\d{4}-\d{2}-\d{2})_(?P<hour>\d{2})_(?P<minute>\d{2})_(?P<state>open|close)\.jpg$'
 DAYONE = datetime.datetime.now() - datetime.timedelta(days=6)
 
 #MEDIAN_THRESHOLD = 191.0  # median(roi_luminance) above this value when door is closed
 MEDIAN_THRESHOLD = 178.5  # median(roi_luminance) above this value when door is closed
+CONFIDENCE_SPAN = 50.0    # median this far (or farther) from threshold gives full confidence in verdict
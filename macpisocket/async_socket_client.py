@@ -4,10 +4,15 @@
 
 import ast
 import sys
+import time
 import socket
+import asyncore
+import asynchat
+from collections import deque
 
 from pims.files.log import my_logger
 from async_socket_common import extract_field_value
+from wire import WireClient
 
 
 class CommaSeparatedMessage(object):
@@ -41,6 +46,104 @@ def send_to_server(ip, port, message):
     return trigger_button
 
 
+def send_to_server_wire(ip, port, want):
+    """Ask server started with --wire (framed binary protocol, see wire.py) what to do about wanted state.
+
+    Returns trigger_button boolean; raises IOError if server could not answer.
+
+    """
+    client = WireClient(ip, port)
+    try:
+        resp = client.request(want)
+    finally:
+        client.close()
+    logger.info('Response from the server: %s' % str(resp))
+    if resp.error:
+        raise IOError('server error: %s' % resp.error)
+    return resp.trigger_button
+
+
+class PipelinedClient(asynchat.async_chat):
+
+    """Send newline-terminated messages over one persistent connection, keeping up to window of them in flight.
+
+    Matches event_loop_server.GarageServer, which answers in request order.
+
+    """
+
+    def __init__(self, ip, port, messages, window=4, map=None):
+        asynchat.async_chat.__init__(self, map=map)
+        self.set_terminator('\n')
+        self.to_send = deque('%s' % m for m in messages)
+        self.total = len(self.to_send)
+        self.window = window
+        self.inflight = 0
+        self.responses = []
+        self.error = None
+        self._buf = []
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect((ip, port))
+
+    @property
+    def done(self):
+        return len(self.responses) == self.total or self.error is not None
+
+    def handle_connect(self):
+        self._send_more()
+
+    def _send_more(self):
+        while self.to_send and self.inflight < self.window:
+            self.push(self.to_send.popleft() + '\n')
+            self.inflight += 1
+
+    def collect_incoming_data(self, data):
+        self._buf.append(data)
+
+    def found_terminator(self):
+        self.responses.append(''.join(self._buf))
+        self._buf = []
+        self.inflight -= 1
+        if len(self.responses) == self.total:
+            self.close()
+        else:
+            self._send_more()
+
+    def handle_close(self):
+        if not self.done:
+            self.error = 'server closed connection after %d of %d responses' % (len(self.responses), self.total)
+        self.close()
+
+    def handle_error(self):
+        t, v, tb = sys.exc_info()
+        self.error = str(v)
+        self.close()
+
+
+def send_to_server_async(ip, port, messages, window=4, timeout=30.0):
+    """Send messages (LIKE CommaSeparatedMessage objects) pipelined over one connection to event-loop server.
+
+    Returns list of trigger_button booleans in the order of messages; raises IOError on error or timeout.
+
+    """
+    socket_map = dict()
+    client = PipelinedClient(ip, port, messages, window=window, map=socket_map)
+    deadline = time.time() + timeout
+    while not client.done and socket_map and time.time() < deadline:
+        asyncore.loop(timeout=0.05, map=socket_map, count=1)
+    client.close()
+    if not client.done:
+        raise IOError(client.error or 'timed out after %d of %d responses' % (len(client.responses), client.total))
+    if client.error:
+        raise IOError(client.error)
+    triggers = []
+    for response in client.responses:
+        if response.startswith('error:'):
+            raise IOError('server %s' % response)
+        fieldstr, triggerstr = extract_field_value(response, 1)
+        triggers.append(ast.literal_eval(triggerstr))
+    return triggers
+
+
 if __name__ == "__main__":
 
     # this is client (typically running on RPi)
@@ -53,17 +156,23 @@ if __name__ == "__main__":
     # set ip and port of the server
     ip, port = '192.168.1.103', 9998
 
+    # --wire to talk to server started with --wire (framed binary protocol on a persistent connection)
+    args = [a for a in sys.argv[1:] if a != '--wire']
+
     # get state info to be: { unknown | open | close }
-    if len(sys.argv) == 1:
+    if len(args) == 0:
         msg = 'unknown'
-    elif len(sys.argv) > 2:
-        raise Exception("too many inputs; requires either zero or one arg")
-    elif sys.argv[1] in ['open', 'close', 'unknown']:
-        msg = sys.argv[1]
+    elif len(args) > 1:
+        raise Exception("too many inputs; requires either zero or one arg (plus optional --wire)")
+    elif args[0] in ['open', 'close', 'unknown']:
+        msg = args[0]
     else:
         raise Exception("invalid arg; must be among: {'open'|'close'|'unknown'}")
     
     # send formatted message to server
-    csm = CommaSeparatedMessage(msg)
-    trigger = send_to_server(ip, port, csm)
+    if '--wire' in sys.argv:
+        trigger = send_to_server_wire(ip, port, msg)
+    else:
+        csm = CommaSeparatedMessage(msg)
+        trigger = send_to_server(ip, port, csm)
     logger.info('Trigger actions: %s' % str(trigger))
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 
+import os
 import sys
+import threading
 import numpy as np
 import datetime
 
+from fauxmo_garage import tracing
 from fauxmo_garage.fcimage import FoscamImage
-from flimsy_constants import MEDIAN_THRESHOLD
+from fauxmo_garage.threshold import scene_brightness
+from flimsy_constants import MEDIAN_THRESHOLD, CONFIDENCE_SPAN
 
 
 def extract_field_value(message, idx_field):
@@ -14,13 +18,28 @@ def extract_field_value(message, idx_field):
     return field, value
 
 
+def verdict_confidence(median, threshold=MEDIAN_THRESHOLD):
+    """return confidence (0.0 at threshold up to 1.0 at CONFIDENCE_SPAN or farther from it) in median's verdict"""
+    return min(1.0, abs(median - threshold) / CONFIDENCE_SPAN)
+
+
 class AnalysisResults(object):
-    
-    def __init__(self, img_fname):
-        self.img_fname = img_fname
+
+    threshold_engine = None  # threshold.ThresholdEngine shared by all instances; None for fixed MEDIAN_THRESHOLD
+
+    def __init__(self, img):
+        # img is snapshot filename, or FoscamImage (like from FoscamImage.from_bytes for frame still in memory)
+        if hasattr(img, 'roi_luminance'):  # any FoscamImage (top-level fcimage module or fauxmo_garage.fcimage)
+            self.img_fname = img.img_name
+            self._source = img
+        else:
+            self.img_fname = img
+            self._source = None
         self.fcimage = None
         self.state = None
         self.median = None
+        self.threshold = None   # median below this means open (learned for time and light, if engine is set)
+        self.confidence = None  # 0.0 at threshold up to 1.0 at CONFIDENCE_SPAN (or more) away from it
         self.elapsed_sec = None
      
     def __str__(self):
@@ -30,16 +49,87 @@ class AnalysisResults(object):
         
     def compute(self):
         n1 = datetime.datetime.now()
-        self.fcimage = FoscamImage(self.img_fname)
-        self.median = np.median(self.fcimage.roi_luminance)
-        if self.median < MEDIAN_THRESHOLD:
-            self.state = 'open'
-        else:
-            self.state = 'close'
+        with tracing.span('analysis.compute', img=os.path.basename(self.img_fname or '')) as ev:
+            if self._source is None:
+                self.fcimage = FoscamImage(self.img_fname, roi_only=True)
+            else:
+                self.fcimage = self._source
+            self.median = np.median(self.fcimage.roi_luminance)
+            self.threshold = self.get_threshold()
+            if self.median < self.threshold:
+                self.state = 'open'
+            else:
+                self.state = 'close'
+            self.confidence = verdict_confidence(self.median, self.threshold)
+            ev['state'] = self.state
         n2 = datetime.datetime.now()
         self.elapsed_sec = (n2 - n1).total_seconds()
+
+    def get_threshold(self):
+        """return median threshold for this frame: from threshold_engine by hour and scene light, else fixed"""
+        engine = AnalysisResults.threshold_engine
+        if engine is None:
+            return MEDIAN_THRESHOLD
+        dtm = self.fcimage.foscam_file.dtm or datetime.datetime.now()
+        return engine.threshold(dtm.hour, scene_brightness(self.fcimage.image, self.fcimage.scale))
      
      
+class _Flight(object):
+    """one in-flight call that other callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.callers = 1
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+
+    """Coalesce concurrent calls: while a call for a key is in flight, later callers wait for and share its result.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self):
+        self.calls = 0      #: int: calls actually made
+        self.coalesced = 0  #: int: callers that shared someone else's call instead of making their own
+        self._flights = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """Call func(*args) unless a call for key is already in flight, in which case wait for that one.
+
+        Returns 2-tuple (result, shared) where shared is how many callers got this same result (1 if only us);
+        re-raises the in-flight call's exception for every caller that shared it.
+
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                flight.callers += 1
+                self.coalesced += 1
+        if leader:
+            try:
+                flight.result = func(*args)
+            except Exception:
+                flight.exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._flights[key]  # callers arriving from now on start a new call
+                flight.done.set()
+        else:
+            flight.done.wait()
+        if flight.exc_info:
+            raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+        return flight.result, flight.callers
+
+
 def demo(state):
     import glob
     fnames = glob.glob('/Users/ken/Pictures/foscam/2017*%s.jpg' % state)
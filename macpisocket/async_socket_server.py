@@ -4,21 +4,75 @@
 
 # https://docs.python.org/2/library/socketserver.html
 
+import sys
 import time
+import datetime
 import socket
 import threading
 import SocketServer
 
 from pims.files.log import my_logger
-from foscam_snap import FoscamSnap
-from async_socket_common import extract_field_value, AnalysisResults
+from fauxmo_garage import tracing
+from fauxmo_garage.fcimage import FoscamImage
+from fauxmo_garage.aggregator import HistogramAggregator
+from fauxmo_garage.threshold import ThresholdEngine
+from foscam_fetch import PooledFoscamSnap
+from prefetch import Prefetcher
+from async_socket_common import extract_field_value, AnalysisResults, SingleFlight
+from wire import Response, WireRequestHandler
 
 
 FOSCAM_INI_FILE = '/Users/ken/config/foscam/cgi_snap.ini'
-FOSCAMSNAP = FoscamSnap(FOSCAM_INI_FILE)
+FOSCAMSNAP = PooledFoscamSnap(FOSCAM_INI_FILE)  # keep-alive connection to camera
+PROM_FILE = '/Users/ken/Pictures/foscam/fauxmo_garage.prom'  # per-stage metrics for local scraper (see tracing.py)
+PREFETCH_INTERVAL = 5.0  # seconds between background snaps in prefetch mode
+PREFETCH_MAX_AGE = 10.0  # seconds old a prefetched frame can be and still answer a request
+PREFETCHER = None        # Prefetcher when server runs in prefetch mode (see __main__ below)
+AGGREGATOR = None        # HistogramAggregator when server keeps running roi histograms (see __main__ below)
+AGGREGATE_SAVE_SEC = 60.0  # seconds between saves of running roi histograms
+SNAP_FLIGHT = SingleFlight()  # concurrent requests share one in-flight snap and analysis
 logger = my_logger('async_socket_server')
 
 
+def snap_and_analyze():
+    """return AnalysisResults (computed) for picture snapped now"""
+    # snap picture with webcam (into memory; archive file gets written in background)
+    t1 = time.time()
+    with tracing.span('camera.snap'):
+        fcsnap_fname, jpeg = FOSCAMSNAP.snap_bytes('unknown')
+    snap_sec = time.time() - t1
+
+    # analyze image from webcam without waiting on disk
+    fci = FoscamImage.from_bytes(jpeg, name=fcsnap_fname, dtm=datetime.datetime.fromtimestamp(t1),
+                                 state='unknown', roi_only=True)
+    image_results = AnalysisResults(fci)
+    image_results.compute()
+    image_results.snap_sec = snap_sec
+    if AGGREGATOR:
+        AGGREGATOR.add_verdict(fci, image_results.state)
+        AGGREGATOR.maybe_save(AGGREGATE_SAVE_SEC)
+    return image_results
+
+
+def wire_answer(req):
+    """return wire.Response to wire.Request (for WireRequestHandler in --wire mode)"""
+    t1 = time.time()
+    try:
+        if PREFETCHER:
+            entry, cached = PREFETCHER.get(PREFETCH_MAX_AGE)
+            verdict, median, confidence = entry.verdict, entry.median, entry.confidence
+            timings = {'frame_age': t1 - entry.timestamp}
+        else:
+            image_results, shared = SNAP_FLIGHT.do('snap', snap_and_analyze)
+            verdict, median, confidence = image_results.state, image_results.median, image_results.confidence
+            timings = {'snap': image_results.snap_sec, 'analysis': image_results.elapsed_sec}
+    except Exception, e:
+        logger.info('Request %d from %s failed: %s' % (req.request_id, req.client, e))
+        return Response(req.request_id, 'unknown', False, 0.0, 0.0, {'total': time.time() - t1}, str(e))
+    timings['total'] = time.time() - t1
+    return Response(req.request_id, verdict, verdict != req.want, median, confidence, timings, '')
+
+
 class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
 
     def handle(self):
@@ -43,28 +97,63 @@ class ThreadedTCPRequestHandler(SocketServer.BaseRequestHandler):
         # EXAMPLE: 'wants:open,client:pihole'
         fieldstr, want_state = extract_field_value(client_data, 0)
         
-        # snap picture with webcam
-        fcsnap_fname = FOSCAMSNAP.snap_picture('unknown')
-        
-        # analyze image from webcam
-        image_results = AnalysisResults(fcsnap_fname)
-        image_results.compute()
+        with tracing.span('server.callback', client=client_data) as ev:
+
+            if PREFETCHER:
+                # answer from recent background frame (snaps a fresh one only if newest is stale)
+                entry, ev['cached'] = PREFETCHER.get(PREFETCH_MAX_AGE)
+                state, median = entry.verdict, entry.median
+                logger.info('Using %s frame from %.1f sec ago.' % ('prefetched' if ev['cached'] else 'fresh',
+                                                                   time.time() - entry.timestamp))
+            else:
+                # snap and analyze, unless another request already is (then we share its results)
+                image_results, shared = SNAP_FLIGHT.do('snap', snap_and_analyze)
+                state, median = image_results.state, image_results.median
+                if shared > 1:
+                    ev['shared'] = shared
+                    logger.info('Coalesced %d concurrent requests onto analysis of %s (%d coalesced so far).' % (
+                                shared, image_results.img_fname, SNAP_FLIGHT.coalesced))
         
         # determine whether or not to trigger garage remote button
-        trigger_button = image_results.state != want_state
+        trigger_button = state != want_state
 
-        return 'seems:%s,trigger_button:%s,median:%d' % (image_results.state, str(trigger_button), image_results.median)        
+        return 'seems:%s,trigger_button:%s,median:%d' % (state, str(trigger_button), median)
 
 
 class ThreadedTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
-    pass
+    daemon_threads = True  # persistent (wire) connections must not keep server process from exiting
 
 
 if __name__ == "__main__":
 
     HOST, PORT = "192.168.1.103", 9998  # zero for port (2nd item) to select arbitrary unused port
 
-    server = ThreadedTCPServer((HOST, PORT), ThreadedTCPRequestHandler)
+    # optional running roi histograms of every classified frame, shared with batch tools (see aggregator.py)
+    if '--aggregate' in sys.argv:
+        AGGREGATOR = HistogramAggregator()
+        logger.info('Counting frames into %s.' % AGGREGATOR)
+
+    # optional thresholds learned by hour and scene light (see threshold.py and Deck.calibrate_thresholds)
+    if '--adaptive' in sys.argv:
+        AnalysisResults.threshold_engine = ThresholdEngine()
+        logger.info('Classifying with %s.' % AnalysisResults.threshold_engine)
+
+    # optional prefetch mode keeps snapping in background so requests need not wait on camera round trip
+    if '--prefetch' in sys.argv:
+        PREFETCHER = Prefetcher(FOSCAMSNAP, interval=PREFETCH_INTERVAL, logger=logger, aggregator=AGGREGATOR)
+        PREFETCHER.start()
+        logger.info('Prefetching a frame every %.1f sec.' % PREFETCH_INTERVAL)
+
+    # break down each response's time into camera fetch, decode, template match, etc.
+    tracing.add_sink(tracing.LoggerSink(logger))
+    tracing.add_sink(tracing.PrometheusSink(PROM_FILE))
+
+    if '--wire' in sys.argv:
+        # framed binary protocol on persistent connections (see wire.py and wire.WireClient)
+        server = ThreadedTCPServer((HOST, PORT), WireRequestHandler)
+        server.answer = wire_answer
+    else:
+        server = ThreadedTCPServer((HOST, PORT), ThreadedTCPRequestHandler)
     ip, port = server.server_address
 
     # Start a thread with the server -- that thread will then start one
@@ -85,5 +174,7 @@ if __name__ == "__main__":
         logger.info("Server got KeyboardInterrupt in thread: %s" % server_thread.name)
         server.shutdown()
         server.server_close()
+        if AGGREGATOR:
+            AGGREGATOR.save()
         logger.info("Server shutdown and closed.")
         logger.info("--------------------\n")
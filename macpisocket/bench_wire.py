@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""Benchmark the framed wire protocol against the original comma-string protocol over loopback.
+
+Both servers answer from a canned verdict, so this measures protocol and connection overhead only (no camera,
+no OpenCV): the old way opens a TCP connection per request, does one recv(1024) and literal_evals the reply;
+the wire protocol keeps one connection open, and can pipeline.
+
+Example:
+    Time 2000 requests each way::
+
+        $ python bench_wire.py 2000
+
+"""
+
+import ast
+import sys
+import time
+import socket
+import threading
+import SocketServer
+import numpy as np
+
+from async_socket_common import extract_field_value
+from wire import Response, WireRequestHandler, WireClient
+
+
+class ThreadedTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class OldRequestHandler(SocketServer.BaseRequestHandler):
+    """like async_socket_server.ThreadedTCPRequestHandler, with canned callback"""
+
+    def handle(self):
+        data = self.request.recv(1024)
+        field, want_state = extract_field_value(data, 0)
+        result = 'seems:open,trigger_button:%s,median:123' % str('open' != want_state)
+        response = '"%s" via %s' % (result, threading.current_thread().name)
+        self.request.sendall(response)
+
+
+def old_send(ip, port, message):
+    """like async_socket_client.send_to_server, without logging"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((ip, port))
+    try:
+        sock.sendall(message)
+        response = sock.recv(1024)
+    finally:
+        sock.close()
+    fieldstr, triggerstr = extract_field_value(response, 1)
+    return ast.literal_eval(triggerstr)
+
+
+def canned_answer(req):
+    return Response(req.request_id, 'open', req.want != 'open', 123.0, 0.9, {'snap': 0.5, 'analysis': 0.01}, '')
+
+
+def _start(handler, answer=None):
+    server = ThreadedTCPServer(('127.0.0.1', 0), handler)
+    server.answer = answer
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server
+
+
+def _summarize(label, latencies, total_sec, n):
+    ms = 1000.0 * np.asarray(latencies)
+    print '%24s: %8.0f req/sec  p50 %6.3f ms  p95 %6.3f ms' % (label, n / total_sec, np.percentile(ms, 50),
+                                                               np.percentile(ms, 95))
+
+
+def bench(n=1000, batch=16):
+    old = _start(OldRequestHandler)
+    new = _start(WireRequestHandler, canned_answer)
+    try:
+        ip, port = old.server_address
+        lat = []
+        t0 = time.time()
+        for i in range(n):
+            t1 = time.time()
+            old_send(ip, port, 'wants:close,client:bench')
+            lat.append(time.time() - t1)
+        _summarize('comma string, new conn', lat, time.time() - t0, n)
+
+        ip, port = new.server_address
+        client = WireClient(ip, port, client='bench')
+        lat = []
+        t0 = time.time()
+        for i in range(n):
+            t1 = time.time()
+            client.request('close')
+            lat.append(time.time() - t1)
+        _summarize('wire, persistent', lat, time.time() - t0, n)
+
+        lat = []
+        t0 = time.time()
+        for i in range(n // batch):
+            t1 = time.time()
+            client.pipeline(['close'] * batch)
+            lat.append((time.time() - t1) / batch)
+        _summarize('wire, pipelined x%d' % batch, lat, time.time() - t0, batch * (n // batch))
+        client.close()
+    finally:
+        old.shutdown()
+        new.shutdown()
+
+
+if __name__ == '__main__':
+
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+# THIS RUNS ON THE MAC
+
+"""An event-loop garage control server: non-blocking camera fetch, analysis in a thread pool.
+
+This module provides a single-threaded asyncore event loop that accepts persistent client connections
+carrying newline-terminated requests (LIKE 'wants:open,client:pihole'), possibly pipelined. For each request
+it fetches a snapshot from the camera's cgi with a non-blocking HTTP GET, hands the JPEG bytes to a thread pool
+for analysis in memory (OpenCV releases the GIL) and writes newline-terminated responses (LIKE
+'seems:close,trigger_button:True,median:201') back in request order. The archive copy of each snapshot is
+written by a background writer thread (foscam_fetch.ArchiveWriter), never on the event loop and never read back.
+
+Backpressure: a connection is not read from while it has max_pending requests in flight or unsent
+responses piling up, so a client that floods the server just fills its own TCP window.
+
+This tree is python 2, so asyncore/asynchat stand in for asyncio and a multiprocessing ThreadPool stands in
+for an executor.
+
+Example:
+    Serve on the Mac (see async_socket_client.send_to_server_async for the matching client)::
+
+        $ python event_loop_server.py
+
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncore
+import asynchat
+import datetime
+import threading
+import urlparse
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from Queue import Queue, Empty
+
+from fauxmo_garage.fcimage import FoscamImage
+from async_socket_common import extract_field_value, AnalysisResults
+from foscam_fetch import ArchiveWriter
+
+TERMINATOR = '\n'
+
+
+def analyze(snap):
+    """return 2-tuple (state, median) for snap, a 3-tuple (jpeg bytes, archive name, datetime) (runs in pool)"""
+    jpeg, fname, dtm = snap
+    ar = AnalysisResults(FoscamImage.from_bytes(jpeg, name=fname, dtm=dtm, state='unknown', roi_only=True))
+    ar.compute()
+    return ar.state, ar.median
+
+
+def _guarded(func, arg):
+    """return 2-tuple (func(arg), None), or (None, error string) if it raised (py2 pools lack error callbacks)"""
+    try:
+        return func(arg), None
+    except Exception, e:
+        return None, '%s: %s' % (e.__class__.__name__, e)
+
+
+def format_response(state, want_state, median):
+    """return response line (without terminator) LIKE seems:open,trigger_button:False,median:123"""
+    trigger_button = state != want_state
+    return 'seems:%s,trigger_button:%s,median:%d' % (state, str(trigger_button), median)
+
+
+class CameraFetch(asyncore.dispatcher):
+
+    """Non-blocking HTTP GET of one snapshot; calls callback(jpeg bytes, error) on the loop."""
+
+    def __init__(self, url, callback, timeout=10.0, map=None):
+        asyncore.dispatcher.__init__(self, map=map)
+        parts = urlparse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        self.callback = callback
+        self.deadline = time.time() + timeout
+        self._out = 'GET %s HTTP/1.0\r\nHost: %s\r\nConnection: close\r\n\r\n' % (path, parts.netloc)
+        self._in = []
+        self._done = False
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.connect((parts.hostname, parts.port or 80))
+
+    def writable(self):
+        return bool(self._out) and not self._done
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+
+    def handle_read(self):
+        data = self.recv(256 * 1024)
+        if data:
+            self._in.append(data)
+
+    def handle_close(self):
+        self._finish()
+
+    def handle_expt(self):
+        self._finish(error='camera connection error')
+
+    def handle_error(self):
+        t, v, tb = sys.exc_info()
+        self._finish(error='camera fetch failed: %s' % v)
+
+    def check_timeout(self, now):
+        if not self._done and now > self.deadline:
+            self._finish(error='camera fetch timed out')
+
+    def _finish(self, error=None):
+        if self._done:
+            return
+        self._done = True
+        self.close()
+        body = None
+        if error is None:
+            body, error = self._body()
+        self.callback(body, error)
+
+    def _body(self):
+        """return 2-tuple (body, None) of complete 200 response, or (None, error string)"""
+        response = ''.join(self._in)
+        head, sep, body = response.partition('\r\n\r\n')
+        if not sep:
+            return None, 'camera response incomplete'
+        status = head.split('\r\n', 1)[0].split()
+        if len(status) < 2 or status[1] != '200':
+            return None, 'camera said %s' % ' '.join(status[1:])
+        return body, None
+
+
+class _Request(object):
+    """one client request; response stays None until it is ready to send"""
+
+    def __init__(self, conn, line):
+        self.conn = conn
+        self.line = line
+        self.response = None
+
+
+class GarageConnection(asynchat.async_chat):
+
+    """One persistent client connection: newline-terminated requests in, responses out in request order."""
+
+    def __init__(self, sock, server, map=None):
+        asynchat.async_chat.__init__(self, sock, map=map)
+        self.set_terminator(TERMINATOR)
+        self.server = server
+        self.pending = deque()  # submitted _Request objects in arrival order, until their response is pushed
+        self.backlog = deque()  # request lines already read but not yet admitted
+        self._buf = []
+
+    def readable(self):
+        # backpressure: stop reading while too much is in flight or waiting to be sent
+        if self.backlog or len(self.pending) >= self.server.max_pending:
+            return False
+        if len(self.producer_fifo) >= self.server.max_pending:
+            return False
+        return asynchat.async_chat.readable(self)
+
+    def collect_incoming_data(self, data):
+        self._buf.append(data)
+
+    def found_terminator(self):
+        line = ''.join(self._buf).strip()
+        self._buf = []
+        if line:
+            self.backlog.append(line)  # one recv can carry many pipelined requests
+            self._admit()
+
+    def _admit(self):
+        while self.backlog and len(self.pending) < self.server.max_pending:
+            req = _Request(self, self.backlog.popleft())
+            self.pending.append(req)
+            self.server.note_inflight(len(self.pending))
+            self.server.submit(req)
+
+    def flush_ready(self):
+        """push responses that are ready, stopping at the first one that is not (keeps request order)"""
+        while self.pending and self.pending[0].response is not None:
+            self.push(self.pending.popleft().response + TERMINATOR)
+        self._admit()
+
+    def handle_close(self):
+        self.pending.clear()
+        self.backlog.clear()
+        self.close()
+
+
+class GarageServer(asyncore.dispatcher):
+
+    """Event-loop server that answers garage requests from fresh camera snapshots.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, address, camera_url, snap_filename, workers=2, max_pending=8, fetch_timeout=10.0,
+                 logger=None):
+        self.map = dict()
+        asyncore.dispatcher.__init__(self, map=self.map)
+        self.camera_url = camera_url        #: str: camera snapshot cgi url
+        self.snap_filename = snap_filename  #: callable: state -> archive filename (like FoscamSnap.snap_filename)
+        self.max_pending = max_pending      #: int: most in-flight requests per connection before we stop reading
+        self.fetch_timeout = fetch_timeout  #: float: seconds allowed for camera fetch
+        self.logger = logger                #: logging.Logger: None for quiet
+        self.pool = ThreadPool(workers)     #: ThreadPool: runs CPU-bound analysis off the event loop
+        self.archive = ArchiveWriter(logger)  #: ArchiveWriter: writes archive copies of snapshots off the loop
+        self.archive.start()
+        self.stats = dict.fromkeys(['requests', 'responses', 'errors', 'max_inflight'], 0)  #: dict: counters
+        self._fetches = []
+        self._done = Queue()  # (callable, args) completions from pool threads, run on loop thread
+        self._wake_r, self._wake_w = os.pipe()
+        self._waker = asyncore.file_dispatcher(self._wake_r, map=self.map)
+        self._waker.handle_read = self._drain
+        self._waker.writable = lambda: False
+        self._stop = threading.Event()
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(16)
+
+    def _log(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            sock, addr = pair
+            self._log('Connection from %s:%d.' % addr)
+            GarageConnection(sock, self, map=self.map)
+
+    def note_inflight(self, n):
+        self.stats['max_inflight'] = max(self.stats['max_inflight'], n)
+
+    def submit(self, req):
+        """start camera fetch for request; analysis and response follow via callbacks"""
+        self.stats['requests'] += 1
+        try:
+            field, want_state = extract_field_value(req.line, 0)
+        except IndexError:
+            self._respond(req, 'error:bad request "%s"' % req.line)
+            return
+        t1 = time.time()
+
+        def fetched(jpeg, error):
+            if error:
+                self._respond(req, 'error:%s' % error)
+                return
+            # per-minute archive name may be shared by requests close together; analysis never reads it back
+            fname = self.snap_filename('unknown')
+            self.archive.submit(fname, jpeg)
+            snap = (jpeg, fname, datetime.datetime.fromtimestamp(t1))
+            self.pool.apply_async(_guarded, (analyze, snap), callback=lambda out: self._from_pool(analyzed, out))
+
+        def analyzed(res, error):
+            if error:
+                self._respond(req, 'error:%s' % error)
+            else:
+                state, median = res
+                self._respond(req, format_response(state, want_state, median))
+
+        self._fetches.append(CameraFetch(self.camera_url, fetched, timeout=self.fetch_timeout, map=self.map))
+
+    def _from_pool(self, func, out):
+        # runs on a pool thread: hand (result, error) to loop thread and wake it
+        self._done.put((func, out))
+        os.write(self._wake_w, 'x')
+
+    def _drain(self):
+        os.read(self._wake_r, 4096)
+        while True:
+            try:
+                func, out = self._done.get_nowait()
+            except Empty:
+                break
+            func(*out)
+
+    def _respond(self, req, response):
+        if response.startswith('error:'):
+            self.stats['errors'] += 1
+            self._log('Request "%s" failed: %s' % (req.line, response))
+        self.stats['responses'] += 1
+        req.response = response
+        if req.conn.connected:
+            req.conn.flush_ready()
+
+    def _check_timeouts(self):
+        now = time.time()
+        for f in self._fetches:
+            f.check_timeout(now)
+        self._fetches = [f for f in self._fetches if not f._done]
+
+    def serve_forever(self, tick=0.05):
+        """run event loop until stop() is called (from any thread)"""
+        while not self._stop.is_set():
+            asyncore.loop(timeout=tick, map=self.map, count=1)
+            self._check_timeouts()
+        self._shutdown()
+
+    def stop(self):
+        self._stop.set()
+
+    def _shutdown(self):
+        self.pool.close()
+        self.pool.join()
+        self.archive.flush()
+        for d in self.map.values():
+            d.close()
+        os.close(self._wake_w)
+
+
+if __name__ == "__main__":
+
+    from pims.files.log import my_logger
+    from foscam_snap import FoscamSnap
+
+    HOST, PORT = "192.168.1.103", 9998
+    FOSCAM_INI_FILE = '/Users/ken/config/foscam/cgi_snap.ini'
+
+    logger = my_logger('event_loop_server')
+    fcsnap = FoscamSnap(FOSCAM_INI_FILE)
+    server = GarageServer((HOST, PORT), fcsnap.url, fcsnap.snap_filename, logger=logger)
+    logger.info('Event loop server listening on %s:%d.' % server.socket.getsockname())
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Server got KeyboardInterrupt.')
+        server.stop()
+        server._shutdown()
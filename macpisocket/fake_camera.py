@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""A local stand-in for the Foscam's snapshot cgi, for tests and benchmarks of the garage servers.
+
+This module provides a threaded HTTP server that answers every GET with the next JPEG from a list of files
+(cycling), optionally after a delay to mimic the camera's round trip.
+
+Example:
+    Serve the data folder's snapshots on port 8088 with a quarter second of latency::
+
+        $ python fake_camera.py 8088 0.25 ../data/2017*.jpg
+
+"""
+
+import time
+import threading
+import SocketServer
+import BaseHTTPServer
+
+
+class FakeCameraHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the camera's own web server
+
+    def do_GET(self):
+        if self.server.take_failure():
+            self.send_error(503, 'fake camera busy')
+            return
+        jpeg = self.server.next_jpeg()
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(jpeg)))
+        self.end_headers()
+        self.wfile.write(jpeg)
+
+    def log_message(self, fmt, *args):
+        pass  # quiet
+
+
+class FakeCamera(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    """A threaded HTTP server that serves JPEG files in turn, like the camera's snapPicture2 cgi.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, files, address=('127.0.0.1', 0), delay=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeCameraHandler)
+        self.jpegs = [open(f, 'rb').read() for f in files]  #: list: JPEG bytes served in turn
+        self.delay = delay     #: float: seconds each response is held back
+        self.requests = 0      #: int: count of snapshots served
+        self.connections = 0   #: int: count of client connections accepted
+        self.failures = 0      #: int: answer this many upcoming requests with 503 (to exercise retries)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def __str__(self):
+        return 'FakeCamera at %s serving %d jpegs (%d requests)' % (self.url, len(self.jpegs), self.requests)
+
+    @property
+    def url(self):
+        """str: snapshot url like the real camera's cgi (credentials are ignored)"""
+        host, port = self.server_address[0:2]
+        return 'http://%s:%d/cgi-bin/CGIProxy.fcgi?cmd=snapPicture2&usr=fake&pwd=fake' % (host, port)
+
+    def get_request(self):
+        conn = BaseHTTPServer.HTTPServer.get_request(self)
+        with self._lock:
+            self.connections += 1
+        return conn
+
+    def take_failure(self):
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                return True
+        return False
+
+    def next_jpeg(self):
+        with self._lock:
+            jpeg = self.jpegs[self.requests % len(self.jpegs)]
+            self.requests += 1
+        return jpeg
+
+    def start(self):
+        """serve in a daemon thread; returns self"""
+        self._thread = threading.Thread(target=self.serve_forever, name='fake_camera')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    cam = FakeCamera(sys.argv[3:], address=('127.0.0.1', int(sys.argv[1])), delay=float(sys.argv[2]))
+    print cam
+    try:
+        cam.serve_forever()
+    except KeyboardInterrupt:
+        cam.server_close()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""Fetch snapshots from the Foscam cgi over a kept-alive HTTP/1.1 connection, straight into memory.
+
+This module provides a fetcher that reuses one connection to the camera (reconnecting when the camera or a
+timeout drops it), retries failed fetches with a short backoff, and hands back the JPEG bytes so analysis can
+decode them in memory (see decoder.decode_bytes) while a background writer thread archives them to disk.
+
+Example:
+    Snap a few pictures over one connection and show how long each took::
+
+        $ python foscam_fetch.py /Users/ken/config/foscam/cgi_snap.ini 5
+
+"""
+
+import os
+import time
+import socket
+import httplib
+import tempfile
+import threading
+import urlparse
+from Queue import Queue
+
+from foscam_snap import FoscamSnap
+
+
+class FetchError(Exception):
+    """raised when a snapshot could not be fetched (after retries)"""
+    pass
+
+
+class CameraFetcher(object):
+
+    """Get snapshot JPEG bytes from camera cgi url, reusing one HTTP/1.1 connection.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, url, timeout=5.0, retries=2, backoff=0.25):
+        parts = urlparse.urlsplit(url)
+        self.url = url              #: str: camera snapshot cgi url
+        self.host = parts.hostname  #: str: camera host
+        self.port = parts.port or 80  #: int: camera port
+        self.path = parts.path + ('?' + parts.query if parts.query else '')  #: str: request path with query
+        self.timeout = timeout      #: float: seconds for connect and for each read
+        self.retries = retries      #: int: extra attempts after a failed fetch
+        self.backoff = backoff      #: float: seconds to wait before first retry (doubles each retry)
+        self.stats = dict.fromkeys(['fetches', 'connects', 'retries', 'bytes'], 0)  #: dict: counters
+        self._conn = None
+        self._lock = threading.Lock()  # one request at a time on the one connection
+
+    def __str__(self):
+        return 'CameraFetcher for %s:%d %s' % (self.host, self.port, self.stats)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.stats['connects'] += 1
+        return self._conn
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _fetch_once(self):
+        conn = self._connection()
+        conn.request('GET', self.path, headers={'Connection': 'keep-alive'})
+        resp = conn.getresponse()
+        data = resp.read()  # read it all, so connection is ready for next request
+        if resp.will_close:
+            self._close()
+        if resp.status != 200:
+            raise FetchError('camera said %d %s' % (resp.status, resp.reason))
+        ctype = resp.getheader('content-type', '')
+        if not data.startswith('\xff\xd8'):
+            raise FetchError('camera sent %d bytes of %s that are not a JPEG' % (len(data), ctype or 'unknown'))
+        return data
+
+    def fetch(self):
+        """return JPEG bytes of a freshly snapped picture; raises FetchError if all attempts fail"""
+        with self._lock:
+            delay = self.backoff
+            for attempt in range(self.retries + 1):
+                try:
+                    data = self._fetch_once()
+                    self.stats['fetches'] += 1
+                    self.stats['bytes'] += len(data)
+                    return data
+                except (socket.error, httplib.HTTPException, FetchError), e:
+                    self._close()  # do not trust a connection after any failure
+                    error = e
+                if attempt < self.retries:
+                    self.stats['retries'] += 1
+                    time.sleep(delay)
+                    delay *= 2
+            raise FetchError('no snapshot from %s:%d after %d attempts: %s' % (self.host, self.port,
+                                                                              self.retries + 1, error))
+
+
+def write_file_atomic(fname, data):
+    """write data to fname via temp file and rename, so readers (like watcher.py) never see a partial file"""
+    dirname = os.path.dirname(os.path.abspath(fname))
+    fd, tmp = tempfile.mkstemp(prefix='.tmp_', suffix='.jpg', dir=dirname)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp, 0644)
+    os.rename(tmp, fname)
+
+
+class ArchiveWriter(threading.Thread):
+
+    """A daemon thread that writes (fname, data) jobs to disk so callers need not wait on the write.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, logger=None):
+        threading.Thread.__init__(self, name='archive_writer')
+        self.daemon = True
+        self.logger = logger  #: logging.Logger: for write failures; None to stay quiet
+        self.written = 0      #: int: files written
+        self.errors = 0       #: int: writes that failed
+        self._queue = Queue()
+
+    def submit(self, fname, data):
+        self._queue.put((fname, data))
+
+    def flush(self):
+        """block until every submitted file has been written (or failed)"""
+        self._queue.join()
+
+    def run(self):
+        while True:
+            fname, data = self._queue.get()
+            try:
+                write_file_atomic(fname, data)
+                self.written += 1
+            except (IOError, OSError), e:
+                self.errors += 1
+                if self.logger:
+                    self.logger.warning('could not archive %s: %s' % (fname, e))
+            finally:
+                self._queue.task_done()
+
+
+class PooledFoscamSnap(FoscamSnap):
+
+    """A FoscamSnap that fetches over a kept-alive connection and archives to disk in the background.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, ini_file, timeout=5.0, retries=2, logger=None):
+        FoscamSnap.__init__(self, ini_file)
+        self.fetcher = CameraFetcher(self.url, timeout=timeout, retries=retries)  #: CameraFetcher: keep-alive
+        self.writer = ArchiveWriter(logger=logger)  #: ArchiveWriter: background archive of snapped pictures
+        self.writer.start()
+
+    def snap_bytes(self, state):
+        """Snap picture into memory; its archive file gets written in the background.
+
+        Returns 2-tuple (fname, data) of archive filename (may not exist yet) and JPEG bytes.
+
+        """
+        data = self.fetcher.fetch()
+        fname = self.snap_filename(state)
+        self.writer.submit(fname, data)
+        return fname, data
+
+    def snap_picture(self, state):
+        """return output filename of snapped image (written before we return, like FoscamSnap)"""
+        data = self.fetcher.fetch()
+        fname = self.snap_filename(state)
+        write_file_atomic(fname, data)
+        return fname
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    snapper = PooledFoscamSnap(sys.argv[1])
+    for i in range(int(sys.argv[2]) if len(sys.argv) > 2 else 3):
+        t1 = time.time()
+        fname, data = snapper.snap_bytes('unknown')
+        print '%s %d bytes in %.3f sec' % (fname, len(data), time.time() - t1)
+    snapper.writer.flush()
+    print snapper.fetcher
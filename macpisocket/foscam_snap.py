@@ -37,10 +37,19 @@ class FoscamSnap(object):
                                                                                         self._username,
                                                                                         self._password)
     
+    @property
+    def url(self):
+        """str: cgi url that returns a freshly snapped JPEG"""
+        return self._url
+
+    def snap_filename(self, state):
+        """return output filename for image snapped now, LIKE /outdir/2017-11-20_06_25_unknown.jpg"""
+        bname = datetime.datetime.now().strftime('%Y-%m-%d_%H_%M') + '_' + state + '.jpg'
+        return os.path.join(self.output_dir, bname)
+
     def snap_picture(self, state):
         """return output filename of snapped image"""
-        bname = datetime.datetime.now().strftime('%Y-%m-%d_%H_%M') + '_' + state + '.jpg'
-        fname = os.path.join(self.output_dir, bname)
+        fname = self.snap_filename(state)
         filename = wget.download(self._url, fname, False)
         return filename
 
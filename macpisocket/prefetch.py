@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""Keep snapping and classifying webcam frames in the background so requests can be answered from a recent one.
+
+This module provides a prefetcher thread that snaps a picture at a fixed cadence, classifies it and keeps the
+most recent results in a ring buffer of (timestamp, verdict, median, fname, confidence) entries. A request is
+answered from the newest entry if it is young enough; otherwise a fresh snap is forced (at most one camera round
+trip is in flight at a time, and a request that waited on someone else's snap reuses that one).
+
+"""
+
+import time
+import datetime
+import threading
+from collections import deque, namedtuple
+
+from fauxmo_garage.fcimage import FoscamImage
+from async_socket_common import AnalysisResults
+
+#: one classified frame; timestamp is time.time() when the snap was requested (so age errs on the old side)
+FrameVerdict = namedtuple('FrameVerdict', ['timestamp', 'verdict', 'median', 'fname', 'confidence'])
+
+
+class Prefetcher(threading.Thread):
+
+    """A daemon thread that snaps and classifies frames into a ring buffer.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, snapper, interval=5.0, maxlen=60, logger=None, aggregator=None):
+        threading.Thread.__init__(self, name='prefetcher')
+        self.daemon = True
+        self.snapper = snapper     #: PooledFoscamSnap (or anything with snap_bytes(state) returning (fname, jpeg))
+        self.interval = interval   #: float: seconds between background snaps
+        self.ring = deque(maxlen=maxlen)  #: deque: most recent FrameVerdict entries (newest last)
+        self.logger = logger       #: logging.Logger: for background snap failures; None to stay quiet
+        self.aggregator = aggregator  #: aggregator.HistogramAggregator: counts frames by verdict; None to skip
+        self.stats = dict.fromkeys(['background', 'forced', 'cached', 'errors'], 0)  #: dict: counts by kind
+        self._snap_lock = threading.Lock()  # one camera round trip at a time
+        self._stop_event = threading.Event()
+
+    def __str__(self):
+        return 'Prefetcher every %.1f sec, %d of %d entries %s' % (self.interval, len(self.ring), self.ring.maxlen,
+                                                                  self.stats)
+
+    def snap(self, kind='forced'):
+        """snap and classify a frame now; returns its FrameVerdict (also appended to ring)"""
+        with self._snap_lock:
+            return self._snap(kind)
+
+    def _snap(self, kind):
+        # caller holds _snap_lock
+        t = time.time()
+        fname, jpeg = self.snapper.snap_bytes('unknown')  # archive file (if any) gets written in the background
+        fci = FoscamImage.from_bytes(jpeg, name=fname, dtm=datetime.datetime.fromtimestamp(t), state='unknown',
+                                     roi_only=True)
+        ar = AnalysisResults(fci)
+        ar.compute()
+        if self.aggregator is not None:
+            self.aggregator.add_verdict(ar.fcimage, ar.state)
+            self.aggregator.maybe_save()
+        entry = FrameVerdict(t, ar.state, ar.median, fname, ar.confidence)
+        self.ring.append(entry)
+        self.stats[kind] += 1
+        return entry
+
+    def latest(self):
+        """return newest FrameVerdict; None if there is none yet"""
+        try:
+            return self.ring[-1]
+        except IndexError:
+            return None
+
+    def get(self, max_age=10.0):
+        """Get a verdict from a frame no older than max_age seconds, snapping a fresh one only if needed.
+
+        Returns 2-tuple (entry, cached) of FrameVerdict and True if it came from the ring buffer.
+
+        """
+        entry = self.latest()
+        if entry is not None and time.time() - entry.timestamp <= max_age:
+            self.stats['cached'] += 1
+            return entry, True
+        with self._snap_lock:
+            # someone else's snap may have finished while we waited for the lock
+            entry = self.latest()
+            if entry is not None and time.time() - entry.timestamp <= max_age:
+                self.stats['cached'] += 1
+                return entry, True
+            return self._snap('forced'), False
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.snap('background')
+            except Exception, e:
+                self.stats['errors'] += 1
+                if self.logger:
+                    self.logger.warning('prefetch snap failed: %s' % e)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""A framed, versioned binary wire protocol for garage door queries over persistent connections.
+
+Every message is a fixed 12-byte header followed by a body of the length the header gives, so either side can
+read exactly one message no matter how TCP splits or joins the bytes (no recv(1024) guessing).
+
+Header (network byte order)::
+
+    magic   4s  'FXGW'
+    version B   WIRE_VERSION
+    kind    B   KIND_REQUEST or KIND_RESPONSE
+    spare   H   zero
+    length  I   bytes of body that follow
+
+Request body: request_id (I), want (B state code), client name (H length + utf-8 bytes).
+
+Response body: request_id (I), verdict (B state code), trigger_button (B), median (f), confidence (f),
+timings count (H) then that many (B length + name bytes, d seconds), and error (H length + utf-8 bytes).
+
+Responses come back in request order on a connection, so a client may pipeline (send several requests before
+reading any responses).
+
+"""
+
+import socket
+import struct
+import threading
+import SocketServer
+from collections import namedtuple
+
+MAGIC = 'FXGW'
+WIRE_VERSION = 1
+KIND_REQUEST = 1
+KIND_RESPONSE = 2
+MAX_BODY = 1 << 20  # refuse bodies larger than this (1 MB), rather than trying to allocate them
+
+STATES = ['unknown', 'open', 'close']  # state code is index into this list
+
+_HEADER = struct.Struct('>4sBBHI')
+_REQUEST = struct.Struct('>IB')
+_RESPONSE = struct.Struct('>IBBffH')
+_TIMING = struct.Struct('>d')
+_LEN8 = struct.Struct('>B')
+_LEN16 = struct.Struct('>H')
+
+#: client asks about door: want is state it wants (open, close or unknown for just asking)
+Request = namedtuple('Request', ['request_id', 'want', 'client'])
+
+#: server answers: timings is dict of stage name -> seconds; error is '' unless something went wrong
+Response = namedtuple('Response', ['request_id', 'verdict', 'trigger_button', 'median', 'confidence', 'timings',
+                                   'error'])
+
+
+class WireError(Exception):
+    """raised for malformed, unexpected or truncated messages"""
+    pass
+
+
+def _state_code(state):
+    try:
+        return STATES.index(state)
+    except ValueError:
+        raise WireError('state "%s" is not among %s' % (state, STATES))
+
+
+def _state_name(code):
+    try:
+        return STATES[code]
+    except IndexError:
+        raise WireError('state code %d is not valid' % code)
+
+
+def _pack_str(s, lenstruct):
+    b = s.encode('utf-8') if isinstance(s, unicode) else s
+    return lenstruct.pack(len(b)) + b
+
+
+def _unpack_str(body, offset, lenstruct):
+    n = lenstruct.unpack_from(body, offset)[0]
+    offset += lenstruct.size
+    if offset + n > len(body):
+        raise WireError('string runs past end of message body')
+    return body[offset:offset + n].decode('utf-8'), offset + n
+
+
+def frame(kind, body):
+    """return header + body bytes for message of kind"""
+    return _HEADER.pack(MAGIC, WIRE_VERSION, kind, 0, len(body)) + body
+
+
+def pack_request(req):
+    """return framed bytes for Request"""
+    return frame(KIND_REQUEST, _REQUEST.pack(req.request_id, _state_code(req.want)) + _pack_str(req.client, _LEN16))
+
+
+def unpack_request(body):
+    """return Request from message body bytes"""
+    try:
+        request_id, want = _REQUEST.unpack_from(body, 0)
+        client, offset = _unpack_str(body, _REQUEST.size, _LEN16)
+    except struct.error, e:
+        raise WireError('bad request body: %s' % e)
+    return Request(request_id, _state_name(want), client)
+
+
+def pack_response(resp):
+    """return framed bytes for Response"""
+    parts = [_RESPONSE.pack(resp.request_id, _state_code(resp.verdict), int(bool(resp.trigger_button)),
+                            resp.median, resp.confidence, len(resp.timings))]
+    for name, sec in sorted(resp.timings.items()):
+        parts.append(_pack_str(name, _LEN8) + _TIMING.pack(sec))
+    parts.append(_pack_str(resp.error, _LEN16))
+    return frame(KIND_RESPONSE, ''.join(parts))
+
+
+def unpack_response(body):
+    """return Response from message body bytes"""
+    try:
+        request_id, verdict, trigger, median, confidence, ntimings = _RESPONSE.unpack_from(body, 0)
+        offset = _RESPONSE.size
+        timings = dict()
+        for i in range(ntimings):
+            name, offset = _unpack_str(body, offset, _LEN8)
+            timings[name] = _TIMING.unpack_from(body, offset)[0]
+            offset += _TIMING.size
+        error, offset = _unpack_str(body, offset, _LEN16)
+    except struct.error, e:
+        raise WireError('bad response body: %s' % e)
+    return Response(request_id, _state_name(verdict), bool(trigger), median, confidence, timings, error)
+
+
+def recv_exactly(sock, n):
+    """return exactly n bytes from sock; raises EOFError if peer closes first (at message boundary or not)"""
+    chunks = []
+    remaining = n
+    while remaining:
+        chunk = sock.recv(min(remaining, 256 * 1024))
+        if not chunk:
+            raise EOFError('connection closed with %d of %d bytes unread' % (remaining, n))
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return ''.join(chunks)
+
+
+def read_message(sock, expect_kind):
+    """read one framed message of expect_kind from sock; returns its body bytes"""
+    magic, version, kind, spare, length = _HEADER.unpack(recv_exactly(sock, _HEADER.size))
+    if magic != MAGIC:
+        raise WireError('bad magic %r' % magic)
+    if version != WIRE_VERSION:
+        raise WireError('wire version %d not supported (we speak %d)' % (version, WIRE_VERSION))
+    if kind != expect_kind:
+        raise WireError('expected message kind %d, got %d' % (expect_kind, kind))
+    if length > MAX_BODY:
+        raise WireError('message body of %d bytes is too big' % length)
+    return recv_exactly(sock, length)
+
+
+class WireRequestHandler(SocketServer.BaseRequestHandler):
+
+    """Serve framed requests on one persistent connection until the client closes it.
+
+    The server must have an answer attribute: callable(Request) -> Response.
+
+    """
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                body = read_message(self.request, KIND_REQUEST)
+            except EOFError:
+                return  # client closed connection between (or mid) requests
+            req = unpack_request(body)
+            self.request.sendall(pack_response(self.server.answer(req)))
+
+
+class WireClient(object):
+
+    """A client that keeps one connection open and can pipeline requests.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, ip, port, client=None, timeout=30.0):
+        self.address = (ip, port)                    #: tuple: (ip, port) of server
+        self.client = client or socket.gethostname()  #: str: name we send with each request
+        self.timeout = timeout                       #: float: socket timeout in seconds
+        self.sock = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        if self.sock is None:
+            self.sock = socket.create_connection(self.address, self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def pipeline(self, wants):
+        """Send one request per wanted state, then read all the responses.
+
+        Returns list of Response in the order of wants.
+
+        """
+        with self._lock:
+            self.connect()
+            reqs = []
+            for want in wants:
+                self._next_id = (self._next_id + 1) & 0xffffffff
+                reqs.append(Request(self._next_id, want, self.client))
+            try:
+                self.sock.sendall(''.join(pack_request(r) for r in reqs))
+                responses = [unpack_response(read_message(self.sock, KIND_RESPONSE)) for r in reqs]
+            except (socket.error, EOFError, WireError):
+                self.close()  # connection state unknown, so next call reconnects
+                raise
+        for req, resp in zip(reqs, responses):
+            if resp.request_id != req.request_id:
+                self.close()
+                raise WireError('response id %d does not match request id %d' % (resp.request_id, req.request_id))
+        return responses
+
+    def request(self, want):
+        """return Response to one request; reconnects once if the kept-open connection went stale"""
+        try:
+            return self.pipeline([want])[0]
+        except (socket.error, EOFError):
+            return self.pipeline([want])[0]
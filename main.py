@@ -116,12 +116,17 @@ if __name__ == '__main__':
     
     import numpy as np
     from fcimage import FoscamImage
-    from flimsy_constants import MEDIAN_THRESHOLD
+    from threshold import ThresholdEngine, scene_brightness
+    from flimsy_constants import MEDIAN_THRESHOLD, DEFAULT_THRESHOLD_FILE
     
     fname = get_most_recent_pic()
-    fci = FoscamImage(fname)
+    fci = FoscamImage(fname, roi_only=True)  # same mode as the server's verdicts (full frame differs by a count)
     med = np.median(fci.roi_luminance)
-    if med < MEDIAN_THRESHOLD:
+    thresh = MEDIAN_THRESHOLD
+    if os.path.exists(DEFAULT_THRESHOLD_FILE):
+        # learned threshold for this time of day and scene light (see threshold.py)
+        thresh = ThresholdEngine().threshold(fci.foscam_file.dtm.hour, scene_brightness(fci.image))
+    if med < thresh:
         guess = 'open'
     else:
         guess = 'close'
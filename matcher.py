@@ -1,6 +1,26 @@
 #!/usr/bin/env python
 
 import cv2
+from collections import namedtuple
+
+from flimsy_constants import TEMPLATE_XY
+
+
+#: cv2.matchTemplate method name -> 2-tuple (method, True if best match is minimum); see template_eval.py for how
+#: they compare on the archive
+TM_METHODS = {
+    'TM_CCOEFF': (cv2.TM_CCOEFF, False),
+    'TM_CCOEFF_NORMED': (cv2.TM_CCOEFF_NORMED, False),
+    'TM_CCORR': (cv2.TM_CCORR, False),
+    'TM_CCORR_NORMED': (cv2.TM_CCORR_NORMED, False),
+    'TM_SQDIFF': (cv2.TM_SQDIFF, True),
+    'TM_SQDIFF_NORMED': (cv2.TM_SQDIFF_NORMED, True),
+}
+DEFAULT_TM_METHOD = 'TM_CCOEFF_NORMED'  # production method (template_eval.choose_default picks from data)
+
+#: found template: xywh is 4-tuple of pixel values, score is peak correlation, path says how it was searched
+#: ('full' for whole frame, 'window' for near last location, 'fallback' for whole frame after window missed)
+TemplateMatch = namedtuple('TemplateMatch', ['xywh', 'score', 'path'])
 
 
 def convert_vertices_to_xywh(tleft, bright):
@@ -54,40 +74,190 @@ def convert_offsetxy_wh_to_vertices(top_left, offsetxy_wh):
 
 def match_template(img, template):
     """Match a subset image (template) within the input image (img).
+
+    Returns tuple (x, y, w, h) for pixel values where template was best matched in img (see find_template)."""
+    return find_template(img, template).xywh
+
+
+def best_match(res, method_name):
+    """return 2-tuple (score, (x, y)) of best match in matchTemplate result res for method_name (see TM_METHODS)"""
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+    if TM_METHODS[method_name][1]:
+        return min_val, min_loc  # squared difference methods: lower is better
+    return max_val, max_loc
+
+
+def find_template(img, template, method_name=DEFAULT_TM_METHOD):
+    """Match a subset image (template) within the input image (img).
     
-    Returns tuple (x, y, w, h) for pixel values where template was best matched in img.
+    Returns TemplateMatch with xywh tuple (x, y, w, h) for pixel values where template was best matched in img
+    along with the peak correlation score.
     -------
     Output:
-    found_xywh -- 4-tuple of pixel values:
-                  (1) x coord where top_left of template was found in img
-                  (1) y coord where top_left of template was found in img
-                  (3) width of template
-                  (4) height of template
+    found -- TemplateMatch with fields:
+             xywh  -- 4-tuple of pixel values:
+                      (1) x coord where top_left of template was found in img
+                      (1) y coord where top_left of template was found in img
+                      (3) width of template
+                      (4) height of template
+             score -- float peak normalized correlation coefficient (1.0 is perfect match) for the default
+                      method; for others, its best matchTemplate value (lowest for TM_SQDIFF methods)
+             path  -- string 'full' for search over entire img
 
     Input arguments:
     img      -- input image we search for template
     template -- template image used for searching in img
 
+    Keyword arguments:
+    method_name -- string key of TM_METHODS (template_eval.py compares them over the archive, by time of day)
+
     """
     h, w = template.shape[0:2]  # FIXME does this work for all cv2's
-    
-    # TODO use large collection of images to find which method works best (maybe some better in dark?)
-    # TODO some methods use max_loc while others use min_loc for where template best matches
-    # TODO there is a 7th method that we discarded for poor performance early on
-    #methods = ['cv2.TM_CCOEFF', 'cv2.TM_CCOEFF_NORMED', 'cv2.TM_CCORR_NORMED', 'cv2.TM_SQDIFF', 'cv2.TM_SQDIFF_NORMED']
-    #
-    # TODO to iterate through list of methods for testing, use following:
-    #for meth in methods:
-    #    method = eval(meth)
-
-    # apply template matching
-    res = cv2.matchTemplate(img, template, cv2.TM_CCOEFF_NORMED)
-    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-    
-    # for this method, we want maximum, max_loc (NOTE: other methods use minimum, min_loc)
-    found_xywh = max_loc + (w, h)
 
-    return found_xywh
+    # apply template matching; some methods want maximum (max_loc), others minimum (min_loc)
+    res = cv2.matchTemplate(img, template, TM_METHODS[method_name][0])
+    score, loc = best_match(res, method_name)
+    found_xywh = loc + (w, h)
+
+    return TemplateMatch(found_xywh, score, 'full')
+
+
+def find_template_windowed(img, template, last_xy=TEMPLATE_XY, margin=24, min_score=0.6, scale=1):
+    """Match template within a window around where it was last found, searching the full image only if that misses.
+
+    Returns TemplateMatch (see find_template) whose path is 'window' if the peak correlation within the window
+    reached min_score, otherwise the result of full-image search with path 'fallback'.
+    -------
+    Output:
+    found -- TemplateMatch with xywh in img (absolute) pixel coords
+
+    Input arguments:
+    img      -- input image we search for template
+    template -- template image used for searching in img
+
+    Keyword arguments:
+    last_xy   -- 2-tuple (x, y) of top-left where template was last found in full-size pixel coords
+    margin    -- int full-size pixels of slack on each side of the template's last location
+    min_score -- float peak correlation below which window result is not trusted
+    scale     -- int downscale factor of img relative to full size (like FoscamImage.scale for reduced decodes)
+
+    """
+    h, w = template.shape[0:2]
+    last_xy, margin = (last_xy[0] // scale, last_xy[1] // scale), max(1, margin // scale)
+    x0, y0 = max(0, last_xy[0] - margin), max(0, last_xy[1] - margin)
+    x1, y1 = min(img.shape[1], last_xy[0] + w + margin), min(img.shape[0], last_xy[1] + h + margin)
+    if x1 - x0 >= w and y1 - y0 >= h:
+        res = cv2.matchTemplate(img[y0:y1, x0:x1], template, cv2.TM_CCOEFF_NORMED)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        if max_val >= min_score:
+            return TemplateMatch((max_loc[0] + x0, max_loc[1] + y0, w, h), max_val, 'window')
+    return find_template(img, template)._replace(path='fallback')
+
+
+def _coarse_peaks(res, count, radius):
+    """return list of up to count (score, (x, y)) peaks in res, suppressing radius pixels around each one found"""
+    res = res.copy()
+    peaks = []
+    for i in range(count):
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+        peaks.append((max_val, max_loc))
+        x, y = max_loc
+        res[max(0, y - radius):y + radius + 1, max(0, x - radius):x + radius + 1] = -1.0
+    return peaks
+
+
+def find_template_pyramid(img, template, level=4, scales=(1.0,), candidates=3, refine=4):
+    """Match template coarse-to-fine: search all of a downsampled image, then refine at full resolution nearby.
+
+    Returns TemplateMatch (see find_template) with path 'pyramid'; xywh width and height are those of the
+    (possibly rescaled) template that matched best.
+    -------
+    Output:
+    found -- TemplateMatch with xywh in img (absolute) pixel coords
+
+    Input arguments:
+    img      -- input image we search for template
+    template -- template image used for searching in img
+
+    Keyword arguments:
+    level      -- int downsample factor for coarse search (like 4 or 8)
+    scales     -- sequence of template size factors to try (like 0.9, 1.0, 1.1 after a zoom or refocus); in
+                  daylight a smaller template tends to score a bit higher, so only widen this when needed
+    candidates -- int number of coarse peaks (per scale) refined at full resolution; daytime frames have
+                  competing peaks within a few coarse pixels of each other
+    refine     -- int pixels of slack (beyond one coarse pixel) on each side of coarse peak for full-res search
+
+    """
+    ih, iw = img.shape[0:2]
+    small = cv2.resize(img, (iw // level, ih // level), interpolation=cv2.INTER_AREA)
+    th, tw = template.shape[0:2]
+    best = None
+    for scale in scales:
+        w, h = int(round(tw * scale)), int(round(th * scale))
+        if w // level < 2 or h // level < 2 or w > iw or h > ih:
+            continue
+        tmp = template if scale == 1.0 else cv2.resize(template, (w, h), interpolation=cv2.INTER_AREA)
+        small_tmp = cv2.resize(tmp, (w // level, h // level), interpolation=cv2.INTER_AREA)
+        res = cv2.matchTemplate(small, small_tmp, cv2.TM_CCOEFF_NORMED)
+        for coarse_score, (x, y) in _coarse_peaks(res, candidates, radius=2):
+            # coarse pixel covers level full-res pixels, so window has to allow that much slack plus refine
+            found = find_template_windowed(img, tmp, last_xy=(x * level, y * level), margin=level + refine,
+                                           min_score=-1.0)
+            if best is None or found.score > best.score:
+                best = found
+    if best is None:
+        return find_template(img, template)._replace(path='fallback')
+    return best._replace(path='pyramid')
+
+
+#: search method name -> function(img, template) returning TemplateMatch
+SEARCH_METHODS = {
+    'full': find_template,
+    'window': find_template_windowed,
+    'pyramid': find_template_pyramid,
+}
+
+
+def run_search(search, img, template, scale=1):
+    """return TemplateMatch from search callable, telling the ones that work in full-size coords the img scale"""
+    if search is find_template_windowed or isinstance(search, WindowedMatcher):
+        return search(img, template, scale=scale)
+    return search(img, template)
+
+
+def get_search_method(method):
+    """return search function for method name (key of SEARCH_METHODS)"""
+    try:
+        return SEARCH_METHODS[method]
+    except KeyError:
+        raise ValueError('search method "%s" is not among %s' % (method, sorted(SEARCH_METHODS.keys())))
+
+
+class WindowedMatcher(object):
+
+    """A template search callable that remembers where the template was last found (see find_template_windowed).
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, last_xy=TEMPLATE_XY, margin=24, min_score=0.6):
+        self.last_xy = last_xy      #: tuple: (x, y) top-left where template was last found (full-size pixels)
+        self.margin = margin        #: int: full-size pixels of slack on each side of last location
+        self.min_score = min_score  #: float: peak correlation below which we fall back to full-image search
+        self.paths = dict.fromkeys(['window', 'fallback'], 0)  #: dict: count of searches by path taken
+
+    def __str__(self):
+        return 'WindowedMatcher at %s +/- %d px (min_score=%.2f) %s' % (self.last_xy, self.margin, self.min_score,
+                                                                       self.paths)
+
+    def __call__(self, img, template, scale=1):
+        found = find_template_windowed(img, template, last_xy=self.last_xy, margin=self.margin,
+                                       min_score=self.min_score, scale=scale)
+        self.paths[found.path] += 1
+        if found.score >= self.min_score:
+            self.last_xy = (found.xywh[0] * scale, found.xywh[1] * scale)
+        return found
 
 
 def get_markup_image(img, rect_params):
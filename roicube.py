@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""A memory-mapped cube of roi luminance for the whole webcam snapshot archive.
+
+This module extracts the door roi luminance (and optionally the grayscale window where the template was found)
+from every snapshot once, into a (N, h, w) uint8 .npy file that later analyses memory-map instead of decoding
+thousands of JPEGs again. Next to the cube go two sidecar files:
+
+    roi_cube_index.csv  one row per snapshot: bname, dtm, state, fsize, mtime (and tx, ty, tscore with windows)
+    roi_cube_meta.json  processing parameters the cube was built with, plus its shapes
+
+Rebuilding a cube copies the rows of snapshots whose size and mtime are unchanged, so only new or changed
+files get decoded.
+
+Example:
+    Build (or bring up to date) the cube for a few days of snapshots, then time stats from it::
+
+        $ python roicube.py 2017-11-10 2017-11-17
+
+"""
+
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+
+from deck import map_images
+from fcimage import FoscamImage, parse_foscam_filenames
+from roistack import RoiStack
+from flimsy_constants import DEFAULT_ROI_CUBE, DEFAULT_TEMPLATE
+
+
+def cube_files(cube_file):
+    """return 4-tuple (cube, window cube, index, meta) of filenames that make up cube_file"""
+    stem = os.path.splitext(cube_file)[0]
+    return cube_file, stem + '_window.npy', stem + '_index.csv', stem + '_meta.json'
+
+
+def extract_roi(fci):
+    """return 4-tuple (roi luminance, None, (0, 0), 0.0) for FoscamImage, fci (module-level for map_images)"""
+    return fci.roi_luminance, None, (0, 0), 0.0
+
+
+def extract_roi_and_window(fci):
+    """return 4-tuple (roi luminance, template window, (tx, ty), tscore) for FoscamImage, fci"""
+    match = fci.template_match
+    x, y, w, h = match.xywh
+    if fci.image.ndim == 2:
+        L = fci.image  # grayscale decode mode, so gray stands in for luminance
+    else:
+        L = fci.lab[0]
+    return fci.roi_luminance, L[y:y + h, x:x + w].copy(), (x, y), float(match.score)
+
+
+def cube_params(tmp_name, decode, blursize, cliplim, gridsize):
+    """return str signature of processing parameters that a cube's contents depend on"""
+    tmp_mtime = os.stat(tmp_name).st_mtime
+    return 'decode=%s,blursize=%s,cliplim=%s,gridsize=%s,template=%s@%r' % (
+        decode, blursize, cliplim, gridsize, os.path.abspath(tmp_name), tmp_mtime)
+
+
+def _temp_name(fname):
+    fd, tmp = tempfile.mkstemp(prefix='.tmp_', suffix=os.path.splitext(fname)[1],
+                               dir=os.path.dirname(os.path.abspath(fname)))
+    os.close(fd)
+    return tmp
+
+
+def build_cube(filenames, cube_file=DEFAULT_ROI_CUBE, tmp_name=DEFAULT_TEMPLATE, windows=False, workers=None,
+               chunksize=None, block=2048, decode='color', blursize=5, cliplim=3.0, gridsize=8):
+    """Extract roi luminance of every snapshot into a memory-mapped cube (with sidecar index and meta files).
+
+    Returns 2-tuple (RoiCube, int number of snapshots that had to be decoded).
+    -------
+    Input arguments:
+    filenames -- list of full path image filenames (cube rows are in this order)
+
+    Keyword arguments:
+    cube_file -- string full path of .npy cube to write (see cube_files for its sidecars)
+    tmp_name  -- string for full path to template image
+    windows   -- True to also keep the grayscale window where the template was found (slower to build)
+    workers   -- int number of worker processes (see deck.map_images)
+    chunksize -- int number of images handed to a worker at a time (see deck.map_images)
+    block     -- int number of images decoded per pass, which bounds memory used while building
+    decode, blursize, cliplim, gridsize -- as for FoscamImage
+
+    """
+    if not filenames:
+        raise ValueError('no filenames to build cube from')
+    params = cube_params(tmp_name, decode, blursize, cliplim, gridsize)
+    bnames = [os.path.basename(f) for f in filenames]
+    stats = [os.stat(f) for f in filenames]
+
+    # rows of an existing cube built the same way can be copied for files unchanged since
+    old = None
+    if os.path.exists(cube_files(cube_file)[3]):
+        old = RoiCube(cube_file)
+        if old.params != params or (windows and old.windows is None):
+            old = None
+    reuse = dict()
+    if old is not None:
+        for i, (b, st) in enumerate(zip(bnames, stats)):
+            j = old.row(b)
+            if j is None or old.index['fsize'][j] != st.st_size:
+                continue
+            if abs(old.index['mtime'][j] - st.st_mtime) < 1e-5:  # index keeps mtime to the microsecond
+                reuse[i] = j
+    todo = [i for i in range(len(filenames)) if i not in reuse]
+
+    extract = extract_roi_and_window if windows else extract_roi
+    fci_kwargs = dict(decode=decode, blursize=blursize, cliplim=cliplim, gridsize=gridsize)
+    if old is not None:
+        roi_shape, win_shape = old.rois.shape[1:], old.windows.shape[1:] if windows else None
+    else:
+        first = map_images(extract, [filenames[todo[0]]], tmp_name=tmp_name, workers=1, **fci_kwargs)[0]
+        roi_shape, win_shape = first[0].shape, first[1].shape if windows else None
+
+    cube, wfile, ifile, mfile = cube_files(cube_file)
+    tmps = dict((f, _temp_name(f)) for f in [cube, ifile, mfile] + ([wfile] if windows else []))
+    n = len(filenames)
+    rois = open_memmap(tmps[cube], mode='w+', dtype=np.uint8, shape=(n,) + tuple(roi_shape))
+    wins = open_memmap(tmps[wfile], mode='w+', dtype=np.uint8, shape=(n,) + tuple(win_shape)) if windows else None
+    txy = np.zeros((n, 2), dtype=np.int32)
+    tscore = np.zeros(n)
+    for i, j in reuse.items():
+        rois[i] = old.rois[j]
+        if windows:
+            wins[i] = old.windows[j]
+            txy[i] = old.index['tx'][j], old.index['ty'][j]
+            tscore[i] = old.index['tscore'][j]
+
+    for start in range(0, len(todo), block):
+        rows = todo[start:start + block]
+        out = map_images(extract, [filenames[i] for i in rows], tmp_name=tmp_name, workers=workers,
+                         chunksize=chunksize, **fci_kwargs)
+        for i, (roi, win, xy, score) in zip(rows, out):
+            if roi.shape != tuple(roi_shape):
+                raise ValueError('%s roi has shape %s, not %s like the cube' % (filenames[i], roi.shape, roi_shape))
+            rois[i] = roi
+            if windows:
+                wins[i] = win
+                txy[i] = xy
+                tscore[i] = score
+    rois.flush()
+    del rois
+    if windows:
+        wins.flush()
+        del wins
+
+    index = pd.DataFrame({'bname': bnames, 'fsize': [st.st_size for st in stats],
+                          'mtime': [st.st_mtime for st in stats]}, columns=['bname', 'fsize', 'mtime'])
+    dtms, states = parse_foscam_filenames(bnames)
+    index.insert(1, 'dtm', dtms.astype('datetime64[ns]'))
+    index.insert(2, 'state', states)
+    if windows:
+        index['tx'], index['ty'], index['tscore'] = txy[:, 0], txy[:, 1], tscore
+    index.to_csv(tmps[ifile], index=False, float_format='%.6f')
+    meta = {'params': params, 'count': n, 'roi_shape': list(roi_shape),
+            'window_shape': list(win_shape) if windows else None}
+    with open(tmps[mfile], 'w') as f:
+        json.dump(meta, f, indent=1)
+
+    # meta file goes last, so a reader never pairs new meta with an old cube
+    if not windows and os.path.exists(wfile):
+        os.remove(wfile)
+    for fname in [cube, wfile, ifile, mfile]:
+        if fname in tmps:
+            os.chmod(tmps[fname], 0644)
+            os.rename(tmps[fname], fname)
+    return RoiCube(cube_file), len(todo)
+
+
+class RoiCube(object):
+
+    """A memory-mapped roi luminance cube with its index (see build_cube).
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, cube_file=DEFAULT_ROI_CUBE):
+        cube, wfile, ifile, mfile = cube_files(cube_file)
+        with open(mfile) as f:
+            self.meta = json.load(f)  #: dict: build parameters and shapes (see build_cube)
+        self.cube_file = cube_file                   #: str: full path of .npy cube
+        self.params = self.meta['params']            #: str: processing parameters signature (see cube_params)
+        self.rois = np.load(cube, mmap_mode='r')     #: numpy.memmap: (N, h, w) uint8 roi luminance
+        self.windows = None                          #: numpy.memmap: (N, th, tw) template windows; None if not kept
+        if self.meta['window_shape'] is not None:
+            self.windows = np.load(wfile, mmap_mode='r')
+        self.index = pd.read_csv(ifile, parse_dates=['dtm'])  #: pandas.DataFrame: one row per cube row
+        if not len(self.index) == len(self.rois) == self.meta['count']:
+            raise ValueError('cube %s has %d rows but its index has %d (expected %d)' % (
+                cube_file, len(self.rois), len(self.index), self.meta['count']))
+        self._rows = dict((b, i) for i, b in enumerate(self.index['bname']))
+
+    def __len__(self):
+        return len(self.rois)
+
+    def __str__(self):
+        return 'RoiCube %s of %d rois with shape %s' % (self.cube_file, len(self), self.rois.shape[1:])
+
+    def row(self, fname):
+        """return int cube row for fname (full path or basename), or None if it is not in the cube"""
+        return self._rows.get(os.path.basename(fname))
+
+    def rows(self, filenames):
+        """return int array of cube rows for filenames; raises KeyError if any are not in the cube"""
+        rows = [self.row(f) for f in filenames]
+        missing = [f for f, r in zip(filenames, rows) if r is None]
+        if missing:
+            raise KeyError('%d of %d files not in cube %s (rebuild it), like %s' % (
+                len(missing), len(filenames), self.cube_file, missing[0]))
+        return np.array(rows, dtype=np.intp)
+
+    def take(self, filenames):
+        """return (n, h, w) roi luminance for filenames: a zero-copy view when they are consecutive cube rows"""
+        rows = self.rows(filenames)
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return self.rois[rows[0]:rows[0] + len(rows)]
+        return self.rois[rows]
+
+    def roi_luminance(self, fname):
+        """return (h, w) zero-copy view of roi luminance for fname"""
+        return self.rois[self.rows([fname])[0]]
+
+    def fcimage(self, fname, **kwargs):
+        """return FoscamImage for fname whose roi_luminance is a view into the cube (see from_roi_luminance)"""
+        i = self.rows([fname])[0]
+        dtm = self.index['dtm'][i].to_pydatetime()
+        return FoscamImage.from_roi_luminance(self.rois[i], name=fname, dtm=dtm, state=self.index['state'][i],
+                                              fsize=int(self.index['fsize'][i]), **kwargs)
+
+    def roi_stack(self, filenames=None):
+        """return roistack.RoiStack for filenames (None for whole cube), sharing the cube's memory where it can"""
+        if filenames is None:
+            return RoiStack(list(self.index['bname']), self.rois)
+        return RoiStack(filenames, self.take(filenames))
+
+
+if __name__ == '__main__':
+
+    import sys
+    import time
+    from deck import Deck
+
+    deck = Deck(date_range=sys.argv[1:3], morning=False)
+    t1 = time.time()
+    rc, decoded = build_cube(deck.filenames)
+    print '%s built in %.1f sec (%d decoded)' % (rc, time.time() - t1, decoded)
+    t1 = time.time()
+    stats = rc.roi_stack().stats()
+    print 'stats for %d rois in %.2f sec' % (len(stats), time.time() - t1)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""Vectorized batch statistics of roi luminance across many webcam snapshots.
+
+This module stacks the roi luminance crops of a batch of snapshots (which all share the roi's shape) into one
+contiguous uint8 array of shape (N, h, w), so medians, percentiles, histograms and per-state aggregates each
+come from a single numpy call over the whole batch instead of one call per image.
+
+Example:
+    Stats for a few days of snapshots, then per-state aggregates::
+
+        $ python roistack.py 2017-11-10 2017-11-17
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from deck import map_images
+from fcimage import parse_foscam_filenames
+from flimsy_constants import DEFAULT_TEMPLATE, MEDIAN_THRESHOLD
+
+PERCENTILES = range(10, 100, 10)  # roi luminance percentiles (10th, 20th, ... 90th), like features.py
+
+
+def roi_luminance(fci):
+    """return (h, w) uint8 roi luminance for FoscamImage, fci (module-level so map_images can fan it out)"""
+    return fci.roi_luminance
+
+
+def stack_rois(rois):
+    """Stack equal-shaped roi luminance arrays into one contiguous array.
+
+    Returns numpy.ndarray (N, h, w) of uint8; raises ValueError if rois do not all have the same shape.
+    -------
+    Input arguments:
+    rois -- sequence of (h, w) roi luminance arrays
+
+    """
+    if len(rois) == 0:
+        return np.empty((0, 0, 0), dtype=np.uint8)
+    shape = rois[0].shape
+    stack = np.empty((len(rois),) + shape, dtype=np.uint8)
+    for i, roi in enumerate(rois):
+        if roi.shape != shape:
+            raise ValueError('roi %d has shape %s, not %s like the first' % (i, roi.shape, shape))
+        stack[i] = roi
+    return stack
+
+
+def batch_medians(stack):
+    """return (N,) float array of median of each roi in (N, h, w) stack"""
+    return np.median(stack.reshape(len(stack), -1), axis=1)
+
+
+def batch_percentiles(stack, q=PERCENTILES):
+    """return (N, len(q)) float array of percentiles q of each roi in (N, h, w) stack"""
+    return np.percentile(stack.reshape(len(stack), -1), q, axis=1).T
+
+
+def batch_histograms(stack):
+    """Count luminance values of every roi in one bincount call.
+
+    Returns (N, 256) int64 array whose row i is the histogram of stack[i].
+    -------
+    Input arguments:
+    stack -- (N, h, w) uint8 array of roi luminance
+
+    """
+    n = len(stack)
+    # offset image i's values by 256 * i so one bincount gives every image its own 256 bins
+    flat = stack.reshape(n, -1).astype(np.intp) + (np.arange(n, dtype=np.intp) * 256)[:, None]
+    return np.bincount(flat.ravel(), minlength=n * 256).reshape(n, 256)
+
+
+class RoiStack(object):
+
+    """A batch of roi luminance crops with their snapshot timestamps and filename states.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, filenames, stack, threshold=MEDIAN_THRESHOLD):
+        dtms, states = parse_foscam_filenames(filenames)
+        self.filenames = list(filenames)  #: list: full path image filenames, in stack order
+        self.stack = stack                #: numpy.ndarray: (N, h, w) uint8 roi luminance, contiguous
+        self.dtms = dtms                  #: numpy.ndarray: datetime64[m] timestamps parsed from filenames
+        self.states = states              #: numpy.ndarray: door states parsed from filenames
+        self.threshold = threshold        #: float: median below this means door is open
+
+    def __len__(self):
+        return len(self.stack)
+
+    def __str__(self):
+        return 'RoiStack of %d rois with shape %s' % (len(self), self.stack.shape[1:])
+
+    @classmethod
+    def from_files(cls, filenames, tmp_name=DEFAULT_TEMPLATE, workers=None, chunksize=None, **fci_kwargs):
+        """return RoiStack of filenames' roi luminance, computed over a process pool (see deck.map_images)"""
+        rois = map_images(roi_luminance, filenames, tmp_name=tmp_name, workers=workers, chunksize=chunksize,
+                          **fci_kwargs)
+        return cls(filenames, stack_rois(rois))
+
+    def medians(self):
+        return batch_medians(self.stack)
+
+    def percentiles(self, q=PERCENTILES):
+        return batch_percentiles(self.stack, q)
+
+    def histograms(self):
+        return batch_histograms(self.stack)
+
+    def stats(self, q=PERCENTILES):
+        """Get per-image stats for the batch.
+
+        Returns pandas.DataFrame indexed by timestamp with columns fname, state, median, verdict and one
+        p<q> column per percentile.
+
+        """
+        medians = self.medians()
+        df = pd.DataFrame({'fname': self.filenames, 'state': self.states, 'median': medians},
+                          index=pd.DatetimeIndex(self.dtms, name='dtm'), columns=['fname', 'state', 'median'])
+        df['verdict'] = np.where(medians < self.threshold, 'open', 'close')
+        pcts = self.percentiles(q)
+        for j, p in enumerate(q):
+            df['p%d' % p] = pcts[:, j]
+        return df
+
+    def state_histograms(self):
+        """return dict of state -> (256,) summed histogram over all rois with that filename state"""
+        hists = self.histograms()
+        return dict((s, hists[self.states == s].sum(axis=0)) for s in np.unique(self.states))
+
+    def state_aggregates(self, q=PERCENTILES):
+        """Aggregate per-image stats by filename state.
+
+        Returns pandas.DataFrame indexed by state with count, median stats (mean, std, min, max) and the number
+        of rois whose verdict disagrees with their state.
+
+        """
+        df = self.stats(q)
+        df['wrong'] = (df['verdict'] != df['state']) & df['state'].isin(['open', 'close'])
+        grp = df.groupby('state')
+        agg = grp['median'].agg(['count', 'mean', 'std', 'min', 'max'])
+        agg['wrong'] = grp['wrong'].sum().astype(int)
+        return agg
+
+
+if __name__ == '__main__':
+
+    import sys
+    from deck import Deck
+
+    rs = RoiStack.from_files(Deck(date_range=sys.argv[1:3]).filenames)
+    print rs
+    print rs.stats()
+    print rs.state_aggregates()
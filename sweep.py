@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""Sweep blur and CLAHE settings (and the median threshold) for the best open/close accuracy on the archive.
+
+This module decodes each labelled snapshot once, keeps just its raw roi luminance (before blur and CLAHE) in a
+(N, h, w) stack, then fans chunks of that stack out over a process pool. Each worker blurs a chunk once per
+blursize and runs every (cliplim, gridsize) CLAHE variant on that cached blur, taking roi medians for the whole
+chunk in one call. Accuracy and margin for every threshold then come from sorted medians of each combination
+(one binary search per threshold), so no image is decoded or blurred more than once per sweep.
+
+Margin is how far a threshold sits from the bulk of each state: the smaller of (5th percentile of close medians
+minus threshold) and (threshold minus 95th percentile of open medians); negative means the threshold cuts into
+one state's bulk.
+
+Example:
+    Sweep the default grid over a few days of snapshots and show the best settings::
+
+        $ python sweep.py 2017-11-10 2017-11-17
+
+"""
+
+import itertools
+import multiprocessing
+import cv2
+import numpy as np
+import pandas as pd
+
+from deck import map_images
+from fcimage import blur_and_clahe, parse_foscam_filenames
+from roistack import stack_rois, batch_medians
+from flimsy_constants import DEFAULT_TEMPLATE
+
+BLURSIZES = (0, 3, 5, 7, 9)               # Gaussian blur kernel sizes; 0 to skip blurring
+CLIPLIMS = (1.0, 2.0, 3.0, 4.0, 6.0)      # CLAHE clipLimit values
+GRIDSIZES = (2, 4, 8, 16)                 # CLAHE tileGridSize values
+THRESHOLDS = np.arange(60.0, 250.0, 0.5)  # median thresholds (door open below)
+MARGIN_PERCENTILE = 5                     # margin ignores this percent of each state's most extreme medians
+
+
+def raw_roi_luminance(fci):
+    """return (h, w) uint8 roi luminance before blur and CLAHE for FoscamImage, fci (for map_images)"""
+    return fci.get_raw_roi_luminance()
+
+
+def _sweep_chunk(args):
+    """return (combos, n) medians of every (blursize, cliplim, gridsize) combo for (n, h, w) chunk of raw rois"""
+    raw, blursizes, cliplims, gridsizes = args
+    n = len(raw)
+    out = np.empty((len(blursizes) * len(cliplims) * len(gridsizes), n))
+    row = 0
+    for blursize in blursizes:
+        # blur each roi once (as blur_and_clahe would); every CLAHE variant below starts from this cached blur
+        if blursize:
+            blurred = [cv2.GaussianBlur(roi, (blursize, blursize), 0) for roi in raw]
+        else:
+            blurred = raw
+        for cliplim, gridsize in itertools.product(cliplims, gridsizes):
+            stack = np.empty_like(raw)
+            for i in range(n):
+                stack[i] = blur_and_clahe(blurred[i], blursize=None, cliplim=cliplim, gridsize=gridsize)
+            out[row] = batch_medians(stack)
+            row += 1
+    return out
+
+
+def sweep_medians(raw, blursizes=BLURSIZES, cliplims=CLIPLIMS, gridsizes=GRIDSIZES, workers=None, chunksize=64):
+    """Compute roi medians of every blur and CLAHE combination for a stack of raw rois.
+
+    Returns 2-tuple (combos, medians) of list of (blursize, cliplim, gridsize) tuples and (len(combos), N) array.
+    -------
+    Input arguments:
+    raw -- (N, h, w) uint8 stack of raw roi luminance (see raw_roi_luminance)
+
+    Keyword arguments:
+    blursizes, cliplims, gridsizes -- sequences of values to sweep (see BLURSIZES etc.)
+    workers   -- int number of worker processes; None for cpu count, 1 to run serially in this process
+    chunksize -- int number of rois handed to a worker at a time
+
+    """
+    combos = list(itertools.product(blursizes, cliplims, gridsizes))
+    tasks = [(raw[i:i + chunksize], blursizes, cliplims, gridsizes) for i in range(0, len(raw), chunksize)]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers == 1 or len(tasks) < 2:
+        parts = [_sweep_chunk(t) for t in tasks]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            parts = pool.map(_sweep_chunk, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+    return combos, np.hstack(parts) if parts else np.empty((len(combos), 0))
+
+
+def evaluate(medians, is_open, thresholds=THRESHOLDS):
+    """Score every threshold against every combination's medians at once.
+
+    Returns 2-tuple (accuracy, margin) of (combos, len(thresholds)) arrays (see module docstring for margin).
+    -------
+    Input arguments:
+    medians -- (combos, N) array of roi medians
+    is_open -- (N,) bool array, True where frame is labelled open (others are labelled close)
+
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    # count frames on the right side of each threshold by binary search of sorted medians (not a combos x N x
+    # thresholds comparison, which would not fit in memory for the whole archive)
+    opens, closes = np.sort(medians[:, is_open], axis=1), np.sort(medians[:, ~is_open], axis=1)
+    right = np.empty((len(medians), len(thresholds)))
+    for row in range(len(medians)):
+        open_below = np.searchsorted(opens[row], thresholds, 'left')
+        close_below = np.searchsorted(closes[row], thresholds, 'left')
+        right[row] = open_below + (closes.shape[1] - close_below)
+    accuracy = right / float(medians.shape[1])
+    top_open = np.percentile(medians[:, is_open], 100 - MARGIN_PERCENTILE, axis=1)
+    bottom_close = np.percentile(medians[:, ~is_open], MARGIN_PERCENTILE, axis=1)
+    margin = np.minimum(bottom_close[:, None] - thresholds[None, :], thresholds[None, :] - top_open[:, None])
+    return accuracy, margin
+
+
+def sweep(filenames, tmp_name=DEFAULT_TEMPLATE, blursizes=BLURSIZES, cliplims=CLIPLIMS, gridsizes=GRIDSIZES,
+          thresholds=THRESHOLDS, workers=None, chunksize=64, decode='rows'):
+    """Sweep blur, CLAHE and threshold settings over labelled snapshots.
+
+    Returns pandas.DataFrame with one row per (blursize, cliplim, gridsize, threshold) and its accuracy and
+    margin, sorted best first (accuracy, then margin).
+
+    """
+    dtms, states = parse_foscam_filenames(filenames)
+    keep = [i for i, s in enumerate(states) if s in ('open', 'close')]
+    filenames = [filenames[i] for i in keep]
+    is_open = states[keep] == 'open'
+    raw = stack_rois(map_images(raw_roi_luminance, filenames, tmp_name=tmp_name, workers=workers, decode=decode))
+    combos, medians = sweep_medians(raw, blursizes, cliplims, gridsizes, workers=workers, chunksize=chunksize)
+    accuracy, margin = evaluate(medians, is_open, thresholds)
+    nt = len(thresholds)
+    df = pd.DataFrame(np.repeat(np.array(combos, dtype=np.float64), nt, axis=0),
+                      columns=['blursize', 'cliplim', 'gridsize'])
+    df['blursize'] = df['blursize'].astype(int)
+    df['gridsize'] = df['gridsize'].astype(int)
+    df['threshold'] = np.tile(thresholds, len(combos))
+    df['accuracy'] = accuracy.ravel()
+    df['margin'] = margin.ravel()
+    return df.sort_values(['accuracy', 'margin'], ascending=False).reset_index(drop=True)
+
+
+def best_per_combo(df):
+    """return pandas.DataFrame of best threshold row for each (blursize, cliplim, gridsize) of sweep results"""
+    ranked = df.sort_values(['accuracy', 'margin'], ascending=False)
+    return ranked.drop_duplicates(['blursize', 'cliplim', 'gridsize']).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+
+    import sys
+    import time
+    from deck import Deck
+
+    deck = Deck(date_range=sys.argv[1:3], morning=False)
+    t1 = time.time()
+    results = sweep(deck.filenames)
+    print 'swept %d settings over %d images in %.1f sec' % (len(results), len(deck), time.time() - t1)
+    print best_per_combo(results).head(20)
@@ -11,10 +11,73 @@ Todo:
 """
 
 import os
+import threading
 import cv2
+import numpy as np
 from flimsy_constants import DEFAULT_TEMPLATE
 
 
+_REGISTRY = dict()               # absolute path -> (mtime, read-only grayscale image)
+_REGISTRY_LOCK = threading.Lock()
+REGISTRY_STATS = {'reads': 0, 'hits': 0}  # process-wide count of template file reads and cache hits
+
+
+def get_template_image(img_name=DEFAULT_TEMPLATE):
+    """Get grayscale template image shared process-wide.
+
+    Returns the same read-only numpy.ndarray (h, w) to every caller; file is re-read only when its mtime changes.
+    -------
+    Input argument:
+    img_name -- string for full path to template image
+
+    """
+    key = os.path.abspath(img_name)
+    mtime = os.stat(key).st_mtime
+    with _REGISTRY_LOCK:
+        entry = _REGISTRY.get(key)
+        if entry is not None and entry[0] == mtime:
+            REGISTRY_STATS['hits'] += 1
+            return entry[1]
+        img = cv2.imread(key, 0)
+        if img is None:
+            raise IOError('cv2.imread returned None')
+        img.flags.writeable = False  # shared by all consumers, so nobody gets to scribble on it
+        _REGISTRY[key] = (mtime, img)
+        REGISTRY_STATS['reads'] += 1
+        return img
+
+
+def clear_template_registry():
+    """forget all cached templates (next access re-reads from disk)"""
+    with _REGISTRY_LOCK:
+        _REGISTRY.clear()
+
+
+def as_template_image(template):
+    """Get grayscale template array from any of the template varieties we accept.
+
+    Returns numpy.ndarray (h, w) of template image (grayscale).
+    -------
+    Input argument:
+    template -- None for default template, string filename, GrayscaleTemplateImage or numpy.ndarray
+
+    """
+    if template is None:
+        # is None, so use default template
+        return get_template_image(DEFAULT_TEMPLATE)
+    elif isinstance(template, np.ndarray):
+        # type is numpy array, so return as-is
+        return template
+    elif isinstance(template, GrayscaleTemplateImage):
+        # type is GrayscaleTemplateImage, so return image part
+        return template.image
+    elif isinstance(template, str):
+        # type is str, so get from registry via string filename
+        return get_template_image(template)
+    else:
+        raise TypeError('template is unexpected type %s' % type(template))
+
+
 class GrayscaleTemplateImage(object):
 
     """A template image object.
@@ -38,15 +101,8 @@ class GrayscaleTemplateImage(object):
 
     @property
     def image(self):
-        """numpy.ndarray: Array (h, w) of input image of interest (grayscale)."""
-        if self._image:
-            return self._image
-
-        img = cv2.imread(self.img_name, 0)
-        if img is None:
-            raise IOError('cv2.imread returned None')
-
-        return img
+        """numpy.ndarray: Array (h, w) of input image of interest (grayscale); read-only, shared via registry."""
+        return get_template_image(self.img_name)
 
     @property
     def img_name(self):
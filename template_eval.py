@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""Compare cv2.matchTemplate methods (and pyramid levels) for finding the template, over the snapshot archive.
+
+Each snapshot is decoded once in a worker process; its luminance is then searched with every method in
+matcher.TM_METHODS at every downsample level in LEVELS (image and template both shrunk by the level, found
+location scaled back up to full-size pixels). For each (image, method, level) we record:
+
+    x, y    -- full-size pixel coords of the best match (max_loc, or min_loc for the TM_SQDIFF methods)
+    score   -- best matchTemplate value
+    margin  -- how much the best peak stands out from the runner-up (best minus second peak away from it), as a
+               fraction of how far the best peak stands above the median response; 0 is a tie, 1 is no contest,
+               and it compares across methods whatever their units
+    sec     -- wall time to resize the image, match and find the peak
+
+Stability is judged against where the camera routinely sees the template (TEMPLATE_XY): a hit is a found
+location within TOLERANCE pixels of it. The summary gives hit rate, spread, margin and time per image for each
+part of the day, the speed/accuracy frontier of each part of the day, and the fastest method that holds up in
+all of them (see choose_default), which is what matcher.DEFAULT_TM_METHOD should be.
+
+Example:
+    Evaluate every method over a week of snapshots and show the frontier::
+
+        $ python template_eval.py 2017-11-10 2017-11-17
+
+"""
+
+import time
+import functools
+import cv2
+import numpy as np
+import pandas as pd
+
+from deck import map_images
+from matcher import TM_METHODS, best_match
+from flimsy_constants import DEFAULT_TEMPLATE, TEMPLATE_XY
+
+LEVELS = (1, 2, 4)  # downsample factors of image and template (1 is full size)
+TOLERANCE = 4       # pixels from TEMPLATE_XY that still count as a hit
+MIN_HIT_RATE = 0.99  # worst part of day hit rate for a method (and level) to be considered for the default
+
+#: 2-tuple (first hour, name) for each part of the day, in order
+DAYPARTS = ((0, 'night'), (6, 'morning'), (11, 'midday'), (16, 'evening'), (20, 'night'))
+
+COLUMNS = ['bname', 'hour', 'daypart', 'method', 'level', 'x', 'y', 'score', 'margin', 'sec']
+
+
+def daypart(hour):
+    """return string name of part of day (see DAYPARTS) for int hour"""
+    name = DAYPARTS[0][1]
+    for first, part in DAYPARTS:
+        if hour >= first:
+            name = part
+    return name
+
+
+def peak_margin(res, best, loc, radius):
+    """Measure how much the best peak of a matchTemplate result stands out (see module docstring).
+
+    Returns float margin, 0.0 to 1.0
+    -------
+    Input arguments:
+    res    -- matchTemplate result, oriented so higher is better (negate it for TM_SQDIFF methods)
+    best   -- float best (maximum) value of res
+    loc    -- 2-tuple (x, y) of best value in res
+    radius -- 2-tuple (rx, ry) of pixels around best peak that belong to it (not runner-up candidates)
+
+    """
+    typical = float(np.median(res))
+    if best <= typical:
+        return 0.0
+    x, y = loc
+    masked = res.copy()
+    masked[max(0, y - radius[1]):y + radius[1] + 1, max(0, x - radius[0]):x + radius[0] + 1] = -np.inf
+    second = masked.max()
+    if not np.isfinite(second):
+        return 1.0  # nothing outside best peak, so no runner-up
+    return float(min(1.0, (best - second) / (best - typical)))
+
+
+def match_methods(L, template, methods=None, levels=LEVELS, scale=1):
+    """Search luminance image for template with each method at each level.
+
+    Returns list of dicts with method, level, x, y, score, margin and sec (see module docstring).
+    -------
+    Input arguments:
+    L        -- (h, w) uint8 luminance image
+    template -- (th, tw) uint8 grayscale template at the same resolution as L
+
+    Keyword arguments:
+    methods -- sequence of keys of matcher.TM_METHODS; None for all of them
+    levels  -- sequence of int downsample factors
+    scale   -- int downscale factor of L relative to full size (so x, y come out in full-size pixels)
+
+    """
+    if methods is None:
+        methods = sorted(TM_METHODS)
+    ih, iw = L.shape[0:2]
+    th, tw = template.shape[0:2]
+    rows = []
+    for level in levels:
+        # template resize is not timed: production would shrink the template once, not per frame
+        tmp = template if level == 1 else cv2.resize(template, (tw // level, th // level),
+                                                     interpolation=cv2.INTER_AREA)
+        radius = (max(1, tw // level // 2), max(1, th // level // 2))
+        for name in methods:
+            method, use_min = TM_METHODS[name]
+            t1 = time.time()
+            img = L if level == 1 else cv2.resize(L, (iw // level, ih // level), interpolation=cv2.INTER_AREA)
+            res = cv2.matchTemplate(img, tmp, method)
+            score, loc = best_match(res, name)
+            sec = time.time() - t1
+            if use_min:
+                margin = peak_margin(-res, -score, loc, radius)
+            else:
+                margin = peak_margin(res, score, loc, radius)
+            rows.append({
+                'method': name,
+                'level': level,
+                'x': loc[0] * level * scale,
+                'y': loc[1] * level * scale,
+                'score': float(score),
+                'margin': margin,
+                'sec': sec,
+            })
+    return rows
+
+
+def method_features(fci, methods=None, levels=LEVELS):
+    """return list of match_methods dicts (plus bname, hour and daypart) for FoscamImage, fci (for map_images)"""
+    fcf = fci.foscam_file
+    L = fci.image if fci.image.ndim == 2 else fci.lab[0]
+    template = fci.template
+    if fci.scale > 1:
+        h, w = template.shape[0:2]
+        template = cv2.resize(template, (w // fci.scale, h // fci.scale), interpolation=cv2.INTER_AREA)
+    rows = match_methods(L, template, methods=methods, levels=levels, scale=fci.scale)
+    for row in rows:
+        row.update(bname=fcf.bname, hour=fcf.dtm.hour, daypart=daypart(fcf.dtm.hour))
+    return rows
+
+
+def evaluate(filenames, tmp_name=DEFAULT_TEMPLATE, methods=None, levels=LEVELS, workers=None, chunksize=None,
+             decode='rows'):
+    """Run every method at every level over filenames in a process pool.
+
+    Returns pandas.DataFrame with one row per (image, method, level) and columns COLUMNS plus offset (pixels
+    from TEMPLATE_XY), hit (offset within TOLERANCE) and spread (pixels from the median location found by
+    the same method and level).
+
+    """
+    func = functools.partial(method_features, methods=methods, levels=levels)
+    per_image = map_images(func, filenames, tmp_name=tmp_name, workers=workers, chunksize=chunksize,
+                           decode=decode)
+    df = pd.DataFrame([row for rows in per_image for row in rows], columns=COLUMNS)
+    df['offset'] = np.hypot(df['x'] - TEMPLATE_XY[0], df['y'] - TEMPLATE_XY[1])
+    df['hit'] = df['offset'] <= TOLERANCE
+    grouped = df.groupby(['method', 'level'])
+    df['spread'] = np.hypot(df['x'] - grouped['x'].transform('median'), df['y'] - grouped['y'].transform('median'))
+    return df
+
+
+def summarize(df, by=('daypart', 'method', 'level')):
+    """return pandas.DataFrame of images, hit_rate, median offset, p95 spread, median margin and msec per image
+    for each group of evaluate results"""
+    grouped = df.groupby(list(by))
+    summary = pd.DataFrame({
+        'images': grouped.size(),
+        'hit_rate': grouped['hit'].mean(),
+        'offset': grouped['offset'].median(),
+        'spread95': grouped['spread'].quantile(0.95),
+        'margin': grouped['margin'].median(),
+        'msec': grouped['sec'].mean() * 1000.0,
+    })
+    return summary[['images', 'hit_rate', 'offset', 'spread95', 'margin', 'msec']]
+
+
+def frontier(df):
+    """Find the speed/accuracy frontier for each part of the day.
+
+    Returns pandas.DataFrame of summarize rows (by daypart, method, level) for which no other method and level
+    is at least as fast with a higher hit rate, fastest first within each part of the day.
+
+    """
+    keep = []
+    for part, group in summarize(df).groupby(level='daypart'):
+        best = -1.0
+        for key, row in group.sort_values(['msec', 'hit_rate'], ascending=[True, False]).iterrows():
+            if row['hit_rate'] > best:
+                keep.append(key)
+                best = row['hit_rate']
+    return summarize(df).loc[keep]
+
+
+def choose_default(df, min_hit_rate=MIN_HIT_RATE):
+    """Pick the production method from evaluate results.
+
+    Returns 2-tuple (method, level) that is fastest among those whose worst part of day hit rate is at least
+    min_hit_rate; if none are, the one with the best worst-case hit rate (then margin, then speed).
+
+    """
+    by_part = summarize(df)
+    worst = by_part.groupby(level=['method', 'level']).agg({'hit_rate': 'min', 'margin': 'min', 'msec': 'mean'})
+    good = worst[worst['hit_rate'] >= min_hit_rate]
+    if len(good):
+        pick = good.sort_values(['msec', 'margin'], ascending=[True, False]).index[0]
+    else:
+        pick = worst.sort_values(['hit_rate', 'margin', 'msec'], ascending=[False, False, True]).index[0]
+    return pick[0], int(pick[1])
+
+
+if __name__ == '__main__':
+
+    import sys
+    from deck import Deck
+
+    deck = Deck(date_range=sys.argv[1:3], morning=False)
+    t1 = time.time()
+    results = evaluate(deck.filenames)
+    print 'evaluated %d method/level pairs over %d images in %.1f sec' % (
+        len(results) // max(1, len(deck)), len(deck), time.time() - t1)
+    print summarize(results, by=('method', 'level'))
+    print frontier(results)
+    print 'default: %s at level %d' % choose_default(results)
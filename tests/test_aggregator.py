@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+import glob
+import numpy as np
+from fauxmo_garage.deck import map_images
+from fauxmo_garage.fcimage import FoscamImage
+from fauxmo_garage.roistack import RoiStack, roi_luminance, stack_rois
+from fauxmo_garage.aggregator import (HistogramAggregator, hist_percentiles, hist_median, bucket_key,
+                                      verdict_state, seen_file)
+
+
+class AggregatorTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(AggregatorTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.basedir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.basedir + '/2017*jpg'))
+        cls.stack = stack_rois(map_images(roi_luminance, cls.files, workers=1))
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'roi_histograms.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hist_percentiles_match_numpy(self):
+        rng = np.random.RandomState(7)
+        for n in [1, 2, 5, 52 * 112]:
+            values = rng.randint(0, 256, n)
+            hist = np.bincount(values, minlength=256)
+            np.testing.assert_allclose(hist_percentiles(hist, [0, 10, 25, 50, 90, 100]),
+                                       np.percentile(values, [0, 10, 25, 50, 90, 100]))
+            self.assertEqual(hist_median(hist), np.median(values))
+        self.assertTrue(np.isnan(hist_median(np.zeros(256))))
+
+    def test_bucket_key(self):
+        self.assertEqual(bucket_key('open', datetime.datetime(2017, 11, 14, 6, 5)), ('open', 6, '2017-W46'))
+        self.assertEqual(bucket_key('close', datetime.datetime(2018, 1, 1, 23, 0)), ('close', 23, '2018-W01'))
+
+    def test_add_stack_matches_pooled_values(self):
+        agg = HistogramAggregator(self.filename)
+        self.assertEqual(agg.add_stack(RoiStack(self.files, self.stack)), len(self.files))
+        self.assertEqual(agg.add_stack(RoiStack(self.files, self.stack)), 0)  # already counted
+        rs = RoiStack(self.files, self.stack)
+        for state in ['open', 'close']:
+            values = self.stack[rs.states == state]
+            self.assertEqual(agg.median(state=state), np.median(values))
+            np.testing.assert_allclose(agg.percentiles(state=state), np.percentile(values, range(10, 100, 10)))
+        morning = [i for i, d in enumerate(rs.dtms.astype(datetime.datetime)) if d.hour < 12]
+        self.assertEqual(agg.count(hours=range(12)), self.stack[morning].size)
+        summary = agg.summary(by=('state',))
+        self.assertEqual(summary['pixels'].sum(), self.stack.size)
+
+    def test_add_frame_same_as_add_stack(self):
+        one = HistogramAggregator(self.filename)
+        for fname in self.files[:4]:
+            self.assertTrue(one.add_frame(FoscamImage(fname, roi_only=True)))
+        self.assertFalse(one.add_frame(FoscamImage(self.files[0], roi_only=True)))
+        two = HistogramAggregator(os.path.join(self.tmpdir, 'other.npz'))
+        two.add_stack(RoiStack(self.files[:4], self.stack[:4]))
+        self.assertEqual(sorted(one.hists), sorted(two.hists))
+        for key in one.hists:
+            np.testing.assert_array_equal(one.hists[key], two.hists[key])
+
+    def test_live_verdicts_kept_out_of_labelled_buckets(self):
+        agg = HistogramAggregator(self.filename)
+        fci = FoscamImage(self.files[0], roi_only=True)
+        self.assertTrue(agg.add_verdict(fci, 'open'))
+        self.assertEqual(agg.count(state='open'), 0)
+        self.assertEqual(agg.count(state=verdict_state('open')), fci.roi_luminance.size)
+        self.assertEqual(list(agg.summary(by=('state',)).index), ['verdict_open'])
+        # live frames a few seconds apart share a (minute resolution) basename; each still counts
+        self.assertTrue(agg.add_verdict(fci, 'open'))
+        self.assertEqual(agg.count(state=verdict_state('open')), 2 * fci.roi_luminance.size)
+        self.assertEqual(agg.seen, set())
+
+    def test_save_merges_counts_from_other_processes(self):
+        a = HistogramAggregator(self.filename)
+        b = HistogramAggregator(self.filename)
+        a.add_stack(RoiStack(self.files[:6], self.stack[:6]))
+        b.add_stack(RoiStack(self.files[6:], self.stack[6:]))
+        a.save()
+        b.save()
+        self.assertEqual(b.count(), self.stack.size)
+        c = HistogramAggregator(self.filename)
+        self.assertEqual(c.count(), self.stack.size)
+        self.assertEqual(len(c.seen), len(self.files))
+        self.assertEqual(c.median(state='open'), b.median(state='open'))
+        self.assertFalse(c.maybe_save(0.0))  # nothing new to save
+        self.assertEqual(b.seen, c.seen)  # b picked up the keys a appended
+
+    def test_seen_keys_appended_not_rewritten(self):
+        agg = HistogramAggregator(self.filename)
+        agg.add_stack(RoiStack(self.files[:4], self.stack[:4]))
+        agg.save()
+        size = os.path.getsize(seen_file(self.filename))
+        agg.save()  # nothing counted since, so nothing appended
+        self.assertEqual(os.path.getsize(seen_file(self.filename)), size)
+        agg.add_stack(RoiStack(self.files[:6], self.stack[:6]))
+        agg.save()
+        with open(seen_file(self.filename)) as fh:
+            self.assertEqual(fh.read().split(), [os.path.basename(f) for f in self.files[:6]])
+        loaded = HistogramAggregator(self.filename)
+        self.assertEqual(loaded.seen, agg.seen)
+        self.assertEqual(loaded.add_stack(RoiStack(self.files, self.stack)), len(self.files) - 6)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import shutil
+import datetime
+import tempfile
+import unittest
+
+from fauxmo_garage.archive import ArchiveIndex
+from fauxmo_garage.fcimage import DateRangeStateFoscamFile
+
+
+class ArchiveIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(ArchiveIndexTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = glob.glob(cls.topdir + '/*')
+        cls.index = ArchiveIndex(cls.topdir)
+
+    def tearDown(self):
+        pass
+
+    def test_query_matches_file_filter(self):
+        # bisection queries must agree with brute-force filter over every file for all the query varieties
+        ranges = [((2017, 11, 10), (2017, 11, 17)), ((2017, 11, 13), (2017, 11, 13)), ((1999, 1, 1), (2000, 12, 31))]
+        for d1, d2 in ranges:
+            start, stop = datetime.date(*d1), datetime.date(*d2)
+            for morning in [True, False]:
+                for state in [None, 'open', 'close']:
+                    filt = DateRangeStateFoscamFile(start, stop, morning=morning, state=state)
+                    exp = sorted(filt(self.files), key=os.path.basename)
+                    got = self.index.query(start, stop, morning=morning, state=state)
+                    self.assertEqual(exp, got,
+                        'index query differs from file filter for %s to %s, morning=%s, state=%s' % (
+                        start, stop, morning, state))
+
+    def test_incremental_refresh(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            shutil.copy(os.path.join(self.topdir, '2017-11-10_06_06_open.jpg'), tmpdir)
+            idx = ArchiveIndex(tmpdir)
+            self.assertEqual(1, len(idx))
+
+            # a new snapshot lands
+            shutil.copy(os.path.join(self.topdir, '2017-11-12_08_38_close.jpg'), tmpdir)
+            day = datetime.date(2017, 11, 12)
+            self.assertEqual([os.path.join(tmpdir, '2017-11-12_08_38_close.jpg')], idx.query(day, day))
+            self.assertEqual('close', idx.latest()[1])
+
+            # and one goes away
+            os.remove(os.path.join(tmpdir, '2017-11-10_06_06_open.jpg'))
+            self.assertEqual(1, len(idx.query(datetime.date(2017, 11, 1), datetime.date(2017, 11, 30))))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
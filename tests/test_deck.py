@@ -3,7 +3,7 @@
 import os
 import unittest
 import glob
-from fauxmo_garage.deck import FoscamImageIterator
+from fauxmo_garage.deck import FoscamImageIterator, map_images, roi_median, roi_verdict
 
 
 class DeckTestCase(unittest.TestCase):
@@ -35,6 +35,18 @@ class DeckTestCase(unittest.TestCase):
         self.assertEqual(count, exp_count,
             'file count (%d) does not equal expected count (%d)' % (count, exp_count))
 
+    def test_map_images_parallel_matches_serial(self):
+        fnames = sorted(self.files)
+        serial = map_images(roi_median, fnames, workers=1)
+        parallel = map_images(roi_median, fnames, workers=2, chunksize=3)
+        self.assertEqual(serial, parallel, 'parallel medians differ from serial medians (or came back out of order)')
+
+    def test_map_images_filename_order(self):
+        fnames = sorted(self.files)
+        states = [v[0] for v in map_images(roi_verdict, fnames, workers=3)]
+        exp_states = [os.path.basename(f).split('_')[-1].replace('.jpg', '') for f in fnames]
+        self.assertEqual(exp_states, states, 'map results not in filename order')
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
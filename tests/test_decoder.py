@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import glob
+import subprocess
+import unittest
+import numpy as np
+
+from fauxmo_garage.fcimage import FoscamImage
+from fauxmo_garage.decoder import DECODE_MODES, decode_file, decode_bytes, crop_rows, find_sof, frame_size
+from fauxmo_garage.flimsy_constants import MEDIAN_THRESHOLD, ROI_DECODE_ROWS
+
+
+class DecoderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(DecoderTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.topdir + '/2017*jpg'))
+        cls.medians = dict()
+        for fname in cls.files:
+            cls.medians[fname] = np.median(FoscamImage(fname, roi_only=True).roi_luminance)
+
+    def tearDown(self):
+        pass
+
+    def test_rows_decode_shape(self):
+        for mode in ['rows', 'rows_gray']:
+            img = decode_file(self.files[0], mode=mode)
+            self.assertEqual(ROI_DECODE_ROWS, img.shape[0],
+                '%s mode decoded %d rows, expected %d' % (mode, img.shape[0], ROI_DECODE_ROWS))
+
+    def test_rows_decode_roi_identical(self):
+        for fname in self.files:
+            roi_full = FoscamImage(fname, roi_only=True).roi_luminance
+            roi_rows = FoscamImage(fname, roi_only=True, decode='rows').roi_luminance
+            self.assertTrue(np.array_equal(roi_full, roi_rows),
+                'rows-only decode changed roi luminance for %s' % fname)
+
+    def test_rows_decode_quiet(self):
+        # libjpeg writes straight to fd 2, so decode in a child process and look at what it wrote there
+        script = ('import sys\n'
+                  'from fauxmo_garage.decoder import decode_file\n'
+                  'for f in sys.argv[1:]:\n'
+                  '    decode_file(f, mode="rows")\n'
+                  '    decode_file(f, mode="rows_gray")\n')
+        child = subprocess.Popen([sys.executable, '-c', script] + self.files[:4], stderr=subprocess.PIPE)
+        err = child.communicate()[1]
+        self.assertEqual(0, child.returncode, err)
+        self.assertEqual('', err, 'expected rows decode to leave stderr alone, got: %s' % err)
+
+    def test_decode_bytes_like_file(self):
+        with open(self.files[0], 'rb') as f:
+            data = f.read()
+        self.assertEqual((720, 1280), frame_size(data))
+        for mode in sorted(DECODE_MODES.keys()):
+            self.assertEqual(decode_file(self.files[0], mode=mode).shape, decode_bytes(data, mode=mode).shape,
+                             'bytes and file decode shapes differ for %s mode' % mode)
+
+    def test_crop_rows_not_jpeg(self):
+        data = 'this is not a jpeg'
+        self.assertEqual((None, None), find_sof(data))
+        self.assertEqual(data, crop_rows(data, 16))
+
+    def test_verdict_regression(self):
+        # every decode mode must reach the same open/close verdict as full-resolution color decoding
+        for mode in sorted(DECODE_MODES.keys()):
+            for fname in self.files:
+                med = np.median(FoscamImage(fname, roi_only=True, decode=mode).roi_luminance)
+                expected = self.medians[fname] < MEDIAN_THRESHOLD
+                self.assertEqual(expected, med < MEDIAN_THRESHOLD,
+                    '%s decode flipped verdict for %s (median %.1f vs %.1f)' % (
+                    mode, fname, med, self.medians[fname]))
+
+    def test_gray_needs_roi_only(self):
+        with self.assertRaises(ValueError):
+            FoscamImage(self.files[0], decode='gray')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
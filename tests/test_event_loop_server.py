@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import shutil
+import tempfile
+import threading
+import unittest
+
+from fauxmo_garage.macpisocket.fake_camera import FakeCamera
+from fauxmo_garage.macpisocket.event_loop_server import GarageServer
+from fauxmo_garage.macpisocket.async_socket_client import send_to_server_async
+
+
+class EventLoopServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.camera = None
+        self.server = None
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(EventLoopServerTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.open_file = sorted(glob.glob(cls.topdir + '/2017*_open.jpg'))[0]
+
+    def tearDown(self):
+        if self.server:
+            self.server.stop()
+            self.thread.join(5.0)
+        if self.camera:
+            self.camera.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _start(self, camera_url, **kwargs):
+        count = [0]
+
+        def snap_filename(state):
+            count[0] += 1
+            return os.path.join(self.tmpdir, 'snap%03d_%s.jpg' % (count[0], state))
+
+        self.server = GarageServer(('127.0.0.1', 0), camera_url, snap_filename, **kwargs)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.server.socket.getsockname()
+
+    def test_pipelined_in_order(self):
+        # camera always shows open door, so wants:open needs no trigger and wants:close does
+        self.camera = FakeCamera([self.open_file], delay=0.05).start()
+        ip, port = self._start(self.camera.url, workers=2)
+        wants = ['open', 'close', 'close', 'open', 'close', 'open', 'open', 'close']
+        messages = ['wants:%s,client:test' % w for w in wants]
+        triggers = send_to_server_async(ip, port, messages, window=len(messages))
+        self.assertEqual([w != 'open' for w in wants], triggers)
+        self.assertEqual(len(wants), self.camera.requests)
+        self.assertGreater(self.server.stats['max_inflight'], 1, 'expected requests to overlap')
+        self.server.archive.flush()  # archive copies are written off the loop, one per request
+        self.assertEqual(len(wants), len(os.listdir(self.tmpdir)))
+
+    def test_backpressure(self):
+        self.camera = FakeCamera([self.open_file], delay=0.05).start()
+        ip, port = self._start(self.camera.url, max_pending=2)
+        messages = ['wants:open,client:test'] * 6
+        triggers = send_to_server_async(ip, port, messages, window=6)
+        self.assertEqual([False] * 6, triggers)
+        self.assertEqual(2, self.server.stats['max_inflight'])
+
+    def test_camera_down(self):
+        self.camera = FakeCamera([self.open_file])
+        url = self.camera.url
+        self.camera.server_close()  # nobody listening at url now
+        self.camera = None
+        ip, port = self._start(url, fetch_timeout=2.0)
+        with self.assertRaises(IOError):
+            send_to_server_async(ip, port, ['wants:open,client:test'], timeout=10.0)
+        self.assertEqual(1, self.server.stats['errors'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
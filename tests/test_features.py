@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from fauxmo_garage.fcimage import FoscamImage
+from fauxmo_garage import features
+from fauxmo_garage.features import FeatureStore
+
+
+class FeatureStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_name = os.path.join(self.tmpdir, 'features.sqlite')
+        # copy a few snapshots so we can touch them without disturbing the data folder
+        self.files = []
+        for f in sorted(glob.glob(self.topdir + '/2017-11-10*jpg'))[:6]:
+            shutil.copy(f, self.tmpdir)
+            self.files.append(os.path.join(self.tmpdir, os.path.basename(f)))
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(FeatureStoreTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_incremental_update(self):
+        store = FeatureStore(db_name=self.db_name)
+        self.assertEqual(len(self.files), store.update(self.files, workers=1))
+        self.assertEqual(0, store.update(self.files, workers=1), 'unchanged files should not be recomputed')
+
+        # changed mtime means stale row
+        mtime = os.stat(self.files[0]).st_mtime
+        os.utime(self.files[0], (mtime + 60, mtime + 60))
+        self.assertEqual(1, store.update(self.files, workers=1), 'only the touched file should be recomputed')
+
+        # store persists across instances
+        store.close()
+        store = FeatureStore(db_name=self.db_name)
+        self.assertEqual(len(self.files), len(store))
+
+    def test_params_change_invalidates(self):
+        store = FeatureStore(db_name=self.db_name)
+        store.update(self.files, workers=1)
+        store.close()
+        store = FeatureStore(db_name=self.db_name, cliplim=2.0)
+        self.assertEqual(0, len(store), 'store built with other CLAHE params should have been emptied')
+
+    def test_stored_features(self):
+        store = FeatureStore(db_name=self.db_name)
+        df = store.features(self.files, workers=1)
+        self.assertEqual([os.path.basename(f) for f in self.files], list(df.index))
+        for fname in self.files:
+            roi = FoscamImage(fname, roi_only=True).roi_luminance
+            row = df.loc[os.path.basename(fname)]
+            self.assertEqual(np.median(roi), row['median'])
+            self.assertEqual(roi.size, row['hist'].sum())
+            self.assertEqual(9, len(row['percentiles']))
+
+    def test_get_subset_across_query_chunks(self):
+        store = FeatureStore(db_name=self.db_name)
+        store.update(self.files, workers=1)
+        wanted = self.files[4:0:-1] + [os.path.join(self.tmpdir, 'not_stored.jpg')]
+        chunk = features.QUERY_CHUNK
+        features.QUERY_CHUNK = 3
+        try:
+            df = store.get(wanted)
+        finally:
+            features.QUERY_CHUNK = chunk
+        self.assertEqual([os.path.basename(f) for f in wanted[:-1]], list(df.index))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -4,11 +4,14 @@ import os
 import glob
 import datetime
 import unittest
+import cv2
+import numpy as np
 
 from fauxmo_garage.fcimage import FoscamFile, FoscamImage
-from fauxmo_garage.fcimage import parse_foscam_fullfilestr, get_date_range_foscam_files
+from fauxmo_garage.fcimage import parse_foscam_fullfilestr, parse_foscam_filenames, get_date_range_foscam_files
 from fauxmo_garage.flimsy_constants import BASENAME_PATTERN, DEFAULT_TEMPLATE
 from fauxmo_garage.template import GrayscaleTemplateImage
+from fauxmo_garage.macpisocket.async_socket_common import AnalysisResults
 
 
 class FoscamFileTestCase(unittest.TestCase):
@@ -52,6 +55,22 @@ class FoscamFileTestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             dtm, st = parse_foscam_fullfilestr(fullfilestr, bname_pattern=BASENAME_PATTERN)
 
+    def test_parse_foscam_filenames(self):
+        files = self.data_files['open'] + self.data_files['close'] + ['/my/path/template.jpg']
+        dtms, states = parse_foscam_filenames(files)
+        for f, dtm64, st in zip(files, dtms, states):
+            dtm, state = parse_foscam_fullfilestr(f)
+            if dtm is None:
+                self.assertTrue(np.isnat(dtm64), 'non-matching name %s should give NaT' % f)
+                self.assertEqual('', st)
+            else:
+                self.assertEqual(dtm, dtm64.astype(datetime.datetime), 'batch datetime differs for %s' % f)
+                self.assertEqual(state, st, 'batch state differs for %s' % f)
+
+        # invalid dates still raise like the one-at-a-time parser
+        with self.assertRaises(ValueError):
+            parse_foscam_filenames(self.data_files['datetime_error'])
+
     # @unittest.skip("NEED TO IRON OUT DATETIME vs. DATE ISSUE")
     def test_get_date_range_foscam_files(self):
         start = datetime.datetime(2017, 11, 14).date()
@@ -101,6 +120,61 @@ class FoscamFileTestCase(unittest.TestCase):
     def test_foscam_image_roi_lum_shape(self):
         self._crudely_verify_grayscale_from_dims(self.fci.roi_luminance)
 
+    def test_foscam_image_roi_only_median(self):
+        # fast classification mode skips full-frame LAB round trip, so allow a count of slop in the median
+        tolerance = 1.0
+        for state in ['open', 'close']:
+            for fname in self.data_files[state]:
+                med_full = np.median(FoscamImage(fname).roi_luminance)
+                med_roi = np.median(FoscamImage(fname, roi_only=True).roi_luminance)
+                self.assertLessEqual(abs(med_full - med_roi), tolerance,
+                    'roi-only median (%.1f) not within %.1f of full-frame median (%.1f) for %s' % (
+                    med_roi, tolerance, med_full, fname))
+
+    def test_foscam_image_from_bytes(self):
+        fname = self.data_files['open'][0]
+        with open(fname, 'rb') as f:
+            data = f.read()
+        expect = FoscamImage(fname, roi_only=True).roi_luminance
+
+        # name need not exist on disk; timestamp and state come from it unless given explicitly
+        fci = FoscamImage.from_bytes(data, name='/nowhere/' + os.path.basename(fname), roi_only=True)
+        np.testing.assert_array_equal(expect, fci.roi_luminance)
+        self.assertEqual(FoscamFile(fname).dtm, fci.foscam_file.dtm)
+        self.assertEqual('open', fci.foscam_file.state)
+        self.assertEqual(len(data), fci.foscam_file.fsize)
+
+        dtm = datetime.datetime(2017, 11, 20, 6, 25)
+        fci = FoscamImage.from_bytes(data, dtm=dtm, state='unknown', roi_only=True)
+        self.assertEqual((dtm, 'unknown', None), (fci.foscam_file.dtm, fci.foscam_file.state, fci.img_name))
+        fci.invalidate()
+        np.testing.assert_array_equal(expect, fci.roi_luminance)
+
+        ar = AnalysisResults(fci)
+        ar.compute()
+        self.assertIs(fci, ar.fcimage)
+        ar_file = AnalysisResults(fname)
+        ar_file.compute()
+        self.assertEqual((ar_file.state, ar_file.median), (ar.state, ar.median))
+
+    def test_analysis_results_duck_types_foscam_image(self):
+        # FoscamImage from the top-level fcimage module (as in scripts run from the repo) is a different class
+        class OtherFoscamImage(object):
+            img_name = None
+            roi_luminance = np.full((4, 4), 10, dtype=np.uint8)
+        ar = AnalysisResults(OtherFoscamImage())
+        ar.compute()
+        self.assertEqual(('open', 10.0), (ar.state, ar.median))
+
+    def test_foscam_image_from_array(self):
+        fname = self.data_files['close'][0]
+        img = cv2.imread(fname)
+        fci = FoscamImage.from_array(img, name=fname, roi_only=True)
+        np.testing.assert_array_equal(FoscamImage(fname, roi_only=True).roi_luminance, fci.roi_luminance)
+        self.assertIs(img, fci.image)
+        with self.assertRaises(ValueError):
+            FoscamImage.from_array(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))  # gray needs roi_only
+
     def test_foscam_image_template_input_varieties(self):
         fname = self.data_files['open'][0]
         fcis = [
@@ -113,5 +187,61 @@ class FoscamFileTestCase(unittest.TestCase):
             self._crudely_verify_grayscale_from_dims(fci.template)
 
 
+class FoscamImageTestCase(unittest.TestCase):
+
+    USED = ['image', 'lab', 'roi_vertices', 'processed_image', 'roi_luminance']  # stages full-frame roi goes through
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(FoscamImageTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.fname = sorted(glob.glob(cls.topdir + '/2017*_open.jpg'))[0]
+
+    def test_cache_hits_and_misses(self):
+        fci = FoscamImage(self.fname)
+        roi = fci.roi_luminance
+        first = fci.cache_info()
+        for stage in self.USED:
+            self.assertEqual(1, first[stage][1], 'expected %s computed exactly once, got %s' % (stage, first[stage]))
+        self.assertEqual((0, 0), first['template_match'])  # roi is at fixed vertices (see _compute_roi_vertices)
+
+        # cached roi is served as-is, without touching upstream stages
+        self.assertIs(roi, fci.roi_luminance)
+        second = fci.cache_info()
+        self.assertEqual((first['roi_luminance'][0] + 1, 1), second['roi_luminance'])
+        for stage in FoscamImage.STAGES[:-1]:
+            self.assertEqual(first[stage], second[stage])
+
+        # recomputing just the roi gets every upstream stage it uses from cache
+        fci.invalidate('roi_luminance')
+        np.testing.assert_array_equal(roi, fci.roi_luminance)
+        third = fci.cache_info()
+        self.assertEqual(2, third['roi_luminance'][1])
+        for stage in self.USED[:-1]:
+            self.assertEqual(1, third[stage][1], 'expected no recompute of %s, got %s' % (stage, third[stage]))
+        for stage in ['roi_vertices', 'processed_image']:
+            self.assertGreater(third[stage][0], second[stage][0], 'expected cache hit on %s' % stage)
+
+    def test_invalidate_downstream_only(self):
+        fci = FoscamImage(self.fname)
+        roi = fci.roi_luminance
+        image = fci.image
+        fci.invalidate('lab')
+        self.assertIs(image, fci._image)
+        for stage in FoscamImage.STAGES[1:]:
+            self.assertIsNone(getattr(fci, '_' + stage), 'expected %s dropped' % stage)
+        np.testing.assert_array_equal(roi, fci.roi_luminance)
+        info = fci.cache_info()
+        self.assertEqual(1, info['image'][1], 'image should not have been decoded again')
+        for stage in self.USED[1:]:
+            self.assertEqual(2, info[stage][1], 'expected %s recomputed once more' % stage)
+        fci.invalidate()
+        for stage in FoscamImage.STAGES:
+            self.assertIsNone(getattr(fci, '_' + stage))
+
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import shutil
+import tempfile
+import unittest
+
+from fauxmo_garage.decoder import decode_bytes
+from fauxmo_garage.macpisocket.fake_camera import FakeCamera
+from fauxmo_garage.macpisocket.foscam_fetch import CameraFetcher, ArchiveWriter, PooledFoscamSnap, FetchError
+
+
+class FoscamFetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.camera = FakeCamera(self.files).start()
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(FoscamFetchTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.topdir + '/2017*jpg'))[0:3]
+
+    def tearDown(self):
+        self.camera.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_keep_alive(self):
+        fetcher = CameraFetcher(self.camera.url)
+        for i in range(6):
+            data = fetcher.fetch()
+            with open(self.files[i % 3], 'rb') as f:
+                self.assertEqual(f.read(), data)
+        self.assertEqual(1, self.camera.connections, 'expected one kept-alive connection for all fetches')
+        self.assertEqual(1, fetcher.stats['connects'])
+        self.assertEqual(3, decode_bytes(data).ndim)
+        fetcher.close()
+
+    def test_retry(self):
+        fetcher = CameraFetcher(self.camera.url, retries=2, backoff=0.01)
+        self.camera.failures = 2
+        self.assertTrue(fetcher.fetch().startswith('\xff\xd8'))
+        self.assertEqual(2, fetcher.stats['retries'])
+        self.camera.failures = 3
+        with self.assertRaises(FetchError):
+            fetcher.fetch()
+        fetcher.close()
+
+    def test_timeout(self):
+        self.camera.delay = 1.0
+        fetcher = CameraFetcher(self.camera.url, timeout=0.1, retries=0)
+        with self.assertRaises(FetchError):
+            fetcher.fetch()
+
+    def test_archive_writer(self):
+        writer = ArchiveWriter()
+        writer.start()
+        for i in range(5):
+            writer.submit(os.path.join(self.tmpdir, '%d.jpg' % i), 'jpeg%d' % i)
+        writer.flush()
+        self.assertEqual(5, writer.written)
+        with open(os.path.join(self.tmpdir, '4.jpg')) as f:
+            self.assertEqual('jpeg4', f.read())
+
+    def test_pooled_foscam_snap(self):
+        ini_file = os.path.join(self.tmpdir, 'cgi_snap.ini')
+        host, port = self.camera.server_address[0:2]
+        with open(ini_file, 'w') as f:
+            f.write('[cgi_snap]\nip_address = %s\nport = %d\noutdir = %s\nusername = u\npassword = p\n' % (
+                    host, port, self.tmpdir))
+        snapper = PooledFoscamSnap(ini_file)
+        fname, data = snapper.snap_bytes('unknown')
+        snapper.writer.flush()
+        with open(fname, 'rb') as f:
+            self.assertEqual(data, f.read())
+        fname = snapper.snap_picture('unknown')
+        self.assertTrue(os.path.exists(fname))
+        self.assertEqual(1, self.camera.connections)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import unittest
+import cv2
+
+from fauxmo_garage.fcimage import FoscamImage
+from fauxmo_garage.matcher import find_template, find_template_windowed, find_template_pyramid, WindowedMatcher
+from fauxmo_garage.flimsy_constants import TEMPLATE_XY
+
+
+class MatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        pass
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(MatcherTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.topdir + '/2017*jpg'))
+        cls.full = dict()
+        for fname in cls.files:
+            fci = FoscamImage(fname)
+            cls.full[fname] = (fci.lab[0], fci.template, fci.template_match)
+
+    def tearDown(self):
+        pass
+
+    def test_full_path(self):
+        for fname in self.files:
+            self.assertEqual('full', self.full[fname][2].path)
+
+    def test_windowed_same_location(self):
+        wm = WindowedMatcher()
+        for fname in self.files:
+            L, template, full = self.full[fname]
+            found = wm(L, template)
+            if abs(full.xywh[0] - found.xywh[0]) > wm.margin or abs(full.xywh[1] - found.xywh[1]) > wm.margin:
+                # full-frame search can get lured far away (e.g. 2017-11-11_15_38 in afternoon glare)
+                self.assertLess(found.score, full.score)
+                continue
+            self.assertEqual(full.xywh, found.xywh,
+                'windowed search found %s, full-frame found %s for %s' % (found.xywh, full.xywh, fname))
+            self.assertEqual('window', found.path, 'expected window search to suffice for %s' % fname)
+
+    def test_windowed_fallback(self):
+        # a last location far from the template makes the window miss, so we fall back to full-frame search
+        L, template, full = self.full[self.files[0]]
+        found = find_template_windowed(L, template, last_xy=(1000, 500), margin=8)
+        self.assertEqual('fallback', found.path)
+        self.assertEqual(full.xywh, found.xywh)
+        self.assertAlmostEqual(full.score, found.score, places=5)
+
+    def test_pyramid_same_location(self):
+        for level in [4, 8]:
+            for fname in self.files:
+                L, template, full = self.full[fname]
+                found = find_template_pyramid(L, template, level=level)
+                self.assertEqual(full.xywh, found.xywh,
+                    'pyramid (level %d) found %s, full-frame found %s for %s' % (level, found.xywh, full.xywh, fname))
+                self.assertEqual('pyramid', found.path)
+
+    def test_pyramid_scales(self):
+        # template shrunk like after a zoom out is still found where the full-size one was (for a dawn image)
+        fname = self.files[0]
+        L, template, full = self.full[fname]
+        h, w = template.shape[0:2]
+        small = cv2.resize(L, (int(L.shape[1] * 0.9), int(L.shape[0] * 0.9)), interpolation=cv2.INTER_AREA)
+        found = find_template_pyramid(small, template, scales=(0.9, 1.0, 1.1))
+        self.assertEqual((int(round(w * 0.9)), int(round(h * 0.9))), found.xywh[2:4])
+        self.assertLessEqual(abs(found.xywh[0] - full.xywh[0] * 0.9), 2)
+        self.assertLessEqual(abs(found.xywh[1] - full.xywh[1] * 0.9), 2)
+
+    def test_foscam_image_search(self):
+        fname = self.files[0]
+        fci = FoscamImage(fname, search=WindowedMatcher())
+        self.assertEqual(self.full[fname][2].xywh, fci.xywh_template)
+        self.assertEqual('window', fci.template_match.path)
+        fci = FoscamImage(fname, search='pyramid')
+        self.assertEqual(self.full[fname][2].xywh, fci.xywh_template)
+        with self.assertRaises(ValueError):
+            FoscamImage(fname, search='bogus')
+
+    def test_windowed_reduced_decode(self):
+        # last location and margin are full-size, so a half-size decode still finds the template in the window
+        wm = WindowedMatcher()
+        for fname in self.files:
+            found = FoscamImage(fname, decode='reduced2', search=wm).template_match
+            self.assertEqual('window', found.path, 'expected window search to suffice for %s' % fname)
+            self.assertLessEqual(abs(found.xywh[0] * 2 - TEMPLATE_XY[0]), wm.margin)
+            self.assertLessEqual(abs(found.xywh[1] * 2 - TEMPLATE_XY[1]), wm.margin)
+        self.assertEqual(0, wm.paths['fallback'])
+        self.assertLessEqual(abs(wm.last_xy[0] - TEMPLATE_XY[0]), wm.margin)  # remembered in full-size pixels
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from fauxmo_garage.macpisocket.prefetch import Prefetcher
+
+
+class FakeSnap(object):
+    """stand-in for PooledFoscamSnap that serves data files (in turn) as snapped JPEG bytes"""
+
+    def __init__(self, files, outdir, delay=0.0):
+        self.files = files
+        self.outdir = outdir
+        self.delay = delay
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def snap_bytes(self, state):
+        with self._lock:
+            src = self.files[self.count % len(self.files)]
+            self.count += 1
+            fname = os.path.join(self.outdir, '%03d_%s' % (self.count, os.path.basename(src)))
+        time.sleep(self.delay)
+        with open(src, 'rb') as f:
+            return fname, f.read()
+
+
+class PrefetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.snapper = FakeSnap(self.files, self.tmpdir)
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(PrefetchTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.topdir + '/2017*jpg'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_fresh_then_cached_then_stale(self):
+        pf = Prefetcher(self.snapper, maxlen=3)
+        self.assertIsNone(pf.latest())
+        entry, cached = pf.get(max_age=10.0)
+        self.assertFalse(cached)
+        self.assertIn(entry.verdict, ['open', 'close'])
+        entry2, cached = pf.get(max_age=10.0)
+        self.assertTrue(cached)
+        self.assertEqual(entry, entry2)
+        entry3, cached = pf.get(max_age=0.0)
+        self.assertFalse(cached)
+        self.assertGreater(entry3.timestamp, entry.timestamp)
+        self.assertEqual(2, self.snapper.count)
+        self.assertEqual([], os.listdir(self.tmpdir), 'expected frames analysed in memory, not read back from disk')
+        for i in range(3):
+            pf.snap()
+        self.assertEqual(3, len(pf.ring))
+
+    def test_concurrent_requests_share_snap(self):
+        self.snapper.delay = 0.2
+        pf = Prefetcher(self.snapper)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(pf.get(max_age=5.0))) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(1, self.snapper.count, 'expected waiting requests to reuse the one forced snap')
+        self.assertEqual(1, len(set(r[0] for r in results)))
+
+    def test_background_thread(self):
+        pf = Prefetcher(self.snapper, interval=0.05)
+        pf.start()
+        try:
+            deadline = time.time() + 10.0
+            while len(pf.ring) < 2 and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            pf.stop()
+            pf.join(5.0)
+        self.assertGreaterEqual(pf.stats['background'], 2)
+        entry, cached = pf.get(max_age=60.0)
+        self.assertTrue(cached)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import glob
+import numpy as np
+from fauxmo_garage.deck import Deck, map_images
+from fauxmo_garage.roistack import roi_luminance
+from fauxmo_garage.roicube import build_cube, cube_files, RoiCube
+
+
+class RoiCubeTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(RoiCubeTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.basedir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.basedir + '/2017*jpg'))
+        cls.rois = map_images(roi_luminance, cls.files, workers=1)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cube_file = os.path.join(self.tmpdir, 'roi_cube.npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_build_matches_decoded_rois(self):
+        rc, decoded = build_cube(self.files, cube_file=self.cube_file, workers=2)
+        self.assertEqual(decoded, len(self.files))
+        self.assertTrue(all(os.path.exists(f) for f in cube_files(self.cube_file)[::2]))
+        self.assertIsInstance(rc.rois, np.memmap)
+        for fname, roi in zip(self.files, self.rois):
+            np.testing.assert_array_equal(rc.roi_luminance(fname), roi)
+        self.assertEqual(list(rc.index['state']), [os.path.basename(f)[17:-4] for f in self.files])
+
+    def test_rebuild_decodes_only_new_files(self):
+        build_cube(self.files[:-3], cube_file=self.cube_file, workers=1)
+        rc, decoded = build_cube(self.files, cube_file=self.cube_file, workers=1)
+        self.assertEqual(decoded, 3)
+        self.assertEqual(len(rc), len(self.files))
+        np.testing.assert_array_equal(rc.roi_luminance(self.files[-1]), self.rois[-1])
+        np.testing.assert_array_equal(rc.roi_luminance(self.files[0]), self.rois[0])
+
+    def test_take_is_view_for_consecutive_rows(self):
+        rc, decoded = build_cube(self.files, cube_file=self.cube_file, workers=1)
+        view = rc.take(self.files[2:6])
+        self.assertTrue(np.shares_memory(view, rc.rois))
+        picked = rc.take([self.files[5], self.files[1]])
+        self.assertFalse(np.shares_memory(picked, rc.rois))
+        np.testing.assert_array_equal(picked[1], self.rois[1])
+        with self.assertRaises(KeyError):
+            rc.take(['/nowhere/2017-01-01_00_00_open.jpg'])
+
+    def test_windows(self):
+        rc, decoded = build_cube(self.files[:4], cube_file=self.cube_file, windows=True, workers=1)
+        self.assertEqual(rc.windows.shape[0], 4)
+        self.assertTrue((rc.index['tscore'] > 0.5).all())
+        # a cube without windows drops the window file
+        build_cube(self.files[:4], cube_file=self.cube_file, workers=1)
+        self.assertIsNone(RoiCube(self.cube_file).windows)
+        self.assertFalse(os.path.exists(cube_files(self.cube_file)[1]))
+
+    def test_deck_cube_mode(self):
+        build_cube(self.files, cube_file=self.cube_file, workers=1)
+        deck = Deck(basedir=self.basedir, date_range=['2017-11-01', '2017-12-31'], morning=False,
+                    cube=self.cube_file)
+        fcis = list(deck.images)
+        self.assertEqual(len(fcis), len(deck.filenames))
+        self.assertTrue(np.shares_memory(fcis[0].roi_luminance, deck.cube.rois))
+        self.assertEqual(fcis[0].foscam_file.state, os.path.basename(deck.filenames[0])[17:-4])
+        plain = Deck(basedir=self.basedir, date_range=['2017-11-01', '2017-12-31'], morning=False)
+        np.testing.assert_array_equal(deck.batch_stats()['median'], plain.batch_stats(workers=1)['median'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+import glob
+import numpy as np
+import cv2
+from fauxmo_garage.deck import map_images, roi_median
+from fauxmo_garage.roistack import (RoiStack, roi_luminance, stack_rois, batch_medians, batch_percentiles,
+                                    batch_histograms, PERCENTILES)
+
+
+class RoiStackTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(RoiStackTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.basedir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.basedir + '/2017*jpg'))
+        cls.rois = map_images(roi_luminance, cls.files, workers=1)
+        cls.stack = stack_rois(cls.rois)
+
+    def test_stack_is_contiguous_uint8(self):
+        h, w = self.rois[0].shape
+        self.assertEqual(self.stack.shape, (len(self.files), h, w))
+        self.assertEqual(self.stack.dtype, np.uint8)
+        self.assertTrue(self.stack.flags['C_CONTIGUOUS'])
+
+    def test_stack_rejects_mixed_shapes(self):
+        with self.assertRaises(ValueError):
+            stack_rois([np.zeros((4, 4), np.uint8), np.zeros((4, 5), np.uint8)])
+
+    def test_batch_stats_match_per_image(self):
+        meds = batch_medians(self.stack)
+        pcts = batch_percentiles(self.stack)
+        hists = batch_histograms(self.stack)
+        for i, roi in enumerate(self.rois):
+            self.assertEqual(meds[i], np.median(roi))
+            np.testing.assert_allclose(pcts[i], np.percentile(roi, PERCENTILES))
+            h = cv2.calcHist([roi], [0], None, [256], [0, 256]).ravel()
+            np.testing.assert_array_equal(hists[i], h)
+        self.assertEqual(list(meds), map_images(roi_median, self.files, workers=1))
+
+    def test_stats_frame(self):
+        rs = RoiStack(self.files, self.stack)
+        df = rs.stats()
+        self.assertEqual(len(df), len(self.files))
+        self.assertTrue(df.index.is_monotonic_increasing)
+        self.assertEqual(list(df['fname']), self.files)
+        self.assertTrue(all(os.path.basename(f).endswith(s + '.jpg') for f, s in zip(df['fname'], df['state'])))
+        self.assertEqual(list(df.columns[-len(PERCENTILES):]), ['p%d' % p for p in PERCENTILES])
+
+    def test_state_aggregates(self):
+        rs = RoiStack(self.files, self.stack)
+        agg = rs.state_aggregates()
+        self.assertEqual(agg['count'].sum(), len(self.files))
+        hists = rs.state_histograms()
+        for state in agg.index:
+            self.assertEqual(hists[state].sum(), agg.loc[state, 'count'] * self.stack[0].size)
+            sub = rs.stats()[rs.states == state]
+            self.assertAlmostEqual(agg.loc[state, 'mean'], sub['median'].mean())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+import time
+import threading
+import unittest
+
+from fauxmo_garage.macpisocket.async_socket_common import SingleFlight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sf = SingleFlight()
+        self.calls = 0
+
+    def tearDown(self):
+        pass
+
+    def _slow(self):
+        self.calls += 1
+        time.sleep(0.3)
+        return 'result%d' % self.calls
+
+    def _run_concurrently(self, func, n=5):
+        results = []
+        started = threading.Event()
+
+        def caller():
+            started.wait()
+            try:
+                results.append(self.sf.do('snap', func))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=caller) for i in range(n)]
+        for t in threads:
+            t.start()
+        started.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_coalesce(self):
+        results = self._run_concurrently(self._slow)
+        self.assertEqual(1, self.calls)
+        self.assertEqual([('result1', 5)] * 5, results)
+        self.assertEqual(4, self.sf.coalesced)
+
+        # once the flight lands, the next caller starts a new one
+        self.assertEqual(('result2', 1), self.sf.do('snap', self._slow))
+        self.assertEqual(2, self.sf.calls)
+
+    def test_keys_independent(self):
+        self.assertEqual((1, 1), self.sf.do('a', lambda: 1))
+        self.assertEqual((2, 1), self.sf.do('b', lambda: 2))
+
+    def test_error_shared(self):
+        def broken():
+            time.sleep(0.3)
+            raise RuntimeError('camera unreachable')
+        results = self._run_concurrently(broken, n=3)
+        self.assertEqual(3, len(results))
+        for r in results:
+            self.assertIsInstance(r, RuntimeError)
+        self.assertEqual(1, self.sf.calls)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
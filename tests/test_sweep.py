@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+import glob
+import numpy as np
+from fauxmo_garage.deck import map_images, roi_median
+from fauxmo_garage.roistack import stack_rois
+from fauxmo_garage.sweep import raw_roi_luminance, sweep_medians, evaluate, sweep, best_per_combo
+
+
+class SweepTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(SweepTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.basedir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.basedir + '/2017*jpg'))
+        cls.raw = stack_rois(map_images(raw_roi_luminance, cls.files, workers=1, decode='rows'))
+
+    def test_default_settings_match_fcimage(self):
+        combos, medians = sweep_medians(self.raw, (5,), (3.0,), (8,), workers=1)
+        self.assertEqual(combos, [(5, 3.0, 8)])
+        exp = map_images(roi_median, self.files, workers=1, decode='rows')
+        np.testing.assert_array_equal(medians[0], exp)
+
+    def test_parallel_matches_serial(self):
+        grid = ((0, 5), (2.0, 4.0), (4, 8))
+        combos, serial = sweep_medians(self.raw, *grid, workers=1)
+        combos2, parallel = sweep_medians(self.raw, *grid, workers=3, chunksize=10)
+        self.assertEqual(combos, combos2)
+        self.assertEqual(serial.shape, (8, len(self.files)))
+        np.testing.assert_array_equal(serial, parallel)
+
+    def test_evaluate_matches_brute_force(self):
+        rng = np.random.RandomState(3)
+        medians = rng.randint(0, 512, (6, 50)) / 2.0
+        is_open = rng.rand(50) < 0.4
+        thresholds = np.arange(0.0, 256.0, 0.5)
+        accuracy, margin = evaluate(medians, is_open, thresholds)
+        for c in range(len(medians)):
+            for j, t in enumerate(thresholds):
+                self.assertAlmostEqual(accuracy[c, j], ((medians[c] < t) == is_open).mean())
+        self.assertEqual(margin.shape, accuracy.shape)
+        self.assertTrue((np.diff(margin, axis=1) != 0).all())
+
+    def test_sweep_table(self):
+        thresholds = np.arange(150.0, 200.0, 1.0)
+        df = sweep(self.files, blursizes=(5,), cliplims=(2.0, 3.0), gridsizes=(8,), thresholds=thresholds,
+                   workers=1)
+        self.assertEqual(len(df), 2 * len(thresholds))
+        self.assertTrue((np.diff(df['accuracy']) <= 0).all())
+        best = best_per_combo(df)
+        self.assertEqual(len(best), 2)
+        self.assertEqual(best.loc[0, 'accuracy'], df['accuracy'].max())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
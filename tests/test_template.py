@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
 import os
+import shutil
+import tempfile
 import unittest
 from fauxmo_garage.flimsy_constants import DEFAULT_TEMPLATE
-from fauxmo_garage.template import GrayscaleTemplateImage
+from fauxmo_garage.template import GrayscaleTemplateImage, get_template_image, REGISTRY_STATS
 
 
 class TemplateTestCase(unittest.TestCase):
@@ -60,6 +62,30 @@ class TemplateTestCase(unittest.TestCase):
         template = GrayscaleTemplateImage(DEFAULT_TEMPLATE)
         self._verify_grayscale_from_dims(template.image)
 
+    def test_registry_shares_one_array(self):
+        reads = REGISTRY_STATS['reads']
+        images = [GrayscaleTemplateImage(DEFAULT_TEMPLATE).image for i in range(5)]
+        images.append(get_template_image(DEFAULT_TEMPLATE))
+        for img in images:
+            self.assertIs(images[0], img, 'template registry handed out a different array')
+        self.assertFalse(images[0].flags.writeable, 'shared template array should be read-only')
+        self.assertLessEqual(REGISTRY_STATS['reads'] - reads, 1, 'template file was read more than once')
+
+    def test_registry_reloads_on_mtime_change(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'template.png')
+            shutil.copy(os.path.join(self.data_dir, 'box.png'), fname)
+            img1 = get_template_image(fname)
+            self.assertIs(img1, get_template_image(fname), 'unchanged template file should not be re-read')
+            shutil.copy(os.path.join(self.data_dir, 'box_in_scene.png'), fname)
+            mtime = os.stat(fname).st_mtime
+            os.utime(fname, (mtime + 10, mtime + 10))  # make sure mtime changes even on coarse filesystems
+            img2 = get_template_image(fname)
+            self.assertNotEqual(img1.shape, img2.shape, 'changed template file was not re-read')
+        finally:
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import os
+import unittest
+import glob
+import numpy as np
+import pandas as pd
+from fauxmo_garage.matcher import TM_METHODS, find_template
+from fauxmo_garage.fcimage import FoscamImage
+from fauxmo_garage.template_eval import (daypart, peak_margin, match_methods, evaluate, summarize, frontier,
+                                         choose_default, COLUMNS)
+
+
+class TemplateEvalTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(TemplateEvalTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.basedir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.basedir + '/2017*jpg'))[:8]
+        cls.results = evaluate(cls.files, workers=2)
+
+    def test_daypart(self):
+        self.assertEqual([daypart(h) for h in (0, 5, 6, 12, 19, 23)],
+                         ['night', 'night', 'morning', 'midday', 'evening', 'night'])
+
+    def test_peak_margin(self):
+        res = np.zeros((20, 20), dtype=np.float32)
+        res[5, 5] = 1.0
+        self.assertEqual(peak_margin(res, 1.0, (5, 5), (2, 2)), 1.0)
+        res[15, 15] = 0.75
+        self.assertAlmostEqual(peak_margin(res, 1.0, (5, 5), (2, 2)), 0.25)
+        res[15, 15] = 1.0
+        self.assertEqual(peak_margin(res, 1.0, (5, 5), (2, 2)), 0.0)
+
+    def test_every_method_finds_planted_template(self):
+        rng = np.random.RandomState(7)
+        img = rng.randint(0, 256, (160, 240)).astype(np.uint8)
+        img = np.repeat(np.repeat(img[::4, ::4], 4, axis=0), 4, axis=1)  # blocky so it survives downsampling
+        template = img[40:88, 96:160].copy()
+        rows = match_methods(img, template, levels=(1, 2, 4))
+        self.assertEqual(len(rows), len(TM_METHODS) * 3)
+        for row in rows:
+            if row['method'] == 'TM_CCORR':
+                continue  # unnormalized correlation favors bright patches over the template itself
+            self.assertEqual((row['x'], row['y']), (96, 40), row)
+            self.assertTrue(row['margin'] > 0, row)
+
+    def test_default_method_matches_find_template(self):
+        fci = FoscamImage(self.files[0], roi_only=True, decode='rows')
+        found = find_template(fci.lab[0], fci.template)
+        row = [r for r in match_methods(fci.lab[0], fci.template, levels=(1,)) if r['method'] == 'TM_CCOEFF_NORMED']
+        self.assertEqual((row[0]['x'], row[0]['y']), found.xywh[0:2])
+        self.assertAlmostEqual(row[0]['score'], found.score, places=5)
+
+    def test_evaluate_table(self):
+        df = self.results
+        self.assertEqual(len(df), len(self.files) * len(TM_METHODS) * 3)
+        self.assertTrue(set(COLUMNS + ['offset', 'hit', 'spread']) <= set(df.columns))
+        self.assertTrue((df['sec'] > 0).all())
+        summary = summarize(df, by=('method', 'level'))
+        self.assertEqual(len(summary), len(TM_METHODS) * 3)
+        self.assertTrue((summary['images'] == len(self.files)).all())
+        self.assertIn(choose_default(df)[0], TM_METHODS)
+
+    def test_frontier_and_choose_default(self):
+        rows = []
+        for part in ('night', 'midday'):
+            for method, level, hit, sec in (('A', 1, 1.0, 0.10), ('A', 4, 0.9, 0.01), ('B', 2, 1.0, 0.02),
+                                            ('C', 2, 0.5, 0.05)):
+                if method == 'B' and part == 'night':
+                    hit = 0.8  # fast and accurate by day, but not in the dark
+                rows.append({'daypart': part, 'method': method, 'level': level, 'hit': hit, 'offset': 0.0,
+                             'spread': 0.0, 'margin': 0.5, 'sec': sec})
+        df = pd.DataFrame(rows)
+        front = frontier(df)
+        self.assertEqual(list(front.loc['midday'].index), [('A', 4), ('B', 2)])
+        self.assertEqual(list(front.loc['night'].index), [('A', 4), ('A', 1)])
+        self.assertEqual(choose_default(df), ('A', 1))
+        self.assertEqual(choose_default(df, min_hit_rate=0.8), ('A', 4))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+import glob
+import numpy as np
+import pandas as pd
+from fauxmo_garage.deck import map_images
+from fauxmo_garage.fcimage import FoscamImage
+from fauxmo_garage.flimsy_constants import MEDIAN_THRESHOLD
+from fauxmo_garage.threshold import ThresholdEngine, best_thresholds, threshold_features, NBINS
+from fauxmo_garage.macpisocket.async_socket_common import AnalysisResults
+
+
+def _counts(medians):
+    counts = np.zeros(NBINS, dtype=np.int64)
+    for m in medians:
+        counts[int(round(2 * m))] += 1
+    return counts
+
+
+class ThresholdTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(ThresholdTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.basedir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.basedir + '/2017*jpg'))
+        cls.frames = pd.DataFrame(map_images(threshold_features, cls.files, workers=2))
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'thresholds.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        AnalysisResults.threshold_engine = None
+
+    def test_best_thresholds(self):
+        # separable: threshold lands midway in the gap, with no errors
+        t, err = best_thresholds(_counts([30, 40, 120])[None], _counts([200, 215.5, 240])[None])
+        self.assertEqual(err[0], 0)
+        self.assertEqual(t[0], 160.0)
+        # one open frame looks closed: it costs one error, threshold still in the widest gap
+        t, err = best_thresholds(_counts([30, 40, 230])[None], _counts([200, 215, 240])[None])
+        self.assertEqual(err[0], 1)
+        self.assertTrue(40 < t[0] <= 200)
+
+    def test_empty_engine_uses_fixed_threshold(self):
+        engine = ThresholdEngine(self.filename)
+        self.assertEqual(len(engine), 0)
+        self.assertEqual(engine.threshold(6, 50.0), MEDIAN_THRESHOLD)
+        self.assertTrue((engine.source == 'fixed').all())
+        self.assertFalse(engine.add(100.0, 'unknown', 6, 50.0))
+
+    def test_incremental_add_same_as_batch(self):
+        one = ThresholdEngine(self.filename, min_count=2)
+        for i, row in self.frames.iterrows():
+            one.add(row['median'], row['state'], row['hour'], row['brightness'], key=row['bname'])
+        two = ThresholdEngine(self.filename, min_count=2)
+        self.assertEqual(two.add_many(self.frames), len(self.files))
+        self.assertEqual(two.add_many(self.frames), 0)  # already counted
+        np.testing.assert_array_equal(one.table, two.table)
+        self.assertTrue((two.source == 'bucket').any())
+        for i, row in self.frames.iterrows():
+            self.assertEqual(two.classify(row['median'], row['hour'], row['brightness']),
+                             'open' if row['median'] < two.threshold(row['hour'], row['brightness']) else 'close')
+
+    def test_learned_no_worse_than_fixed_on_training_frames(self):
+        engine = ThresholdEngine(self.filename, min_count=2)
+        engine.add_many(self.frames)
+        report = engine.report(self.frames)
+        self.assertEqual(report.loc['all', 'frames'], len(self.files))
+        self.assertLessEqual(report.loc['all', 'learned_errors'], report.loc['all', 'fixed_errors'])
+
+    def test_save_and_load(self):
+        engine = ThresholdEngine(self.filename, min_count=2)
+        engine.add_many(self.frames)
+        engine.save()
+        loaded = ThresholdEngine(self.filename, min_count=2)
+        np.testing.assert_array_equal(loaded.table, engine.table)
+        self.assertEqual(loaded.seen, engine.seen)
+        self.assertFalse(loaded.add_frame(FoscamImage(self.files[0], roi_only=True)))
+
+    def test_analysis_results_use_engine(self):
+        engine = ThresholdEngine(self.filename, min_count=2)
+        engine.add_many(self.frames)
+        AnalysisResults.threshold_engine = engine
+        for fname, row in zip(self.files, self.frames.itertuples()):
+            ar = AnalysisResults(fname)
+            ar.compute()
+            self.assertEqual(ar.threshold, engine.threshold(row.hour, row.brightness))
+            self.assertEqual(ar.state, engine.classify(row.median, row.hour, row.brightness))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import os
+import csv
+import glob
+import shutil
+import tempfile
+import unittest
+
+from fauxmo_garage import tracing
+from fauxmo_garage.fcimage import FoscamImage
+
+
+class TracingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        tracing.clear_sinks()
+        tracing.add_sink(self.events.append)
+        self.tmpdir = tempfile.mkdtemp()
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(TracingTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.fname = sorted(glob.glob(cls.topdir + '/2017*jpg'))[0]
+
+    def tearDown(self):
+        tracing.clear_sinks()
+        shutil.rmtree(self.tmpdir)
+
+    def test_stage_events(self):
+        fci = FoscamImage(self.fname)
+        fci.template_match
+        fci.roi_luminance
+        fci.roi_luminance
+        computed = [e['name'] for e in self.events if e.get('hit') is False]
+        for stage in FoscamImage.STAGES:
+            self.assertEqual(1, computed.count('fcimage.' + stage), 'expected one computed event for %s' % stage)
+        hits = [e for e in self.events if e.get('hit')]
+        self.assertEqual(fci.cache_hits['roi_luminance'], len([e for e in hits if e['name'] == 'fcimage.roi_luminance']))
+        decode = [e for e in self.events if e['name'] == 'decode'][0]
+        self.assertEqual(os.path.getsize(self.fname), decode['bytes'])
+        self.assertEqual(fci.image.shape[0] * fci.image.shape[1], decode['pixels'])
+        for e in self.events:
+            self.assertEqual(os.path.basename(self.fname), e['img'])
+
+    def test_decode_bytes_event(self):
+        with open(self.fname, 'rb') as f:
+            data = f.read()
+        for mode in ('color', 'rows'):
+            del self.events[:]
+            fci = FoscamImage.from_bytes(data, name=self.fname, roi_only=True, decode=mode)
+            fci.roi_luminance
+            decode = [e for e in self.events if e['name'] == 'decode']
+            self.assertEqual(1, len(decode), 'expected one decode event in %s mode' % mode)
+            self.assertEqual(len(data), decode[0]['bytes'])
+            self.assertEqual(fci.image.shape[0] * fci.image.shape[1], decode[0]['pixels'])
+            self.assertEqual(os.path.basename(self.fname), decode[0]['img'])
+        del self.events[:]
+        FoscamImage(self.fname, roi_only=True, decode='rows').roi_luminance
+        self.assertEqual(1, len([e for e in self.events if e['name'] == 'decode']))
+
+    def test_no_sinks_no_events(self):
+        tracing.clear_sinks()
+        self.assertFalse(tracing.enabled())
+        with tracing.span('nothing') as ev:
+            ev['bytes'] = 1
+        FoscamImage(self.fname, roi_only=True).roi_luminance
+        self.assertEqual([], self.events)
+
+    def test_broken_sink(self):
+        def broken(event):
+            raise RuntimeError('oops')
+        tracing.add_sink(broken)
+        with tracing.span('survives'):
+            pass
+        self.assertEqual('survives', self.events[-1]['name'])
+
+    def test_csv_sink(self):
+        fname = os.path.join(self.tmpdir, 'trace.csv')
+        sink = tracing.add_sink(tracing.CsvSink(fname))
+        FoscamImage(self.fname, roi_only=True).roi_luminance
+        sink.close()
+        with open(fname) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(self.events), len(rows))
+        self.assertIn('decode', [r['name'] for r in rows])
+
+    def test_prometheus_sink(self):
+        fname = os.path.join(self.tmpdir, 'trace.prom')
+        sink = tracing.add_sink(tracing.PrometheusSink(fname, interval=0))
+        FoscamImage(self.fname).template_match
+        with open(fname) as f:
+            text = f.read()
+        self.assertIn('fauxmo_garage_stage_calls_total{stage="fcimage.template_match"} 1', text)
+        self.assertIn('fauxmo_garage_stage_bytes_total{stage="decode"} %d' % os.path.getsize(self.fname), text)
+        self.assertEqual([os.path.basename(fname)], os.listdir(self.tmpdir))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import os
+import time
+import glob
+import shutil
+import tempfile
+import unittest
+
+from fauxmo_garage.watcher import Watcher, InotifySource, PollingSource, read_latest_verdict
+from fauxmo_garage.flimsy_constants import DEFAULT_TEMPLATE
+
+
+class WatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.verdict_file = os.path.join(self.tmpdir, 'latest.json')
+
+    @classmethod
+    def setUpClass(cls):
+        """ just do this once [whereas setUp gets called for each test]
+        """
+        super(WatcherTestCase, cls).setUpClass()
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        cls.topdir = cwd.replace(os.path.basename(cwd), 'data')
+        cls.files = sorted(glob.glob(cls.topdir + '/2017*jpg'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _check_source(self, source):
+        w = Watcher(topdir=self.tmpdir, tmp_name=DEFAULT_TEMPLATE, verdict_file=self.verdict_file, source=source)
+        self.assertIsNone(read_latest_verdict(self.verdict_file))
+        self.assertEqual([], w.step(timeout=0.1))
+
+        # half-written file is not classified yet (no close-after-write, size moving, no end-of-image marker)
+        src = self.files[0]
+        dest = os.path.join(self.tmpdir, os.path.basename(src))
+        with open(src, 'rb') as f:
+            data = f.read()
+        f = open(dest, 'wb')
+        f.write(data[:len(data) // 2])
+        f.flush()
+        self.assertEqual([], w.step(timeout=0.2))
+        f.write(data[len(data) // 2:])
+        f.close()
+
+        verdicts = w.step(timeout=2.0)
+        if not verdicts:
+            verdicts = w.step(timeout=2.0)  # polling needs one more look to see that size held steady
+        self.assertEqual(1, len(verdicts))
+        expect = os.path.basename(src).split('_')[-1].replace('.jpg', '')
+        self.assertEqual(expect, verdicts[0]['verdict'])
+        self.assertEqual(verdicts[0], read_latest_verdict(self.verdict_file))
+
+        # files not named like snapshots are ignored
+        shutil.copy(src, os.path.join(self.tmpdir, 'template.jpg'))
+        self.assertEqual([], w.step(timeout=1.0))
+        self.assertEqual(1, w.count)
+
+    def test_inotify_source(self):
+        try:
+            source = InotifySource(self.tmpdir)
+        except OSError:
+            self.skipTest('no inotify on this platform')
+        self._check_source(source)
+
+    def test_polling_source(self):
+        self._check_source(PollingSource(self.tmpdir, interval=0.05))
+
+    def test_bad_files_skipped(self):
+        class ListSource(object):
+            def __init__(self):
+                self.names = []
+
+            def wait(self, timeout=1.0):
+                names, self.names = self.names, []
+                return names
+
+            def close(self):
+                pass
+
+        source = ListSource()
+        w = Watcher(topdir=self.tmpdir, tmp_name=DEFAULT_TEMPLATE, verdict_file=self.verdict_file, source=source,
+                    settle_sec=0.2)
+        with open(self.files[0], 'rb') as f:
+            data = f.read()
+        with open(os.path.join(self.tmpdir, '2017-11-10_06_06_close.jpg'), 'wb') as f:
+            f.write('not a jpeg at all\xff\xd9')  # ends like a JPEG, but will not decode
+        with open(os.path.join(self.tmpdir, '2017-11-10_06_07_close.jpg'), 'wb') as f:
+            f.write(data[:len(data) // 2])  # writer not done yet
+        shutil.copy(self.files[0], os.path.join(self.tmpdir, '2017-11-10_06_08_close.jpg'))
+        source.names = ['2017-11-10_06_06_close.jpg', '2017-11-10_06_07_close.jpg', '2017-11-10_06_08_close.jpg']
+
+        verdicts = w.step()
+        self.assertEqual(['2017-11-10_06_08_close.jpg'], [os.path.basename(v['img']) for v in verdicts])
+        self.assertEqual(1, w.errors)
+
+        # half-written file gets retried, and classified once the writer finishes
+        with open(os.path.join(self.tmpdir, '2017-11-10_06_07_close.jpg'), 'ab') as f:
+            f.write(data[len(data) // 2:])
+        self.assertEqual(1, len(w.step()))
+
+        # one that never finishes is given up on after settle_sec
+        with open(os.path.join(self.tmpdir, '2017-11-10_06_09_close.jpg'), 'wb') as f:
+            f.write(data[:100])
+        source.names = ['2017-11-10_06_09_close.jpg']
+        self.assertEqual([], w.step())
+        time.sleep(0.3)
+        self.assertEqual([], w.step())
+        self.assertEqual((2, 2), (w.count, w.errors))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+import socket
+import struct
+import logging
+import threading
+import unittest
+import SocketServer
+
+from fauxmo_garage.macpisocket import wire
+from fauxmo_garage.macpisocket import async_socket_client
+from fauxmo_garage.macpisocket.wire import Request, Response, WireClient, WireError, WireRequestHandler
+
+
+class ThreadedTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+
+
+class DribbleSocket(object):
+    """wraps bytes and hands them out one byte per recv, like the worst-case TCP split"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def recv(self, n):
+        b, self.data = self.data[:1], self.data[1:]
+        return b
+
+
+class WireTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = None
+
+    def tearDown(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def _serve(self):
+        def answer(req):
+            timings = {'snap': 0.5, 'analysis': 0.25}
+            return Response(req.request_id, 'close', req.want != 'close', 201.0, 0.5, timings, '')
+        self.server = ThreadedTCPServer(('127.0.0.1', 0), WireRequestHandler)
+        self.server.answer = answer
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+        return self.server.server_address
+
+    def test_roundtrip_large(self):
+        # more than 1 KB each way, read back one byte at a time
+        req = Request(7, 'open', u'pihole-' + u'x' * 2000)
+        data = wire.pack_request(req)
+        self.assertGreater(len(data), 1024)
+        self.assertEqual(req, wire.unpack_request(wire.read_message(DribbleSocket(data), wire.KIND_REQUEST)))
+
+        timings = dict(('stage%03d' % i, i / 1000.0) for i in range(100))
+        resp = Response(7, 'close', True, 201.5, 0.5, timings, u'')
+        data = wire.pack_response(resp)
+        self.assertGreater(len(data), 1024)
+        self.assertEqual(resp, wire.unpack_response(wire.read_message(DribbleSocket(data), wire.KIND_RESPONSE)))
+
+    def test_bad_messages(self):
+        data = wire.pack_request(Request(1, 'open', 'pi'))
+        with self.assertRaises(WireError):
+            wire.read_message(DribbleSocket('XXXX' + data[4:]), wire.KIND_REQUEST)
+        with self.assertRaises(WireError):
+            wire.read_message(DribbleSocket(data[:4] + struct.pack('>B', 99) + data[5:]), wire.KIND_REQUEST)
+        with self.assertRaises(WireError):
+            wire.read_message(DribbleSocket(data), wire.KIND_RESPONSE)
+        with self.assertRaises(EOFError):
+            wire.read_message(DribbleSocket(data[:-1]), wire.KIND_REQUEST)
+        with self.assertRaises(WireError):
+            wire.pack_request(Request(1, 'ajar', 'pi'))
+
+    def test_pipeline_persistent(self):
+        ip, port = self._serve()
+        client = WireClient(ip, port, client='test')
+        wants = ['open', 'close', 'unknown', 'close', 'open']
+        responses = client.pipeline(wants)
+        self.assertEqual([w != 'close' for w in wants], [r.trigger_button for r in responses])
+        self.assertEqual(sorted(set(r.request_id for r in responses)), [r.request_id for r in responses])
+        sock = client.sock
+        resp = client.request('close')
+        self.assertIs(sock, client.sock, 'expected connection to be reused')
+        self.assertFalse(resp.trigger_button)
+        self.assertEqual({'snap': 0.5, 'analysis': 0.25}, resp.timings)
+        client.close()
+
+    def test_reconnect(self):
+        ip, port = self._serve()
+        client = WireClient(ip, port, client='test')
+        client.request('open')
+        client.sock.shutdown(socket.SHUT_RDWR)  # connection went stale under us
+        self.assertEqual('close', client.request('open').verdict)
+        client.close()
+
+    def test_shipped_client(self):
+        ip, port = self._serve()
+        async_socket_client.logger = logging.getLogger('test_wire')  # normally set up by client's __main__
+        self.assertTrue(async_socket_client.send_to_server_wire(ip, port, 'open'))
+        self.assertFalse(async_socket_client.send_to_server_wire(ip, port, 'close'))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
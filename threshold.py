@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""Open/close decision thresholds learned from the labelled snapshot archive.
+
+This module replaces the one fixed MEDIAN_THRESHOLD with a table of thresholds, one per (hour of day, scene
+brightness) bucket, each placed where it misclassifies the fewest labelled frames (filenames carry open or
+close). The engine keeps a histogram of roi medians per bucket and per state, so each new labelled frame is
+counted in O(1) and the table is recalibrated from the histograms without revisiting any image. Looking up a
+threshold is two small array indexings, so it is cheap enough for the server's hot path.
+
+A bucket with too few frames of either state borrows the threshold of its whole hour (all brightness), then
+of the whole archive, then falls back to MEDIAN_THRESHOLD.
+
+Example:
+    Learn thresholds from older days of a date range and report accuracy on the newer days against the fixed
+    threshold::
+
+        $ python threshold.py 2017-11-10 2017-11-17
+
+"""
+
+import os
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+from flimsy_constants import DEFAULT_THRESHOLD_FILE, MEDIAN_THRESHOLD, ROI_DECODE_ROWS
+
+HOUR_WIDTH = 3                            # hours of day per bucket
+BRIGHTNESS_EDGES = (0, 80, 110, 140, 256)  # scene brightness bucket edges (night/IR is ~50-65, daylight ~130-145)
+MIN_COUNT = 5                             # frames of each state a bucket needs before it gets its own threshold
+NBINS = 511  # roi medians of uint8 pixels are whole or half values 0.0 to 255.0, so bin index is 2 * median
+
+
+def scene_brightness(img, scale=1):
+    """return float mean pixel value over the (subsampled) top band of decoded image, as a measure of scene light"""
+    step = max(1, 4 // scale)
+    return float(img[:ROI_DECODE_ROWS // scale:step, ::step].mean())
+
+
+def threshold_features(fci):
+    """return dict of bname, dtm, state, median, hour and brightness for FoscamImage, fci (for map_images)"""
+    fcf = fci.foscam_file
+    return {
+        'bname': fcf.bname,
+        'dtm': fcf.dtm,
+        'state': fcf.state,
+        'median': float(np.median(fci.roi_luminance)),
+        'hour': fcf.dtm.hour,
+        'brightness': scene_brightness(fci.image, fci.scale),
+    }
+
+
+def best_thresholds(open_counts, close_counts):
+    """Find error-minimizing thresholds for rows of roi median histograms (door is open when median < threshold).
+
+    Returns 2-tuple (thresholds, errors) of (K,) arrays; each threshold is at the center of the widest run of
+    candidate thresholds that misclassify the fewest frames, for the most margin on both sides.
+    -------
+    Input arguments:
+    open_counts  -- (K, NBINS) array of counts of open frames by 2 * median
+    close_counts -- (K, NBINS) array of counts of close frames by 2 * median
+
+    """
+    k = len(open_counts)
+    cum_open = np.zeros((k, NBINS + 1), dtype=np.int64)
+    cum_close = np.zeros((k, NBINS + 1), dtype=np.int64)
+    cum_open[:, 1:] = np.cumsum(open_counts, axis=1)
+    cum_close[:, 1:] = np.cumsum(close_counts, axis=1)
+    # candidate i calls bin indexes below i open: open frames at or above it and close frames below it are wrong
+    errors = (cum_open[:, -1:] - cum_open) + cum_close
+    best = errors.min(axis=1)
+    thresholds = np.empty(k)
+    for row in range(k):
+        is_min = np.concatenate(([0], (errors[row] == best[row]).astype(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(is_min))
+        starts, stops = edges[0::2], edges[1::2] - 1
+        widest = np.argmax(stops - starts)
+        # midway between last bin called open and first called close, over 2 for median
+        thresholds[row] = max(0, starts[widest] - 1 + stops[widest]) / 4.0
+    return thresholds, best
+
+
+class ThresholdEngine(object):
+
+    """A table of learned thresholds by (hour of day, scene brightness), recalibrated as labelled frames arrive.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, filename=DEFAULT_THRESHOLD_FILE, hour_width=HOUR_WIDTH, brightness_edges=BRIGHTNESS_EDGES,
+                 min_count=MIN_COUNT, load=True):
+        self.filename = filename  #: str: full path of .npz file the engine persists in
+        self.min_count = min_count  #: int: frames of each state a bucket needs for its own threshold
+        self.seen = set()         #: set: keys (basenames) of labelled frames already counted
+        self._lock = threading.Lock()
+        if load and os.path.exists(filename):
+            with np.load(filename) as npz:
+                self._setup(int(npz['hour_width']), tuple(npz['brightness_edges']))
+                self.open_counts[:] = npz['open_counts']
+                self.close_counts[:] = npz['close_counts']
+                self.seen = set(str(k) for k in npz['seen'])
+        else:
+            self._setup(hour_width, brightness_edges)
+        self.recalibrate()
+
+    def _setup(self, hour_width, brightness_edges):
+        self.hour_width = hour_width              #: int: hours of day per bucket
+        self.brightness_edges = brightness_edges  #: tuple: scene brightness bucket edges
+        nh, nb = -(-24 // hour_width), len(brightness_edges) - 1
+        self.open_counts = np.zeros((nh, nb, NBINS), dtype=np.int64)   #: numpy.ndarray: open frame counts
+        self.close_counts = np.zeros((nh, nb, NBINS), dtype=np.int64)  #: numpy.ndarray: close frame counts
+        self.table = np.full((nh, nb), MEDIAN_THRESHOLD)  #: numpy.ndarray: (hour bin, brightness bin) -> threshold
+        self.source = np.full((nh, nb), 'fixed', dtype='S6')  #: numpy.ndarray: bucket, hour, all or fixed
+        # lookup tables make bucket of (hour, brightness) two indexings
+        self._hour_bin = np.arange(24) // hour_width
+        self._bright_bin = np.clip(np.searchsorted(brightness_edges, np.arange(256), 'right') - 1, 0, nb - 1)
+
+    def __len__(self):
+        return int(self.open_counts.sum() + self.close_counts.sum())
+
+    def __str__(self):
+        return 'ThresholdEngine of %d frames, %d x %d buckets (%d with own threshold)' % (
+            len(self), self.table.shape[0], self.table.shape[1], (self.source == 'bucket').sum())
+
+    def bucket(self, hour, brightness):
+        """return 2-tuple (hour bin, brightness bin) for frame taken at hour with scene brightness"""
+        return self._hour_bin[hour], self._bright_bin[min(255, max(0, int(brightness)))]
+
+    def threshold(self, hour, brightness):
+        """return float median threshold (door open below it) for frame taken at hour with scene brightness"""
+        return self.table[self.bucket(hour, brightness)]
+
+    def classify(self, median, hour, brightness):
+        """return open or close verdict for roi median of frame taken at hour with scene brightness"""
+        if median < self.threshold(hour, brightness):
+            return 'open'
+        return 'close'
+
+    def recalibrate(self):
+        """recompute threshold table from counts (cost depends on number of buckets, not of frames)"""
+        nh, nb = self.table.shape
+        opens, closes = self.open_counts, self.close_counts
+
+        def enough(o, c):
+            return (o.sum(axis=-1) >= self.min_count) & (c.sum(axis=-1) >= self.min_count)
+
+        own, _ = best_thresholds(opens.reshape(nh * nb, NBINS), closes.reshape(nh * nb, NBINS))
+        hourly, _ = best_thresholds(opens.sum(axis=1), closes.sum(axis=1))
+        overall, _ = best_thresholds(opens.sum(axis=(0, 1))[None], closes.sum(axis=(0, 1))[None])
+        table = np.full((nh, nb), MEDIAN_THRESHOLD)
+        source = np.full((nh, nb), 'fixed', dtype='S6')
+        if enough(opens.sum(axis=(0, 1)), closes.sum(axis=(0, 1))):
+            table[:], source[:] = overall[0], 'all'
+        hour_ok = enough(opens.sum(axis=1), closes.sum(axis=1))
+        table[hour_ok], source[hour_ok] = hourly[hour_ok][:, None], 'hour'
+        own_ok = enough(opens, closes)
+        table[own_ok], source[own_ok] = own.reshape(nh, nb)[own_ok], 'bucket'
+        self.table, self.source = table, source  # swap in whole, so lookups never see a half-built table
+
+    def add(self, median, state, hour, brightness, key=None, recalibrate=True):
+        """Count one labelled frame.
+
+        Returns True if counted; False if state is not open or close, or a frame with key was already counted.
+
+        """
+        if state not in ('open', 'close'):
+            return False
+        with self._lock:
+            if key is not None:
+                if key in self.seen:
+                    return False
+                self.seen.add(key)
+            counts = self.open_counts if state == 'open' else self.close_counts
+            counts[self.bucket(hour, brightness) + (int(round(2 * median)),)] += 1
+            if recalibrate:
+                self.recalibrate()
+        return True
+
+    def add_frame(self, fci):
+        """count FoscamImage, fci by the state in its filename (see add); returns True if counted"""
+        f = threshold_features(fci)
+        return self.add(f['median'], f['state'], f['hour'], f['brightness'], key=f['bname'])
+
+    def add_many(self, frames):
+        """Count labelled frames (like rows of threshold_features) in one pass, then recalibrate once.
+
+        Returns int number of frames counted.
+
+        """
+        df = frames[frames['state'].isin(['open', 'close'])]
+        with self._lock:
+            if 'bname' in df:
+                df = df[~df['bname'].isin(self.seen)].drop_duplicates('bname')
+                self.seen.update(df['bname'])
+            hbin = self._hour_bin[df['hour'].values.astype(int)]
+            bbin = self._bright_bin[np.clip(df['brightness'].values.astype(int), 0, 255)]
+            mbin = np.round(2 * df['median'].values).astype(int)
+            is_open = (df['state'] == 'open').values
+            np.add.at(self.open_counts, (hbin[is_open], bbin[is_open], mbin[is_open]), 1)
+            np.add.at(self.close_counts, (hbin[~is_open], bbin[~is_open], mbin[~is_open]), 1)
+            self.recalibrate()
+        return len(df)
+
+    def save(self):
+        """write counts to filename via temp file and rename"""
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(prefix='.tmp_', suffix='.npz', dir=dirname)
+        with self._lock:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, hour_width=self.hour_width, brightness_edges=np.array(self.brightness_edges),
+                         open_counts=self.open_counts, close_counts=self.close_counts,
+                         seen=np.array(sorted(self.seen), dtype=str))
+        os.chmod(tmp, 0644)
+        os.rename(tmp, self.filename)
+
+    def report(self, frames):
+        """Compare accuracy of learned thresholds with fixed MEDIAN_THRESHOLD on labelled frames.
+
+        Returns pandas.DataFrame indexed by hour bin (like 06-08) plus an all row, with frame count, errors and
+        accuracy for the fixed and the learned thresholds.
+
+        """
+        df = frames[frames['state'].isin(['open', 'close'])].copy()
+        df['fixed'] = np.where(df['median'] < MEDIAN_THRESHOLD, 'open', 'close')
+        df['learned'] = [self.classify(m, h, b) for m, h, b in zip(df['median'], df['hour'], df['brightness'])]
+        df['fixed_errors'] = df['fixed'] != df['state']
+        df['learned_errors'] = df['learned'] != df['state']
+        w = self.hour_width
+        df['hours'] = ['%02d-%02d' % (h // w * w, min(23, h // w * w + w - 1)) for h in df['hour']]
+        rows = df.groupby('hours')[['fixed_errors', 'learned_errors']].sum().astype(int)
+        rows.loc['all'] = rows.sum()
+        rows.insert(0, 'frames', df.groupby('hours').size().append(pd.Series({'all': len(df)})))
+        rows['fixed_accuracy'] = 1.0 - rows['fixed_errors'] / rows['frames'].astype(float)
+        rows['learned_accuracy'] = 1.0 - rows['learned_errors'] / rows['frames'].astype(float)
+        return rows
+
+
+if __name__ == '__main__':
+
+    import sys
+    from deck import Deck, map_images
+
+    deck = Deck(date_range=sys.argv[1:3], morning=False)
+    frames = pd.DataFrame(map_images(threshold_features, deck.filenames, tmp_name=deck.tmp_name))
+    days = sorted(set(d.date() for d in frames['dtm']))
+    split = days[int(0.7 * len(days))]
+    train = frames[[d.date() < split for d in frames['dtm']]]
+    engine = ThresholdEngine(filename='/tmp/thresholds.npz', load=False)
+    print 'learned from %d frames before %s: %s' % (engine.add_many(train), split, engine)
+    print engine.report(frames[[d.date() >= split for d in frames['dtm']]])
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""Lightweight stage-level tracing for the snapshot-to-verdict pipeline.
+
+This module provides a process-wide registry of sinks and a span context manager that times a block of work
+and emits an event (a dict with name, sec and any extra fields like img, hit or bytes) to every registered
+sink. With no sinks registered, spans and emits cost next to nothing, so instrumentation stays in place.
+
+Instrumented now: each FoscamImage stage (computed or served from cache), JPEG decoding (input bytes and
+decoded pixels), AnalysisResults.compute and, in the socket server, the camera fetch and whole callback.
+
+Example:
+    Send per-stage timings to the server log and to a Prometheus textfile-collector file::
+
+        import tracing
+        from pims.files.log import my_logger
+        tracing.add_sink(tracing.LoggerSink(my_logger('trace')))
+        tracing.add_sink(tracing.PrometheusSink('/var/lib/node_exporter/fauxmo_garage.prom'))
+
+"""
+
+import os
+import sys
+import csv
+import time
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+_SINKS = []  # callables that each take one event dict
+_SINKS_LOCK = threading.Lock()
+
+
+def add_sink(sink):
+    """register sink, a callable that takes one event dict; returns sink"""
+    with _SINKS_LOCK:
+        _SINKS.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    with _SINKS_LOCK:
+        if sink in _SINKS:
+            _SINKS.remove(sink)
+
+
+def clear_sinks():
+    with _SINKS_LOCK:
+        del _SINKS[:]
+
+
+def enabled():
+    """return True if any sink is registered (use to skip gathering extra fields that cost something)"""
+    return bool(_SINKS)
+
+
+def emit(name, sec=None, **fields):
+    """send event with name, duration sec and extra fields to every registered sink"""
+    if not _SINKS:
+        return
+    event = dict(fields)
+    event['name'] = name
+    event['sec'] = sec
+    event['when'] = time.time()
+    event['thread'] = threading.current_thread().name
+    for sink in list(_SINKS):
+        try:
+            sink(event)
+        except Exception, e:
+            # a broken sink must never break the analysis it is watching
+            sys.stderr.write('tracing sink %r failed: %s\n' % (sink, e))
+
+
+@contextmanager
+def span(name, **fields):
+    """Time the with-block and emit it as event name; yields the fields dict so the block can add to it.
+
+    Example::
+
+        with tracing.span('decode', mode=mode) as ev:
+            img = ...
+            ev['bytes'] = len(data)
+
+    """
+    if not _SINKS:
+        yield fields
+        return
+    t1 = time.time()
+    try:
+        yield fields
+    finally:
+        emit(name, sec=time.time() - t1, **fields)
+
+
+def format_event(event):
+    """return one-line string for event like: fcimage.lab 8.1 ms img=2017-11-10_06_06_open.jpg hit=False"""
+    if event['sec'] is None:
+        s = event['name']
+    else:
+        s = '%s %.1f ms' % (event['name'], 1000.0 * event['sec'])
+    extras = sorted((k, v) for k, v in event.items() if k not in ('name', 'sec', 'when', 'thread'))
+    return ' '.join([s] + ['%s=%s' % (k, v) for k, v in extras])
+
+
+class LoggerSink(object):
+
+    """A sink that logs each event as one line (see format_event) to a logging.Logger, like from pims my_logger.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, logger, level=logging.INFO, hits=False):
+        self.logger = logger  #: logging.Logger: where events get logged
+        self.level = level    #: int: logging level for events
+        self.hits = hits      #: bool: True to also log cache hits (there are many)
+
+    def __call__(self, event):
+        if event.get('hit') and not self.hits:
+            return
+        self.logger.log(self.level, format_event(event))
+
+
+class CsvSink(object):
+
+    """A sink that appends each event as a row of a CSV file (header is written when file is new).
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    FIELDS = ('when', 'thread', 'name', 'sec', 'hit', 'img', 'bytes', 'pixels')
+
+    def __init__(self, filename, fields=FIELDS):
+        self.filename = filename  #: str: full path to CSV file
+        self.fields = fields      #: tuple: event keys written as columns (in this order)
+        self._lock = threading.Lock()
+        is_new = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self._file = open(filename, 'ab')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fields, extrasaction='ignore')
+        if is_new:
+            self._writer.writeheader()
+
+    def __call__(self, event):
+        with self._lock:
+            self._writer.writerow(event)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class PrometheusSink(object):
+
+    """A sink that keeps per-event-name totals and periodically rewrites a Prometheus text-format file.
+
+    The file is replaced atomically (write temp file, then rename), so a local scraper like the node_exporter
+    textfile collector never reads a partial file.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    PREFIX = 'fauxmo_garage'
+
+    def __init__(self, filename, interval=5.0):
+        self.filename = filename  #: str: full path to .prom output file
+        self.interval = interval  #: float: minimum seconds between rewrites of file (0 to write on every event)
+        self.totals = dict()      #: dict: name -> dict of count, sec, max_sec, hits, bytes, pixels
+        self._written = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            t = self.totals.setdefault(event['name'], dict.fromkeys(['count', 'sec', 'max_sec', 'hits', 'bytes',
+                                                                     'pixels'], 0))
+            if event.get('hit'):
+                t['hits'] += 1
+            else:
+                t['count'] += 1
+                if event['sec'] is not None:
+                    t['sec'] += event['sec']
+                    t['max_sec'] = max(t['max_sec'], event['sec'])
+            t['bytes'] += event.get('bytes') or 0
+            t['pixels'] += event.get('pixels') or 0
+            due = event['when'] - self._written >= self.interval
+        if due:
+            self.flush()
+
+    def render(self):
+        """return string of metrics in Prometheus text exposition format"""
+        p = self.PREFIX
+        metrics = [
+            ('stage_seconds_total', 'counter', 'seconds spent computing stage', 'sec'),
+            ('stage_calls_total', 'counter', 'times stage was computed', 'count'),
+            ('stage_max_seconds', 'gauge', 'longest single computation of stage', 'max_sec'),
+            ('stage_cache_hits_total', 'counter', 'times stage was served from cache', 'hits'),
+            ('stage_bytes_total', 'counter', 'input bytes (like JPEG bytes decoded) for stage', 'bytes'),
+            ('stage_pixels_total', 'counter', 'output pixels (like decoded image size) for stage', 'pixels'),
+        ]
+        with self._lock:
+            totals = dict((name, dict(t)) for name, t in self.totals.items())
+        lines = []
+        for metric, kind, help_text, key in metrics:
+            lines.append('# HELP %s_%s %s' % (p, metric, help_text))
+            lines.append('# TYPE %s_%s %s' % (p, metric, kind))
+            for name in sorted(totals):
+                lines.append('%s_%s{stage="%s"} %s' % (p, metric, name, repr(totals[name][key])))
+        return '\n'.join(lines) + '\n'
+
+    def flush(self):
+        """atomically rewrite output file with current totals"""
+        text = self.render()
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(prefix='.tmp_', suffix='.prom', dir=dirname)
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(tmp, 0644)
+        os.rename(tmp, self.filename)
+        self._written = time.time()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""Watch the snapshot folder and classify each new snapshot as soon as it is fully written.
+
+This module provides a long-running watcher that keeps the template and processing chain warm in one
+process, classifies each new snapshot (open or close) the moment it lands, and publishes the latest verdict
+as a small JSON file (replaced atomically), so answering "is the door open?" is just reading that file.
+
+New files are noticed via inotify (Linux, through ctypes) on close-after-write or rename-into-folder; where
+inotify is not available, the folder is polled and a file counts as fully written once its size holds steady
+between polls and it ends with the JPEG end-of-image marker. Either way, a file that does not yet end with that
+marker (a writer that closes and reopens it, say) is held back and retried for up to settle_sec, and a file that
+still fails to classify is logged and skipped rather than stopping the watcher.
+
+Example:
+    Watch the default folder and publish verdicts to the default verdict file::
+
+        $ python watcher.py
+
+"""
+
+import os
+import re
+import json
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import datetime
+import tempfile
+import numpy as np
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir  # python 2 backport (pip install scandir)
+
+import tracing
+from fcimage import FoscamImage
+from template import as_template_image
+from flimsy_constants import DEFAULT_FOLDER, DEFAULT_TEMPLATE, DEFAULT_VERDICT_FILE, MEDIAN_THRESHOLD
+
+#: snapshot names to classify, like 2017-11-20_06_25_close.jpg or 2017-11-20_06_25_unknown.jpg (from FoscamSnap)
+WATCH_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}_\d{2}_\d{2}_\w+\.jpg$')
+
+# from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = 0x00000800
+_IN_CLOEXEC = 0x00080000
+_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len (name follows, NUL padded to len)
+
+
+class InotifySource(object):
+
+    """New-file source for a folder via Linux inotify (close-after-write and rename-into-folder events).
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, topdir):
+        self.topdir = topdir  #: str: folder being watched
+        libname = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify not available in %s' % libname)
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        wd = libc.inotify_add_watch(self._fd, topdir, _IN_CLOSE_WRITE | _IN_MOVED_TO)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(err, 'inotify_add_watch failed for %s' % topdir)
+
+    def wait(self, timeout=1.0):
+        """return list of basenames of files that were fully written within timeout seconds (maybe empty)"""
+        readable, w, x = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        names = []
+        i = 0
+        while i + _EVENT_HEADER.size <= len(buf):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, i)
+            i += _EVENT_HEADER.size
+            names.append(buf[i:i + length].rstrip('\0'))
+            i += length
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingSource(object):
+
+    """New-file source for a folder via polling; a file is ready once its size is steady and it ends like a JPEG.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, topdir, interval=0.5):
+        self.topdir = topdir      #: str: folder being watched
+        self.interval = interval  #: float: seconds between polls
+        self._done = set(e.name for e in scandir(topdir))  # files already there when we start are not new
+        self._sizes = dict()      # name -> size at last poll, for files not yet ready
+
+    def wait(self, timeout=1.0):
+        """return list of basenames of files that became fully written, polling for up to timeout seconds"""
+        stop = time.time() + timeout
+        while True:
+            ready = self._poll()
+            if ready or time.time() + self.interval > stop:
+                return ready
+            time.sleep(self.interval)
+
+    def _poll(self):
+        ready = []
+        sizes = dict()
+        for entry in scandir(self.topdir):
+            if entry.name in self._done or not entry.is_file():
+                continue
+            size = entry.stat().st_size
+            if size and self._sizes.get(entry.name) == size and _ends_like_jpeg(entry.path):
+                ready.append(entry.name)
+                self._done.add(entry.name)
+            else:
+                sizes[entry.name] = size
+        self._sizes = sizes
+        return sorted(ready)
+
+    def close(self):
+        pass
+
+
+def _ends_like_jpeg(fname):
+    """return True if file ends with JPEG end-of-image marker (FF D9)"""
+    try:
+        with open(fname, 'rb') as f:
+            f.seek(-2, os.SEEK_END)
+            return f.read(2) == '\xff\xd9'
+    except IOError:
+        return False
+
+
+def make_source(topdir, poll_interval=0.5):
+    """return InotifySource for topdir if this platform has inotify; otherwise PollingSource"""
+    try:
+        return InotifySource(topdir)
+    except (OSError, AttributeError):
+        return PollingSource(topdir, interval=poll_interval)
+
+
+def write_json_atomic(obj, fname):
+    """write obj as JSON to fname via temp file and rename, so readers never see a partial file"""
+    dirname = os.path.dirname(os.path.abspath(fname))
+    fd, tmp = tempfile.mkstemp(prefix='.tmp_', suffix='.json', dir=dirname)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(obj, f, sort_keys=True)
+    os.chmod(tmp, 0644)
+    os.rename(tmp, fname)
+
+
+def read_latest_verdict(fname=DEFAULT_VERDICT_FILE):
+    """return dict of latest verdict published by a Watcher (see Watcher.classify); None if there is none yet"""
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except IOError:
+        return None
+
+
+class Watcher(object):
+
+    """Classify each new snapshot in a folder with a warm processing chain and publish the latest verdict.
+
+    Attributes are documented inline with the attribute's declaration (see __init__ method below).
+
+    """
+
+    def __init__(self, topdir=DEFAULT_FOLDER, tmp_name=DEFAULT_TEMPLATE, verdict_file=DEFAULT_VERDICT_FILE,
+                 decode='rows', source=None, settle_sec=10.0, logger=None):
+        self.topdir = topdir              #: str: folder where snapshots land
+        self.tmp_name = tmp_name          #: str: full filename of template image
+        self.verdict_file = verdict_file  #: str: full filename where latest verdict gets published (JSON)
+        self.decode = decode              #: str: JPEG decode mode (see decoder.DECODE_MODES)
+        self.source = source or make_source(topdir)  #: InotifySource or PollingSource of new file names
+        self.latest = None                #: dict: most recent verdict (see classify)
+        self.count = 0                    #: int: snapshots classified so far
+        self.errors = 0                   #: int: snapshots skipped because they could not be classified
+        self.settle_sec = settle_sec      #: float: seconds to keep retrying a file that is not fully written yet
+        self.logger = logger              #: logging.Logger: for skipped snapshots; None to stay quiet
+        self._pending = dict()            # basename -> time.time() first seen, for files not fully written yet
+        as_template_image(self.tmp_name)  # warm the template registry before the first snapshot lands
+
+    def __str__(self):
+        return 'Watcher of %s via %s (%d classified)' % (self.topdir, self.source.__class__.__name__, self.count)
+
+    def classify(self, fname):
+        """Classify snapshot file and publish the verdict.
+
+        Returns dict with img, dtm, verdict (open or close), median, elapsed_sec and when (classified).
+
+        """
+        t1 = time.time()
+        with tracing.span('watcher.classify', img=os.path.basename(fname)):
+            fci = FoscamImage(fname, template=self.tmp_name, roi_only=True, decode=self.decode)
+            med = float(np.median(fci.roi_luminance))
+        if med < MEDIAN_THRESHOLD:
+            verdict = 'open'
+        else:
+            verdict = 'close'
+        dtm = fci.foscam_file.dtm
+        self.latest = {
+            'img': fname,
+            'dtm': dtm.isoformat() if dtm else None,
+            'verdict': verdict,
+            'median': med,
+            'elapsed_sec': time.time() - t1,
+            'when': datetime.datetime.now().isoformat(),
+        }
+        write_json_atomic(self.latest, self.verdict_file)
+        self.count += 1
+        return self.latest
+
+    def _skip(self, name, why):
+        self.errors += 1
+        if self.logger:
+            self.logger.warning('watcher skipped %s: %s' % (name, why))
+
+    def step(self, timeout=1.0):
+        """wait up to timeout seconds for new snapshots and classify them; returns list of their verdicts"""
+        verdicts = []
+        names = self.source.wait(timeout)
+        names += [n for n in sorted(self._pending) if n not in names]  # retry those not fully written before
+        for name in names:
+            if not WATCH_PATTERN.match(name):
+                continue
+            fname = os.path.join(self.topdir, name)
+            if not _ends_like_jpeg(fname):
+                first = self._pending.setdefault(name, time.time())
+                if time.time() - first >= self.settle_sec:
+                    del self._pending[name]
+                    self._skip(name, 'no JPEG end-of-image marker after %.1f sec' % self.settle_sec)
+                continue
+            self._pending.pop(name, None)
+            try:
+                verdicts.append(self.classify(fname))
+            except Exception, e:
+                self._skip(name, e)
+        return verdicts
+
+    def run(self, stop=None, timeout=1.0):
+        """classify snapshots as they land until stop (like threading.Event) is set or KeyboardInterrupt"""
+        try:
+            while stop is None or not stop.is_set():
+                self.step(timeout)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.source.close()
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    topdir = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FOLDER
+    w = Watcher(topdir=topdir)
+    print '%s publishing to %s' % (w, w.verdict_file)
+    w.run()